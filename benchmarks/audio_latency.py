@@ -0,0 +1,129 @@
+"""
+Latency of the audio reactive patterns (see led_control_v2/audio.py), without audio hardware.
+
+    python -m benchmarks.audio_latency
+    python -m benchmarks.audio_latency --block-size 256 --fft-size 1024 --fps 120
+
+Writes a WAV file of kick drums at known times over quiet noise, plays it through the same analyzer the render
+loop uses and renders SpectrumBars and BeatPulse frames at --fps. Reports how long it took from a sample being
+recorded to a frame using it, how late each kick was detected and how long analysing a block took.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import wave
+from typing import List
+
+import numpy as np
+
+from led_control_v2 import audio
+from led_control_v2.pattern import BeatPulse, ColorPattern, SpectrumBars
+from led_strip.color import Color
+
+SAMPLE_RATE = 44100
+
+
+def write_kicks(path: str, duration: float, interval: float) -> List[float]:
+    """
+    Writes a stereo 16 bit WAV file with a kick every interval seconds, returns the times of the kicks
+    """
+    rng = np.random.default_rng(0)
+    samples = rng.normal(0, 0.01, int(duration * SAMPLE_RATE))
+    kick_length = int(0.15 * SAMPLE_RATE)
+    t = np.arange(kick_length) / SAMPLE_RATE
+    # A sine dropping from 120 Hz to 50 Hz, dying out quickly
+    kick = np.sin(2 * np.pi * (50 * t + 70 * 0.03 * (1 - np.exp(-t / 0.03)))) * np.exp(-t / 0.05) * 0.8
+    # The beat detector needs a second of history first
+    onsets = list(np.arange(1, duration - 0.2, interval))
+    for onset in onsets:
+        start = int(onset * SAMPLE_RATE)
+        samples[start:start + kick_length] += kick
+
+    pcm = (np.clip(samples, -1, 1) * 32767).astype('<i2')
+    with wave.open(path, 'wb') as wav:
+        wav.setnchannels(2)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(np.repeat(pcm, 2).tobytes())
+    return onsets
+
+
+class _Recorder:
+    """
+    Collects what the analyzer would send to the frame profiler
+    """
+
+    def __init__(self):
+        self.seconds: List[float] = []
+
+    def record(self, metric: str, label: str, seconds: float):
+        self.seconds.append(seconds)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Measure audio analysis and sample to frame latency')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between kicks')
+    parser.add_argument('--fps', type=float, default=60)
+    parser.add_argument('--leds', type=int, default=300)
+    parser.add_argument('--block-size', type=int, default=512)
+    parser.add_argument('--fft-size', type=int, default=2048)
+    parser.add_argument('--bands', type=int, default=16)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(tempfile.mkdtemp(), 'kicks.wav')
+    onsets = write_kicks(path, args.duration, args.interval)
+
+    recorder = _Recorder()
+    analyzer = audio.start_audio('wav', path, SAMPLE_RATE, 2, args.block_size, args.fft_size, args.bands, 40, 16000,
+                                 40, recorder)
+    patterns = [SpectrumBars(ColorPattern(Color(0, 128, 255))), BeatPulse(ColorPattern(Color(255, 255, 255)))]
+
+    latencies = []
+    beats = set()
+    frame_time = 1 / args.fps
+    next_frame = time.monotonic()
+    end_time = next_frame + args.duration
+    try:
+        while time.monotonic() < end_time:
+            for pattern in patterns:
+                pattern.render_frame(0, args.leds)
+                pattern.after_update()
+            sample_time = analyzer.analysis.take_consumed()
+            if sample_time is not None:
+                latencies.append(time.monotonic() - sample_time)
+            beats.add(audio.latest().beat_time)
+
+            next_frame += frame_time
+            time.sleep(max(0.0, next_frame - time.monotonic()))
+        start_time = analyzer.source.start_time
+    finally:
+        analyzer.close()
+        os.remove(path)
+
+    # When a kick was detected, relative to when its first sample was recorded
+    detected = np.array(sorted(beat - start_time for beat in beats if np.isfinite(beat)))
+    delays = []
+    for onset in onsets:
+        matches = detected[(detected >= onset) & (detected < onset + args.interval / 2)]
+        if len(matches):
+            delays.append(matches[0] - onset)
+    found, false_beats = len(delays), len(detected) - len(delays)
+
+    latencies = np.array(latencies) * 1000
+    delays = np.array(delays or [np.nan]) * 1000
+    analysis = np.array(recorder.seconds) * 1000
+    print(f'{args.block_size} sample blocks, {args.fft_size} point FFT, {args.bands} bands, {args.fps:g} fps')
+    print(f'{"":<18}{"p50 ms":>10}{"p99 ms":>10}{"max ms":>10}')
+    for name, values in (('sample to frame', latencies), ('beat detection', delays), ('analysis', analysis)):
+        print(f'{name:<18}{np.percentile(values, 50):>10.3f}{np.percentile(values, 99):>10.3f}'
+              f'{np.max(values):>10.3f}')
+    print(f'{found}/{len(onsets)} kicks detected, {false_beats} false beats')
+
+    return 0 if found == len(onsets) and false_beats == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
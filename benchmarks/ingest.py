@@ -0,0 +1,100 @@
+"""
+Packet generator for the UDP frame ingest (see led_control_v2/ingest.py).
+
+    python -m benchmarks.ingest                                   # loopback test against a local UdpIngest
+    python -m benchmarks.ingest --target 192.168.1.20 --fps 60    # drive a running server with a moving rainbow
+
+In loopback mode it checks that every frame arrives intact and reports how long frames took from the first packet
+being sent to the frame being available to the render loop.
+"""
+import argparse
+import colorsys
+import socket
+import sys
+import time
+from typing import Iterator, List
+
+import numpy as np
+
+from led_control_v2.config import LED_COUNT
+from led_control_v2.ingest import create_ingest, ddp_packets, e131_packets, ingest_protocols
+from led_control_v2.preview import frame_to_rgb_bytes
+
+
+def rainbow_frames(leds: int) -> Iterator[bytes]:
+    hues = np.arange(leds) / leds
+    colors = np.array([colorsys.hsv_to_rgb(hue, 1, 1) for hue in hues])
+    rgb = (colors * 255).astype(np.uint8)
+    offset = 0
+    while True:
+        yield np.roll(rgb, offset, axis=0).tobytes()
+        offset += 1
+
+
+def packets_for(protocol: str, rgb: bytes, sequence: int) -> List[bytes]:
+    if protocol == 'ddp':
+        return list(ddp_packets(rgb, sequence))
+    return list(e131_packets(rgb, sequence=sequence))
+
+
+def send(protocol: str, host: str, port: int, leds: int, fps: float, frames: int):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    period = 1 / fps
+    deadline = time.monotonic()
+
+    for sequence, rgb in zip(range(frames), rainbow_frames(leds)):
+        for packet in packets_for(protocol, rgb, sequence):
+            sock.sendto(packet, (host, port))
+        deadline += period
+        time.sleep(max(0.0, deadline - time.monotonic()))
+
+
+def loopback(protocol: str, leds: int, frames: int) -> int:
+    ingest = create_ingest(protocol, leds, 0, timeout=1, host='127.0.0.1')
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    latencies = []
+    corrupted = 0
+
+    for sequence, rgb in zip(range(frames), rainbow_frames(leds)):
+        start_time = time.perf_counter()
+        for packet in packets_for(protocol, rgb, sequence):
+            sock.sendto(packet, ('127.0.0.1', ingest.port))
+
+        while ingest.frames_received <= sequence:
+            if time.perf_counter() - start_time > 1:
+                print(f'Frame {sequence} never arrived')
+                return 1
+            time.sleep(0)
+
+        frame = ingest.frame()
+        latencies.append(time.perf_counter() - start_time)
+        if frame_to_rgb_bytes(frame) != rgb:
+            corrupted += 1
+
+    ingest.close()
+    latencies = np.array(latencies) * 1000
+    print(f'{protocol}: {frames} frames of {leds} LEDs, p50 {np.percentile(latencies, 50):.3f} ms, '
+          f'p99 {np.percentile(latencies, 99):.3f} ms, {corrupted} corrupted')
+    return 1 if corrupted else 0
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Generate DDP / E1.31 frames')
+    parser.add_argument('--protocol', default='ddp', choices=list(ingest_protocols))
+    parser.add_argument('--target', help='host to send to, runs a local loopback test if not given')
+    parser.add_argument('--port', type=int)
+    parser.add_argument('--leds', type=int, default=LED_COUNT)
+    parser.add_argument('--fps', type=float, default=60)
+    parser.add_argument('--frames', type=int, default=600)
+    args = parser.parse_args(argv)
+
+    if args.target is None:
+        return loopback(args.protocol, args.leds, args.frames)
+
+    port = args.port if args.port is not None else ingest_protocols[args.protocol].default_port
+    send(args.protocol, args.target, port, args.leds, args.fps, args.frames)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
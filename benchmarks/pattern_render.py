@@ -0,0 +1,142 @@
+"""
+Renders every pattern in pattern_constructors for a number of frames at a few strip sizes and reports frame times
+against the 1 / REFRESH_RATE_TARGET_HZ budget.
+
+    python -m benchmarks.pattern_render --leds 300 900 3000 --frames 600
+    python -m benchmarks.pattern_render --save-baseline     # on the machine the baseline is for
+    python -m benchmarks.pattern_render                     # exits with 1 if anything got slower than the baseline
+
+Runs without hardware: frames go into a MemorySink instead of a strip.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from led_control_v2.compile import compile_pattern
+from led_control_v2.config import pattern_constructors, INITIAL_PROGRESS, INITIAL_PROGRESS_INCREMENT, \
+    REFRESH_RATE_TARGET_HZ, COMPILE_PATTERNS
+from led_strip.frame_sink import MemorySink
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'pattern_render_baseline.json')
+WARMUP_FRAMES = 10
+
+
+class BenchmarkResult:
+    def __init__(self, pattern: str, leds: int, frame_times: np.ndarray):
+        self.pattern = pattern
+        self.leds = leds
+        self.p50 = float(np.percentile(frame_times, 50))
+        self.p99 = float(np.percentile(frame_times, 99))
+
+    @property
+    def key(self) -> str:
+        return f'{self.pattern}@{self.leds}'
+
+    def to_json(self) -> Dict[str, float]:
+        return {'p50': self.p50, 'p99': self.p99}
+
+
+def run_benchmark(pattern_name: str, leds: int, frames: int,
+                  progress_increment: float = INITIAL_PROGRESS_INCREMENT,
+                  compile_patterns: bool = COMPILE_PATTERNS) -> BenchmarkResult:
+    pattern = pattern_constructors[pattern_name]()
+    if compile_patterns:
+        pattern = compile_pattern(pattern)
+    sink = MemorySink(leds)
+    progress = INITIAL_PROGRESS
+    frame_times = np.zeros(frames)
+
+    for i in range(-WARMUP_FRAMES, frames):
+        start_time = time.perf_counter()
+
+        frame = pattern.render_frame(progress, leds)
+        if frame is not None:
+            sink.write(frame)
+        pattern.after_update()
+        sink.show()
+
+        if i >= 0:
+            frame_times[i] = time.perf_counter() - start_time
+
+        progress += progress_increment
+        progress -= math.trunc(progress)
+
+    return BenchmarkResult(pattern_name, leds, frame_times)
+
+
+def find_regressions(results: List[BenchmarkResult], baseline: Dict[str, Dict[str, float]],
+                     tolerance: float) -> List[str]:
+    regressions = []
+    for result in results:
+        if result.key not in baseline:
+            continue
+        for stat in ('p50', 'p99'):
+            allowed = baseline[result.key][stat] * (1 + tolerance)
+            actual = getattr(result, stat)
+            if actual > allowed:
+                expected = baseline[result.key][stat]
+                regressions.append(f'{result.key} {stat}: {_ms(actual)} ms (baseline {_ms(expected)} ms)')
+    return regressions
+
+
+def _ms(seconds: float) -> str:
+    return f'{seconds * 1000:.3f}'
+
+
+def _print_results(results: List[BenchmarkResult]):
+    budget = 1 / REFRESH_RATE_TARGET_HZ
+    print(f'{"pattern":<24}{"leds":>6}{"p50 ms":>10}{"p99 ms":>10}{"budget ms":>11}  status')
+    for result in results:
+        status = 'ok' if result.p99 <= budget else 'OVER BUDGET'
+        print(f'{result.pattern:<24}{result.leds:>6}{_ms(result.p50):>10}{_ms(result.p99):>10}{_ms(budget):>11}'
+              f'  {status}')
+
+
+def _load_baseline(path: str) -> Optional[Dict[str, Dict[str, float]]]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark pattern rendering')
+    parser.add_argument('--patterns', nargs='+', default=list(pattern_constructors), choices=list(pattern_constructors))
+    parser.add_argument('--leds', nargs='+', type=int, default=[300, 900, 3000])
+    parser.add_argument('--frames', type=int, default=600)
+    parser.add_argument('--no-compile', action='store_true', help='render the pattern trees without compiling them')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='how much slower than the baseline (as a fraction) counts as a regression')
+    args = parser.parse_args(argv)
+
+    results = [run_benchmark(pattern, leds, args.frames, compile_patterns=not args.no_compile)
+               for pattern in args.patterns for leds in args.leds]
+    _print_results(results)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump({result.key: result.to_json() for result in results}, f, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+        return 0
+
+    baseline = _load_baseline(args.baseline)
+    if baseline is None:
+        print(f'No baseline at {args.baseline}, skipping regression check')
+        return 0
+
+    regressions = find_regressions(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION', regression)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
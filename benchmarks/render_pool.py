@@ -0,0 +1,121 @@
+"""
+How frame times scale with the number of render workers, for a large installation split into equal segments that
+all run the same pattern.
+
+    python -m benchmarks.render_pool --leds 8000 --segments 4 --workers 1 2 3 4
+
+'1 worker' here still goes through a RenderPool, so the difference to 'inline' (rendering in the calling process,
+like the render loop does with RENDER_WORKERS = 1) is the cost of the round trip to the workers. Unless the
+pattern draws random colors without a seed it also checks that every worker count ends up with exactly the same
+frame as inline rendering (chases included, they keep their memory in the worker), and exits with 1 if one doesn't.
+"""
+import argparse
+import sys
+import time
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from led_control_v2.compile import compile_pattern
+from led_control_v2.config import pattern_constructors, INITIAL_PROGRESS, INITIAL_PROGRESS_INCREMENT, \
+    REFRESH_RATE_TARGET_HZ
+from led_control_v2.pattern import FullRandomPattern, find_patterns
+from led_control_v2.render_pool import RenderPool
+from led_control_v2.segment import Segment
+from led_strip.frame_buffer import FrameBuffer, Range
+
+WARMUP_FRAMES = 10
+
+
+def split(leds: int, segments: int) -> Dict[str, Range]:
+    bounds = np.linspace(0, leds, segments + 1).astype(int)
+    return {f'segment{i}': (int(bounds[i]), int(bounds[i + 1])) for i in range(segments)}
+
+
+def run_inline(pattern_name: str, leds: int, segments: Dict[str, Range], frames: int) -> Tuple[float, np.ndarray]:
+    buffer = FrameBuffer(leds)
+    parts = [Segment(name, buffer, start, end, INITIAL_PROGRESS, INITIAL_PROGRESS_INCREMENT, 255)
+             for name, (start, end) in segments.items()]
+    for segment in parts:
+        segment.set_pattern(compile_pattern(pattern_constructors[pattern_name]()), INITIAL_PROGRESS)
+
+    def render_frame():
+        for segment in parts:
+            segment.render()
+        buffer.take_dirty()
+        for segment in parts:
+            segment.pattern.after_update()
+            segment.advance(1)
+
+    return _time_frames(frames, render_frame), buffer.pixels.copy()
+
+
+def run_pool(pattern_name: str, leds: int, segments: Dict[str, Range], workers: int,
+             frames: int) -> Tuple[float, np.ndarray]:
+    pool = RenderPool(leds, segments, workers)
+    buffer = FrameBuffer(leds, pool.pixels)
+    parts = [Segment(name, buffer, start, end, INITIAL_PROGRESS, INITIAL_PROGRESS_INCREMENT, 255, pool)
+             for name, (start, end) in segments.items()]
+    for segment in parts:
+        segment.set_pattern(pattern_constructors[pattern_name](), INITIAL_PROGRESS)
+
+    def render_frame():
+        pool.render({segment.name: segment.progress for segment in parts}, buffer)
+        buffer.take_dirty()
+        for segment in parts:
+            segment.advance(1)
+
+    try:
+        return _time_frames(frames, render_frame), buffer.pixels.copy()
+    finally:
+        pool.close()
+
+
+def _time_frames(frames: int, render_frame) -> float:
+    """
+    Returns the median time per frame in seconds
+    """
+    frame_times = np.zeros(frames)
+    for i in range(-WARMUP_FRAMES, frames):
+        start_time = time.perf_counter()
+        render_frame()
+        if i >= 0:
+            frame_times[i] = time.perf_counter() - start_time
+    return float(np.median(frame_times))
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark parallel segment rendering')
+    parser.add_argument('--pattern', default='RGB Chase', choices=list(pattern_constructors))
+    parser.add_argument('--leds', type=int, default=8000)
+    parser.add_argument('--segments', type=int, default=4)
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 3, 4])
+    parser.add_argument('--frames', type=int, default=300)
+    args = parser.parse_args(argv)
+
+    segments = split(args.leds, args.segments)
+    inline_time, inline_frame = run_inline(args.pattern, args.leds, segments, args.frames)
+
+    budget = 1 / REFRESH_RATE_TARGET_HZ
+    print(f'{args.pattern}, {args.leds} LEDs in {args.segments} segments, budget {budget * 1000:.3f} ms')
+    print(f'{"workers":<10}{"p50 ms":>10}{"speedup":>10}  frames')
+    print(f'{"inline":<10}{inline_time * 1000:>10.3f}{1:>10.2f}')
+
+    reproducible = all(pattern.seed is not None
+                       for pattern in find_patterns(pattern_constructors[args.pattern](), FullRandomPattern))
+    mismatched = False
+    for workers in args.workers:
+        pool_time, pool_frame = run_pool(args.pattern, args.leds, segments, workers, args.frames)
+        if reproducible:
+            same = np.array_equal(pool_frame, inline_frame)
+            mismatched |= not same
+            frames = 'same' if same else 'DIFFERENT'
+        else:
+            frames = 'random'
+        print(f'{workers:<10}{pool_time * 1000:>10.3f}{inline_time / pool_time:>10.2f}  {frames}')
+
+    return 1 if mismatched else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
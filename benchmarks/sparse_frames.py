@@ -0,0 +1,91 @@
+"""
+Per-frame cost of sparse patterns, drawing only the pixels that changed versus rendering and uploading whole frames.
+
+    python -m benchmarks.sparse_frames --leds 300 900 3000
+
+Covers 'halloween1' from pattern_constructors and the legacy Halloween2Process / Halloween3Process, all rendering into
+a MemorySink.
+"""
+import argparse
+import math
+import sys
+import time
+from typing import Callable, List
+
+import numpy as np
+
+from led_control.processes import Halloween2Process, Halloween3Process, ProcessContext
+from led_control_v2.config import pattern_constructors, INITIAL_PROGRESS_INCREMENT
+from led_strip.frame_buffer import FrameBuffer
+from led_strip.frame_sink import MemorySink
+from led_strip.strip import VirtualStrip
+
+
+def time_frames(frames: int, render_frame: Callable[[], None]) -> float:
+    """
+    Returns the median time per frame in microseconds
+    """
+    frame_times = np.zeros(frames)
+    for i in range(frames):
+        start_time = time.perf_counter()
+        render_frame()
+        frame_times[i] = time.perf_counter() - start_time
+    return float(np.median(frame_times)) * 1e6
+
+
+def pattern_benchmark(leds: int, frames: int, sparse: bool) -> float:
+    pattern = pattern_constructors['halloween1']()
+    sink = MemorySink(leds)
+    buffer = FrameBuffer(leds)
+    progress = 0
+
+    def render_frame():
+        nonlocal progress
+        if sparse:
+            pattern.render_into(progress, leds, buffer)
+            sink.write_ranges(buffer.pixels, buffer.take_dirty())
+        else:
+            sink.write(pattern.render_frame(progress, leds))
+        pattern.after_update()
+        progress += INITIAL_PROGRESS_INCREMENT
+        progress -= math.trunc(progress)
+
+    return time_frames(frames, render_frame)
+
+
+def process_benchmark(process_class: type, leds: int, frames: int, sparse: bool) -> float:
+    process = process_class()
+    strip = VirtualStrip(leds, history=1)
+    context = ProcessContext(1, leds)
+    sink = MemorySink(leds)
+
+    def render_frame():
+        process.run(strip, context)
+        if sparse:
+            sink.write_ranges(context.frame_buffer.pixels, context.frame_buffer.take_dirty())
+        else:
+            sink.write(context.frame_buffer.pixels)
+
+    return time_frames(frames, render_frame)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Benchmark sparse frame updates')
+    parser.add_argument('--leds', nargs='+', type=int, default=[300, 900, 3000])
+    parser.add_argument('--frames', type=int, default=2000)
+    args = parser.parse_args(argv)
+
+    print(f'{"pattern":<20}{"leds":>6}{"full us":>10}{"sparse us":>11}')
+    for leds in args.leds:
+        benchmarks = [
+            ('halloween1', lambda sparse: pattern_benchmark(leds, args.frames, sparse)),
+            ('Halloween2Process', lambda sparse: process_benchmark(Halloween2Process, leds, args.frames, sparse)),
+            ('Halloween3Process', lambda sparse: process_benchmark(Halloween3Process, leds, args.frames, sparse)),
+        ]
+        for name, benchmark in benchmarks:
+            print(f'{name:<20}{leds:>6}{benchmark(False):>10.1f}{benchmark(True):>11.1f}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
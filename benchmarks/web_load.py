@@ -0,0 +1,164 @@
+"""
+Request throughput and latency with many concurrent clients, for several web server workers sharing one render
+daemon (see led_control_v2/daemon.py and wsgi.py).
+
+    LED_STRIP_BACKEND=virtual python -m benchmarks.web_load --processes 1 2 4 --threads 8
+    python -m benchmarks.web_load --url http://127.0.0.1:5000 --processes 1 2 4 --threads 8
+
+Without --url it starts its own daemon and every client process connects to it the way a web server worker does,
+which measures the command bus and the render loop without HTTP in the way. With --url it sends HTTP requests to a
+running server instead, e.g. gunicorn serving wsgi:app. Either way each client process stands in for one web server
+worker with --threads concurrent requests, and a --reads fraction of the requests are reads answered from shared
+memory instead of commands that wait for the render loop.
+"""
+import argparse
+import os
+import random
+import signal
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from multiprocessing import Process, Queue
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from led_control_v2.command import CommandResponse, SetBrightnessCommand
+from led_control_v2.config import MAX_COMMANDS_PER_FRAME, REFRESH_RATE_TARGET_HZ
+from led_control_v2.daemon import connect_to_daemon, run_daemon
+from led_control_v2.state import StateSnapshot
+
+
+def start_daemon(address: str) -> Process:
+    daemon = Process(target=run_daemon, args=(address, None))
+    daemon.start()
+    deadline = time.monotonic() + 10
+    while not os.path.exists(address):
+        if time.monotonic() > deadline or not daemon.is_alive():
+            raise RuntimeError('The render daemon didn\'t start')
+        time.sleep(0.05)
+    return daemon
+
+
+def stop_daemon(daemon: Process):
+    os.kill(daemon.pid, signal.SIGINT)
+    daemon.join(10)
+
+
+def bus_requests(address: str) -> Tuple[Callable[[], bool], Callable[[], bool]]:
+    """
+    (write, read) for a client process talking to the daemon directly, each returns whether it succeeded
+    """
+    channel, snapshot, _, _ = connect_to_daemon(address, None)
+
+    def write() -> bool:
+        command = SetBrightnessCommand(random.randint(1, 255))
+        return channel.send(command).status == CommandResponse.Status.OK
+
+    def read() -> bool:
+        snapshot.read()[StateSnapshot.segment_field('brightness', snapshot.segments[0])]
+        return True
+
+    return write, read
+
+
+def http_requests(url: str) -> Tuple[Callable[[], bool], Callable[[], bool]]:
+    def send(request: urllib.request.Request) -> bool:
+        try:
+            with urllib.request.urlopen(request, timeout=10) as response:
+                response.read()
+                return response.status == 200
+        except OSError:
+            return False
+
+    def write() -> bool:
+        return send(urllib.request.Request(f'{url}/set_value/brightness?value={random.randint(1, 255)}',
+                                           method='PUT'))
+
+    def read() -> bool:
+        return send(urllib.request.Request(f'{url}/get_value/brightness'))
+
+    return write, read
+
+
+def client_process(address: str, url: Optional[str], threads: int, duration: float, reads: float, results: Queue):
+    write, read = http_requests(url) if url is not None else bus_requests(address)
+    latencies: List[float] = []
+    failures = [0]
+    lock = threading.Lock()
+
+    def client():
+        own_latencies = []
+        own_failures = 0
+        end_time = time.monotonic() + duration
+        while time.monotonic() < end_time:
+            request = read if random.random() < reads else write
+            start_time = time.perf_counter()
+            if request():
+                own_latencies.append(time.perf_counter() - start_time)
+            else:
+                own_failures += 1
+        with lock:
+            latencies.extend(own_latencies)
+            failures[0] += own_failures
+
+    clients = [threading.Thread(target=client) for _ in range(threads)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    results.put((latencies, failures[0]))
+
+
+def run(address: str, url: Optional[str], processes: int, threads: int, duration: float,
+        reads: float) -> Tuple[float, np.ndarray, int]:
+    """
+    Returns (requests per second, latencies in seconds, failed requests)
+    """
+    results = Queue()
+    clients = [Process(target=client_process, args=(address, url, threads, duration, reads, results))
+               for _ in range(processes)]
+    for process in clients:
+        process.start()
+    outcomes = [results.get() for _ in clients]
+    for process in clients:
+        process.join()
+
+    latencies = np.concatenate([np.array(latencies) for latencies, _ in outcomes])
+    return len(latencies) / duration, latencies, sum(failures for _, failures in outcomes)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Load test the web server and the render daemon')
+    parser.add_argument('--url', help='server to send HTTP requests to, talks to a local daemon if not given')
+    parser.add_argument('--processes', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5)
+    parser.add_argument('--reads', type=float, default=0.5, help='fraction of requests that only read state')
+    args = parser.parse_args(argv)
+
+    address = os.path.join(tempfile.mkdtemp(), 'led-control.sock')
+    daemon = start_daemon(address) if args.url is None else None
+
+    print(f'{args.url or "command bus"}, {args.threads} threads per process, {args.reads:.0%} reads, '
+          f'render loop takes up to {MAX_COMMANDS_PER_FRAME * REFRESH_RATE_TARGET_HZ} commands/s')
+    print(f'{"processes":<10}{"clients":>8}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"failed":>8}')
+    failed = 0
+    try:
+        for processes in args.processes:
+            rate, latencies, failures = run(address, args.url, processes, args.threads, args.duration, args.reads)
+            latencies = latencies * 1000 if len(latencies) else np.zeros(1)
+            print(f'{processes:<10}{processes * args.threads:>8}{rate:>10.0f}{np.percentile(latencies, 50):>10.3f}'
+                  f'{np.percentile(latencies, 99):>10.3f}{failures:>8}')
+            failed += failures
+    finally:
+        if daemon is not None:
+            stop_daemon(daemon)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
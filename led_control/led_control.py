@@ -1,8 +1,9 @@
+import os
 from enum import Enum
 from typing import Tuple, Optional, Dict, Type
 from .processes import *
 
-from rpi_ws281x import PixelStrip
+from led_strip.strip import Strip, create_strip
 
 LED_COUNT = 900
 LED_PIN = 18
@@ -11,6 +12,7 @@ LED_DMA = 10
 LED_BRIGHTNESS = 255
 LED_INVERT = False
 LED_CHANNEL = 0
+LED_BACKEND = os.environ.get('LED_STRIP_BACKEND', 'ws281x')
 
 
 class CommandResponse(Enum):
@@ -31,7 +33,7 @@ no_args_commands = ['halloween1', 'halloween2', 'halloween3']
 set_value_commands = ['set_brightness', 'set_scale_factor']
 
 
-def fade_out(strip: PixelStrip):
+def fade_out(strip: Strip):
     for i in range(strip.getBrightness(), -1, -32):
         strip.setBrightness(i)
         strip.show()
@@ -73,11 +75,12 @@ def process_command(pipe, current_process, wait=False) -> Optional[Process]:
 
 
 def run_control_loop(pipe):
-    strip = PixelStrip(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
+    strip = create_strip(LED_BACKEND, LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
     strip.begin()
     strip.show()
+    sink = strip.frame_sink()
 
-    context = ProcessContext(6)
+    context = ProcessContext(6, strip.numPixels())
 
     current_process: Process = DoNothingProcess()
 
@@ -89,7 +92,8 @@ def run_control_loop(pipe):
                 if not isinstance(current_process, InterruptingProcess):
                     i += 1
                 current_process = current_process.run(strip, context)
-            strip.show()
+            sink.write_ranges(context.frame_buffer.pixels, context.frame_buffer.take_dirty())
+            sink.show()
 
             new_process = process_command(pipe, current_process, wait=current_process.can_wait)
 
@@ -1,4 +1,7 @@
-from rpi_ws281x import Color, PixelStrip
+import numpy as np
+
+from led_strip.color import Color
+from led_strip.strip import Strip
 
 from .process import Process, InterruptingProcess, ProcessContext
 
@@ -7,7 +10,7 @@ class DoNothingProcess(Process):
     def __init__(self):
         super().__init__(True)
 
-    def run(self, strip: PixelStrip, context: ProcessContext) -> Process:
+    def run(self, strip: Strip, context: ProcessContext) -> Process:
         return self
 
 
@@ -17,9 +20,8 @@ class SetColorProcess(Process):
         super().__init__(False)
         self.color = color
 
-    def run(self, strip: PixelStrip, context: ProcessContext) -> Process:
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, self.color)
+    def run(self, strip: Strip, context: ProcessContext) -> Process:
+        context.frame_buffer.update(np.full(len(context.frame_buffer), self.color, dtype=np.uint32))
         return self
 
 
@@ -31,7 +33,7 @@ class SetBrightnessProcess(Process):
     def set_previous_process(self, prev_process: Process):
         self.prev_process = prev_process
 
-    def run(self, strip: PixelStrip, context: ProcessContext) -> Process:
+    def run(self, strip: Strip, context: ProcessContext) -> Process:
         curr_brightness = strip.getBrightness()
         diff = self.value - curr_brightness
         diff = max(-5, min(5, diff))
@@ -44,6 +46,6 @@ class SetScaleFactorProcess(InterruptingProcess):
         super().__init__(False)
         self.value = value
 
-    def run(self, strip: PixelStrip, context: ProcessContext) -> Process:
+    def run(self, strip: Strip, context: ProcessContext) -> Process:
         context.scale_factor = self.value
         return self.prev_process
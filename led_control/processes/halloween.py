@@ -1,6 +1,9 @@
 import time
 
-from rpi_ws281x import Color, PixelStrip
+import numpy as np
+
+from led_strip.color import Color
+from led_strip.strip import Strip
 
 from .process import Process, ProcessContext
 
@@ -14,10 +17,17 @@ class Halloween1Process(Process):
         self.size = 8
         self.offset = 0
         self.wait_ms = 10
-
-    def run(self, strip: PixelStrip, context: ProcessContext) -> Process:
-        for i in range(strip.numPixels()):
-            strip.setPixelColor(i, self.orange if (i + self.offset) % (self.size * 2) < self.size else self.purple)
+        # The stripes repeat every size * 2 offsets, so each frame only has to be built once
+        self.frames = {}
+
+    def run(self, strip: Strip, context: ProcessContext) -> Process:
+        frame = self.frames.get(self.offset)
+        if frame is None or len(frame) != len(context.frame_buffer):
+            indices = np.arange(len(context.frame_buffer))
+            in_orange_stripe = (indices + self.offset) % (self.size * 2) < self.size
+            frame = np.where(in_orange_stripe, self.orange, self.purple).astype(np.uint32)
+            self.frames[self.offset] = frame
+        context.frame_buffer.update(frame)
         time.sleep(self.wait_ms / 1000.0)
 
         self.offset += 1
@@ -35,8 +45,8 @@ class Halloween2Process(Process):
         self.current_color = self.orange
         self.offset = 0
 
-    def run(self, strip: PixelStrip, context: ProcessContext) -> Process:
-        strip.setPixelColor(self.offset, self.current_color)
+    def run(self, strip: Strip, context: ProcessContext) -> Process:
+        context.frame_buffer.set(self.offset, self.current_color)
 
         self.offset += 1
         self.offset %= strip.numPixels()
@@ -61,11 +71,12 @@ class Halloween3Process(Process):
         self.offset = 0
         self.chases = 6
 
-    def run(self, strip: PixelStrip, context: ProcessContext) -> Process:
+    def run(self, strip: Strip, context: ProcessContext) -> Process:
         chase_size = strip.numPixels() / self.chases
 
         for i in range(self.chases):
-            strip.setPixelColor((self.offset + int(i * chase_size)) % strip.numPixels(), self.colors[i % len(self.colors)])
+            index = (self.offset + int(i * chase_size)) % strip.numPixels()
+            context.frame_buffer.set(index, self.colors[i % len(self.colors)])
 
         self.offset += 1
         self.offset %= strip.numPixels()
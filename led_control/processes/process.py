@@ -1,11 +1,14 @@
 import abc
 
-from rpi_ws281x import PixelStrip
+from led_strip.frame_buffer import FrameBuffer
+from led_strip.strip import Strip
 
 
 class ProcessContext:
-    def __init__(self, scale_factor):
+    def __init__(self, scale_factor, num_pixels):
         self.scale_factor = scale_factor
+        # Processes draw into this and the control loop uploads whatever changed before showing
+        self.frame_buffer = FrameBuffer(num_pixels)
 
 
 class Process(abc.ABC):
@@ -13,7 +16,7 @@ class Process(abc.ABC):
         self.can_wait = can_wait
 
     @abc.abstractmethod
-    def run(self, strip: PixelStrip, context: ProcessContext) -> "Process":
+    def run(self, strip: Strip, context: ProcessContext) -> "Process":
         pass
 
 
@@ -1,4 +1,9 @@
 from .led_control import run_control_loop
 from .config import patterns
+from .channel import CommandChannel
+from .state import StateSnapshot
+from .preview import SharedFrameBuffer, frame_to_rgb_bytes
+from .profiling import FrameProfiler
 from .command import (CommandResponse, PatternCommand, SetIncrementCommand, SetBrightnessCommand, SetColorCommand,
-                      GetIncrementCommand, GetBrightnessCommand)
+                      LoadPatternsCommand, BatchCommand)
+from .pattern_definitions import PatternDefinitionError
@@ -0,0 +1,359 @@
+import sys
+import threading
+import time
+import wave
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from .shm import open_shared_memory
+
+_HEADER_FIELDS = 5
+_SEQUENCE = 0
+_SAMPLE_TIME = 1
+_LEVEL = 2
+_BEAT_TIME = 3
+_CONSUMED_SAMPLE_TIME = 4
+
+_BEAT_HISTORY_S = 1.0
+_BEAT_THRESHOLD = 1.5
+_BEAT_MIN_INTERVAL_S = 0.2
+_BEAT_MAX_HZ = 150
+_PEAK_DECAY_PER_S = 0.5
+"""
+dB per second the loudest level seen so far sinks, so the bands adapt to quieter music
+"""
+
+
+class AudioSource(ABC):
+    """
+    Delivers mono samples in blocks as they're recorded. read() blocks until the next block is there.
+    """
+
+    sample_rate: int
+
+    @abstractmethod
+    def read(self) -> Optional[np.ndarray]:
+        """
+        The next block as float32 from -1 to 1, None once the input ended
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class AlsaSource(AudioSource):
+    def __init__(self, device: str, sample_rate: int, channels: int, block_size: int):
+        # Only needed for ALSA input, so not in requirements.txt (pip install pyalsaaudio)
+        import alsaaudio
+        self.sample_rate = sample_rate
+        self._channels = channels
+        self._pcm = alsaaudio.PCM(alsaaudio.PCM_CAPTURE, alsaaudio.PCM_NORMAL, device=device, channels=channels,
+                                  rate=sample_rate, format=alsaaudio.PCM_FORMAT_S16_LE, periodsize=block_size)
+
+    def read(self) -> Optional[np.ndarray]:
+        while True:
+            length, data = self._pcm.read()
+            # Negative lengths are overruns, the next read continues with fresh samples
+            if length > 0:
+                return pcm_to_mono(data, 2, self._channels)
+
+    def close(self):
+        self._pcm.close()
+
+
+class WavSource(AudioSource):
+    """
+    Plays a WAV file at its own pace, like a live input would deliver it
+    """
+
+    def __init__(self, path: str, block_size: int, loop: bool = False):
+        self._wav = wave.open(path, 'rb')
+        self.sample_rate = self._wav.getframerate()
+        self._block_size = block_size
+        self._loop = loop
+        self.start_time: Optional[float] = None
+        """
+        time.monotonic() when the first sample was read
+        """
+        self._samples_read = 0
+
+    def read(self) -> Optional[np.ndarray]:
+        data = self._wav.readframes(self._block_size)
+        if not data and self._loop:
+            self._wav.rewind()
+            data = self._wav.readframes(self._block_size)
+        if not data:
+            return None
+
+        if self.start_time is None:
+            self.start_time = time.monotonic()
+        samples = pcm_to_mono(data, self._wav.getsampwidth(), self._wav.getnchannels())
+        self._samples_read += len(samples)
+        time.sleep(max(0.0, self.start_time + self._samples_read / self.sample_rate - time.monotonic()))
+        return samples
+
+    def close(self):
+        self._wav.close()
+
+
+class StdinSource(AudioSource):
+    """
+    Raw little endian 16 bit PCM on stdin, e.g. from `arecord -f S16_LE -r 44100 -c 2` or `ffmpeg -f s16le -`.
+    fd is a copy of stdin for processes started by multiprocessing, which replaces their stdin with /dev/null.
+    """
+
+    def __init__(self, sample_rate: int, channels: int, block_size: int, fd: Optional[int] = None):
+        self.sample_rate = sample_rate
+        self._channels = channels
+        self._block = bytearray(block_size * channels * 2)
+        self._input = open(fd if fd is not None else sys.stdin.fileno(), 'rb', buffering=0, closefd=False)
+
+    def read(self) -> Optional[np.ndarray]:
+        view = memoryview(self._block)
+        received = 0
+        while received < len(view):
+            count = self._input.readinto(view[received:])
+            if not count:
+                return None
+            received += count
+        return pcm_to_mono(self._block, 2, self._channels)
+
+
+audio_sources: Dict[str, Callable[[str, int, int, int, Optional[int]], AudioSource]] = {
+    'alsa': lambda device, sample_rate, channels, block_size, _: AlsaSource(device, sample_rate, channels, block_size),
+    'wav': lambda path, sample_rate, channels, block_size, _: WavSource(path, block_size, loop=True),
+    'stdin': lambda _, sample_rate, channels, block_size, fd: StdinSource(sample_rate, channels, block_size, fd),
+}
+"""
+Takes (device or file, sample rate, channels, block size, stdin fd). WAV files bring their own rate and channels.
+"""
+
+
+def pcm_to_mono(data: bytes, sample_width: int, channels: int) -> np.ndarray:
+    """
+    Converts interleaved little endian PCM (unsigned 8 bit, or signed 16, 24 or 32 bit) to float32 mono
+    """
+    frame_size = sample_width * channels
+    data = data[:len(data) - len(data) % frame_size]
+    if sample_width == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128) / 128
+    elif sample_width == 3:
+        packed = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        # Shifting the top byte up and back down again sign extends it
+        samples = (packed[:, 0] | (packed[:, 1] << 8) | (packed[:, 2] << 16)) << 8 >> 8
+        samples = samples.astype(np.float32) / (1 << 23)
+    else:
+        dtype = {2: '<i2', 4: '<i4'}[sample_width]
+        samples = np.frombuffer(data, dtype=dtype).astype(np.float32) / (1 << (sample_width * 8 - 1))
+    return samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+
+
+class AudioFrame:
+    def __init__(self, bands: np.ndarray, level: float, beat_time: float, sample_time: float):
+        self.bands = bands
+        """
+        Energy of every band from 0 to 1, lowest frequencies first
+        """
+        self.level = level
+        self.beat_time = beat_time
+        """
+        time.monotonic() of the last beat, -inf if there wasn't one yet
+        """
+        self.sample_time = sample_time
+        """
+        time.monotonic() when the newest sample of the analysis was recorded
+        """
+
+
+class SharedAnalysis:
+    """
+    The newest analysis in shared memory, written by the analyzer and read by patterns, in the render loop or in
+    render workers. Uses a sequence counter like StateSnapshot, so the analyzer never waits for a reader and readers
+    never wait for each other, they only retry if they read while a new analysis was being written.
+
+    Readers also leave the sample time of what they read, which is how the render loop measures how long it took
+    from a sample being recorded to the frame it showed up in.
+    """
+
+    def __init__(self, bands: int, name: str = None):
+        self.bands = bands
+        self._owner = name is None
+        self._shm = open_shared_memory(name, (_HEADER_FIELDS + bands) * 8)
+        self._header = np.ndarray(_HEADER_FIELDS, dtype=np.float64, buffer=self._shm.buf)
+        self._bands = np.ndarray(bands, dtype=np.float64, buffer=self._shm.buf, offset=_HEADER_FIELDS * 8)
+        if self._owner:
+            self._header[:] = 0
+            self._header[_BEAT_TIME] = -float('inf')
+            self._bands[:] = 0
+
+    def __reduce__(self):
+        return SharedAnalysis, (self.bands, self._shm.name)
+
+    def publish(self, bands: np.ndarray, level: float, beat_time: float, sample_time: float):
+        self._header[_SEQUENCE] += 1
+        self._bands[:] = bands
+        self._header[_LEVEL] = level
+        self._header[_BEAT_TIME] = beat_time
+        self._header[_SAMPLE_TIME] = sample_time
+        self._header[_SEQUENCE] += 1
+
+    def read(self) -> AudioFrame:
+        while True:
+            sequence = self._header[_SEQUENCE]
+            if sequence % 2 == 1:
+                # The writer may be a thread of this process, which needs the GIL to finish
+                time.sleep(0)
+                continue
+            bands = self._bands.copy()
+            level, beat_time, sample_time = self._header[_LEVEL], self._header[_BEAT_TIME], self._header[_SAMPLE_TIME]
+            if self._header[_SEQUENCE] == sequence:
+                self._header[_CONSUMED_SAMPLE_TIME] = sample_time
+                return AudioFrame(bands, float(level), float(beat_time), float(sample_time))
+
+    def take_consumed(self) -> Optional[float]:
+        """
+        Sample time of the newest analysis a pattern read since the last call, None if none did
+        """
+        sample_time = float(self._header[_CONSUMED_SAMPLE_TIME])
+        self._header[_CONSUMED_SAMPLE_TIME] = 0
+        return sample_time if sample_time > 0 else None
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class AudioAnalyzer:
+    """
+    Reads the source on a background thread. After every block it takes the newest fft_size samples through a
+    Hann window and an FFT, and publishes the energy in bands logarithmically spaced from min_hz to max_hz.
+
+    Energies are in dB relative to the loudest level heard recently, spread over dynamic_range_db, so quiet and
+    loud music both use the whole range. A beat is a jump in the energy below 150 Hz over its average of the last
+    second.
+
+    The windows, band of every FFT bin and so on are computed once up front, so a block is a handful of NumPy calls.
+    """
+
+    def __init__(self, source: AudioSource, analysis: SharedAnalysis, fft_size: int, min_hz: float, max_hz: float,
+                 dynamic_range_db: float, profiler=None):
+        self.source = source
+        self.analysis = analysis
+        self._profiler = profiler
+        self._dynamic_range_db = dynamic_range_db
+
+        self._samples = np.zeros(fft_size, dtype=np.float32)
+        self._window = np.hanning(fft_size).astype(np.float32)
+        # Takes out the window's gain, so levels don't depend on fft_size
+        self._scale = 1 / np.sum(self._window) ** 2
+
+        frequencies = np.fft.rfftfreq(fft_size, 1 / source.sample_rate)
+        edges = np.geomspace(min_hz, min(max_hz, source.sample_rate / 2), analysis.bands + 1)
+        band_of_bin = np.searchsorted(edges, frequencies, side='right') - 1
+        bins = np.flatnonzero((band_of_bin >= 0) & (band_of_bin < analysis.bands))
+        band_of_bin = band_of_bin[bins]
+        # Low bands can be narrower than a bin, those use the bin closest to them instead of staying dark
+        empty = np.setdiff1d(np.arange(analysis.bands), band_of_bin)
+        centers = np.sqrt(edges[empty] * edges[empty + 1])
+        self._bins = np.concatenate((bins, np.abs(frequencies[:, None] - centers).argmin(axis=0)))
+        self._band_of_bin = np.concatenate((band_of_bin, empty))
+        self._bins_per_band = np.bincount(self._band_of_bin, minlength=analysis.bands)
+        self._bass_bins = np.flatnonzero((frequencies > 0) & (frequencies <= _BEAT_MAX_HZ))
+
+        self._peak_db = -float('inf')
+        self._bass_history = []
+        self._beat_time = -float('inf')
+        self._last_block_time = None
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops the analysis and frees the source and the shared analysis, the latter only once the thread is done
+        with it
+        """
+        self._running = False
+        self._thread.join(1)
+        self.source.close()
+        if not self._thread.is_alive():
+            self.analysis.close()
+
+    def _run(self):
+        while self._running:
+            try:
+                block = self.source.read()
+            except Exception as e:
+                print(repr(e))
+                block = None
+            if block is None:
+                print('Audio input ended')
+                # Silence from here on, rather than the last analysis forever
+                self.analysis.publish(np.zeros(self.analysis.bands), 0, self._beat_time, time.monotonic())
+                return
+            self._analyze(block, time.monotonic())
+
+    def _analyze(self, block: np.ndarray, sample_time: float):
+        start = time.perf_counter()
+        samples = self._samples
+        if len(block) >= len(samples):
+            samples[:] = block[-len(samples):]
+        else:
+            samples[:-len(block)] = samples[len(block):]
+            samples[-len(block):] = block
+
+        power = np.abs(np.fft.rfft(samples * self._window)) ** 2 * self._scale
+        band_power = np.bincount(self._band_of_bin, weights=power[self._bins], minlength=self.analysis.bands)
+        band_db = 10 * np.log10(band_power / self._bins_per_band + 1e-12)
+
+        elapsed = sample_time - self._last_block_time if self._last_block_time is not None else 0
+        self._last_block_time = sample_time
+        self._peak_db = max(self._peak_db - _PEAK_DECAY_PER_S * elapsed, float(band_db.max()))
+        floor_db = self._peak_db - self._dynamic_range_db
+        bands = np.clip((band_db - floor_db) / self._dynamic_range_db, 0, 1)
+
+        bass = float(power[self._bass_bins].sum())
+        history_length = max(1, int(_BEAT_HISTORY_S * self.source.sample_rate / len(block)))
+        # Needs a full second to compare against, a few blocks of noise aren't enough
+        average = sum(self._bass_history) / len(self._bass_history) if len(self._bass_history) == history_length else 0
+        if average > 0 and bass > _BEAT_THRESHOLD * average and sample_time - self._beat_time > _BEAT_MIN_INTERVAL_S:
+            self._beat_time = sample_time
+        self._bass_history.append(bass)
+        del self._bass_history[:-history_length]
+
+        level = float(np.sqrt(np.mean(np.square(block))))
+        self.analysis.publish(bands, level, self._beat_time, sample_time)
+        if self._profiler is not None:
+            self._profiler.record('audio', 'analysis', time.perf_counter() - start)
+
+
+_analysis: Optional[SharedAnalysis] = None
+"""
+Where audio patterns read from in this process. Render workers inherit it when they're started.
+"""
+
+
+def start_audio(source: str, device: str, sample_rate: int, channels: int, block_size: int, fft_size: int,
+                bands: int, min_hz: float, max_hz: float, dynamic_range_db: float, profiler=None,
+                stdin_fd: Optional[int] = None) -> AudioAnalyzer:
+    """
+    Opens the source (see audio_sources) and starts analyzing it for the audio patterns in this process, and render
+    workers started after this. stdin_fd is what the stdin source reads from instead of stdin.
+    """
+    global _analysis
+    if source not in audio_sources:
+        raise ValueError(f'Unknown audio source {source!r}, expected one of {list(audio_sources)}')
+    _analysis = SharedAnalysis(bands)
+    audio_source = audio_sources[source](device, sample_rate, channels, block_size, stdin_fd)
+    return AudioAnalyzer(audio_source, _analysis, fft_size, min_hz, max_hz, dynamic_range_db, profiler)
+
+
+def latest() -> Optional[AudioFrame]:
+    """
+    The newest analysis, None if there's no audio input
+    """
+    return _analysis.read() if _analysis is not None else None
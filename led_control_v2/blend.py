@@ -0,0 +1,203 @@
+import colorsys
+from enum import Enum
+from functools import lru_cache
+
+import numpy as np
+
+from led_strip.color import RGBW, Color
+
+
+class BlendMode(Enum):
+    HSV_MIDPOINT = 1
+    """
+    Average hue, saturation and value. What blending has always done.
+    """
+    LINEAR_RGB = 2
+    """
+    Average each channel's raw 0-255 value.
+    """
+    GAMMA_CORRECT = 3
+    """
+    Average each channel's light output, assuming the LEDs follow a 2.2 gamma curve.
+    """
+
+
+_GAMMA = 2.2
+_MAX_CACHED_PAIRS = 4096
+
+
+def blend_colors(color1: RGBW, color2: RGBW, mode: BlendMode = BlendMode.HSV_MIDPOINT) -> RGBW:
+    return _blend_colors_cached(int(color1), int(color2), mode)
+
+
+@lru_cache(maxsize=_MAX_CACHED_PAIRS)
+def _blend_colors_cached(color1: int, color2: int, mode: BlendMode) -> RGBW:
+    if mode == BlendMode.HSV_MIDPOINT:
+        return _hsv_midpoint(RGBW(color1), RGBW(color2))
+    return RGBW(int(blend_frames(np.array([color1], dtype=np.uint32), np.array([color2], dtype=np.uint32), mode)[0]))
+
+
+def _hsv_midpoint(color1: RGBW, color2: RGBW) -> RGBW:
+    color1_hsv = colorsys.rgb_to_hsv(color1.r / 255, color1.g / 255, color1.b / 255)
+    color2_hsv = colorsys.rgb_to_hsv(color2.r / 255, color2.g / 255, color2.b / 255)
+
+    midpoint = (_avg(color1_hsv[0], color2_hsv[0]),
+                _avg(color1_hsv[1], color2_hsv[1]),
+                _avg(color1_hsv[2], color2_hsv[2]))
+
+    midpoint_rgb = colorsys.hsv_to_rgb(*midpoint)
+
+    return Color(int(midpoint_rgb[0] * 255), int(midpoint_rgb[1] * 255), int(midpoint_rgb[2] * 255))
+
+
+def _avg(a, b):
+    return (a + b) / 2
+
+
+class BlendCache:
+    """
+    Remembers blends of color pairs across frames. Patterns like 'RGB Chase' only ever blend a handful of distinct
+    pairs, so most frames end up being lookups. Pairs are kept as sorted uint64 keys so the lookup is vectorized too.
+    """
+
+    def __init__(self, mode: BlendMode = BlendMode.HSV_MIDPOINT, max_pairs: int = _MAX_CACHED_PAIRS):
+        self.mode = mode
+        self._max_pairs = max_pairs
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._values = np.zeros(0, dtype=np.uint32)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def blend(self, frame1: np.ndarray, frame2: np.ndarray) -> np.ndarray:
+        keys = (frame1.astype(np.uint64) << np.uint64(32)) | frame2.astype(np.uint64)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+
+        if len(unique_keys) > self._max_pairs:
+            # Mostly distinct pairs (e.g. random colors), caching won't help
+            return blend_frames(frame1, frame2, self.mode)
+
+        positions = np.searchsorted(self._keys, unique_keys)
+        positions = np.minimum(positions, max(len(self._keys) - 1, 0))
+        hits = (self._keys[positions] == unique_keys) if len(self._keys) > 0 else np.zeros(len(unique_keys), bool)
+
+        unique_values = np.empty(len(unique_keys), dtype=np.uint32)
+        unique_values[hits] = self._values[positions[hits]]
+
+        missing_keys = unique_keys[~hits]
+        if len(missing_keys) > 0:
+            missing_values = blend_frames((missing_keys >> np.uint64(32)).astype(np.uint32),
+                                          (missing_keys & np.uint64(0xffffffff)).astype(np.uint32), self.mode)
+            unique_values[~hits] = missing_values
+            self._insert(missing_keys, missing_values)
+
+        return unique_values[inverse]
+
+    def _insert(self, keys: np.ndarray, values: np.ndarray):
+        if len(self._keys) + len(keys) > self._max_pairs:
+            self._keys = np.zeros(0, dtype=np.uint64)
+            self._values = np.zeros(0, dtype=np.uint32)
+
+        all_keys = np.concatenate((self._keys, keys))
+        order = np.argsort(all_keys)
+        self._keys = all_keys[order]
+        self._values = np.concatenate((self._values, values))[order]
+
+
+def blend_frames(frame1: np.ndarray, frame2: np.ndarray, mode: BlendMode = BlendMode.HSV_MIDPOINT) -> np.ndarray:
+    """
+    Blends two frames pixel by pixel. HSV_MIDPOINT mirrors colorsys step for step, so the output is identical to
+    blend_colors.
+    """
+    if mode == BlendMode.HSV_MIDPOINT:
+        return _hsv_midpoint_frames(frame1, frame2)
+    if mode == BlendMode.LINEAR_RGB:
+        return _table_blend_frames(frame1, frame2, _LINEAR_TABLE)
+    if mode == BlendMode.GAMMA_CORRECT:
+        return _table_blend_frames(frame1, frame2, _GAMMA_TABLE)
+    raise ValueError(f'Unknown blend mode {mode}')
+
+
+def mix_frames(frame1: np.ndarray, frame2: np.ndarray, weight: float) -> np.ndarray:
+    """
+    Mixes every channel of frame2 into frame1 by weight, 0 being all frame1 and 1 all frame2, in 1/256 steps
+    """
+    amount = int(round(min(max(weight, 0), 1) * 256))
+    channels1 = np.ascontiguousarray(frame1, dtype=np.uint32).view(np.uint8).astype(np.uint16)
+    channels2 = np.ascontiguousarray(frame2, dtype=np.uint32).view(np.uint8).astype(np.uint16)
+    mixed = (channels1 * (256 - amount) + channels2 * amount) >> 8
+    return mixed.astype(np.uint8).view(np.uint32)
+
+
+def _hsv_midpoint_frames(frame1: np.ndarray, frame2: np.ndarray) -> np.ndarray:
+    hsv1 = _rgb_to_hsv(*_unpack_rgb(frame1))
+    hsv2 = _rgb_to_hsv(*_unpack_rgb(frame2))
+
+    midpoint = [_avg(a, b) for a, b in zip(hsv1, hsv2)]
+
+    r, g, b = _hsv_to_rgb(*midpoint)
+    return _pack_rgb((r * 255).astype(np.uint32), (g * 255).astype(np.uint32), (b * 255).astype(np.uint32))
+
+
+def _unpack_rgb(frame: np.ndarray):
+    return ((frame >> 16) & 0xff) / 255, ((frame >> 8) & 0xff) / 255, (frame & 0xff) / 255
+
+
+def _pack_rgb(r: np.ndarray, g: np.ndarray, b: np.ndarray) -> np.ndarray:
+    return (r << 16) | (g << 8) | b
+
+
+def _rgb_to_hsv(r: np.ndarray, g: np.ndarray, b: np.ndarray):
+    maxc = np.maximum(np.maximum(r, g), b)
+    minc = np.minimum(np.minimum(r, g), b)
+    rangec = maxc - minc
+    gray = rangec == 0
+
+    safe_maxc = np.where(gray, 1, maxc)
+    safe_rangec = np.where(gray, 1, rangec)
+
+    s = np.where(gray, 0.0, rangec / safe_maxc)
+    rc = (maxc - r) / safe_rangec
+    gc = (maxc - g) / safe_rangec
+    bc = (maxc - b) / safe_rangec
+
+    h = np.where(r == maxc, bc - gc, np.where(g == maxc, 2.0 + rc - bc, 4.0 + gc - rc))
+    h = np.where(gray, 0.0, (h / 6.0) % 1.0)
+    return h, s, maxc
+
+
+def _hsv_to_rgb(h: np.ndarray, s: np.ndarray, v: np.ndarray):
+    i = (h * 6.0).astype(np.int64)
+    f = (h * 6.0) - i
+    p = v * (1.0 - s)
+    q = v * (1.0 - s * f)
+    t = v * (1.0 - s * (1.0 - f))
+    i = i % 6
+
+    gray = s == 0.0
+    r = np.where(gray, v, np.choose(i, [v, q, p, p, t, v]))
+    g = np.where(gray, v, np.choose(i, [t, v, v, q, p, p]))
+    b = np.where(gray, v, np.choose(i, [p, p, t, v, v, q]))
+    return r, g, b
+
+
+def _table_blend_frames(frame1: np.ndarray, frame2: np.ndarray, table: np.ndarray) -> np.ndarray:
+    result = np.zeros(len(frame1), dtype=np.uint32)
+    for shift in (0, 8, 16, 24):
+        channel1 = (frame1 >> shift) & 0xff
+        channel2 = (frame2 >> shift) & 0xff
+        result |= table[channel1, channel2].astype(np.uint32) << shift
+    return result
+
+
+def _build_blend_table(gamma: float) -> np.ndarray:
+    """
+    256x256 table of the blended value of every pair of channel values
+    """
+    light = (np.arange(256) / 255) ** gamma
+    blended_light = (light[:, np.newaxis] + light[np.newaxis, :]) / 2
+    return np.round(blended_light ** (1 / gamma) * 255).astype(np.uint8)
+
+
+_LINEAR_TABLE = _build_blend_table(1.0)
+_GAMMA_TABLE = _build_blend_table(_GAMMA)
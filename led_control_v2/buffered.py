@@ -0,0 +1,122 @@
+from abc import ABC, abstractmethod
+from typing import Generic, Optional, Tuple, TypeVar
+
+import numpy as np
+
+T = TypeVar('T')
+
+
+class Buffered(ABC):
+    """
+    State that patterns read while rendering a frame but only want to change once the frame is done.
+    Writes go to a back buffer and become visible when swap() is called at the end of the frame.
+    """
+
+    @abstractmethod
+    def swap(self):
+        pass
+
+
+class BufferedValue(Buffered, Generic[T]):
+    def __init__(self, value: T):
+        self.value = value
+        self._next_value = value
+        self._pending = False
+
+    def set(self, value: T):
+        self._next_value = value
+        self._pending = True
+
+    def swap(self):
+        if self._pending:
+            self.value = self._next_value
+            self._pending = False
+
+
+class BufferedRing(Buffered):
+    """
+    Colors shown last frame, as uint32 in a ring buffer: pixel i is at (offset + i) % len, so moving every pixel
+    along only moves the offset.
+
+    shift() stages moving the pixels up and filling in the start, which swap() does by writing only the new colors.
+    set()/set_frame() stage arbitrary changes on a copy, which swap() then uses as the ring.
+    """
+
+    def __init__(self):
+        self._ring = np.zeros(0, dtype=np.uint32)
+        self._offset = 0
+        self._next: Optional[np.ndarray] = None
+        self._shift: Optional[Tuple[int, np.ndarray]] = None
+
+    def __len__(self):
+        return len(self._ring)
+
+    def resize(self, size: int):
+        """
+        Grows the ring to at least size pixels, new ones are black
+        """
+        if len(self._ring) < size:
+            padding = np.zeros(size - len(self._ring), dtype=np.uint32)
+            self._ring = np.concatenate((self.frame(), padding))
+            self._offset = 0
+            if self._next is not None:
+                self._next = np.concatenate((self._next, padding))
+
+    def at(self, index: int) -> int:
+        return int(self._ring[(self._offset + index) % len(self._ring)])
+
+    def frame(self, size: int = None) -> np.ndarray:
+        """
+        Copy of the first size pixels (all of them if None)
+        """
+        return self.copy_to(np.empty(len(self._ring) if size is None else size, dtype=np.uint32))
+
+    def copy_to(self, out: np.ndarray) -> np.ndarray:
+        """
+        Copies the first len(out) pixels into out, and returns it
+        """
+        head = self._ring[self._offset:self._offset + len(out)]
+        out[:len(head)] = head
+        out[len(head):] = self._ring[:len(out) - len(head)]
+        return out
+
+    def shift(self, colors: np.ndarray):
+        """
+        Moves every pixel up by len(colors), dropping the last ones, and puts colors at the start
+        """
+        self._shift = (len(colors), colors)
+        self._next = None
+
+    def set(self, index: int, color: int):
+        self._stage_copy()[index] = color
+
+    def set_frame(self, frame: np.ndarray):
+        self._stage_copy()[:len(frame)] = frame
+
+    def swap(self):
+        if self._next is not None:
+            self._ring, self._next = self._next, None
+            self._offset = 0
+        elif self._shift is not None:
+            count, colors = self._shift
+            self._shift = None
+            size = len(self._ring)
+            count = min(count, size)
+            if count == 0:
+                return
+            self._offset = (self._offset - count) % size
+            # colors[0] becomes pixel 0, i.e. lands at the new offset
+            head = min(count, size - self._offset)
+            self._ring[self._offset:self._offset + head] = colors[:head]
+            self._ring[:count - head] = colors[head:count]
+
+    def _stage_copy(self) -> np.ndarray:
+        if self._next is None:
+            self._next = self.frame()
+            if self._shift is not None:
+                count, colors = self._shift
+                count = min(count, len(self._next))
+                self._next[count:] = self._next[:len(self._next) - count].copy()
+                self._next[:count] = colors[:count]
+                self._shift = None
+        return self._next
@@ -0,0 +1,70 @@
+import threading
+import uuid
+from multiprocessing.connection import Connection
+from typing import Dict, Optional
+
+from .command import Command, CommandResponse
+
+
+class _PendingCommand:
+    def __init__(self):
+        self.done = threading.Event()
+        self.response: Optional[CommandResponse] = None
+
+
+class CommandChannel:
+    """
+    Web server side of the command pipe. Any number of threads can send commands at once: each one only holds the
+    lock while writing to the pipe, and a background thread hands responses back to whoever sent the command with
+    the matching id.
+    """
+
+    def __init__(self, conn: Connection, timeout: float = 5):
+        self._conn = conn
+        self._timeout = timeout
+        self._send_lock = threading.Lock()
+        self._pending_lock = threading.Lock()
+        self._pending: Dict[uuid.UUID, _PendingCommand] = {}
+        self.closed = False
+        """
+        Set once the render loop hung up, nothing sent after that will be answered
+        """
+
+        self._receiver = threading.Thread(target=self._receive_responses, daemon=True)
+        self._receiver.start()
+
+    def send(self, command: Command) -> CommandResponse:
+        pending = _PendingCommand()
+        with self._pending_lock:
+            self._pending[command.id] = pending
+
+        try:
+            with self._send_lock:
+                self._conn.send(command)
+        except (OSError, ValueError):
+            self.closed = True
+            with self._pending_lock:
+                self._pending.pop(command.id, None)
+            return command.response(CommandResponse.Status.FAILED, 'The render loop is gone')
+
+        if not pending.done.wait(self._timeout):
+            with self._pending_lock:
+                self._pending.pop(command.id, None)
+            return command.response(CommandResponse.Status.FAILED, 'Timed out waiting for the render loop')
+
+        return pending.response
+
+    def _receive_responses(self):
+        while True:
+            try:
+                response: CommandResponse = self._conn.recv()
+            except (EOFError, ConnectionError):
+                self.closed = True
+                return
+
+            with self._pending_lock:
+                pending = self._pending.pop(response.command_id, None)
+
+            if pending is not None:
+                pending.response = response
+                pending.done.set()
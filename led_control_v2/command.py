@@ -1,12 +1,14 @@
+import time
 import uuid
 from abc import ABC, abstractmethod
 from enum import Enum
 from multiprocessing import Pipe
-from typing import Optional, Dict, Tuple, Callable, List, Any
+from typing import Optional, Tuple, Callable, List, Any
 
-from rpi_ws281x import RGBW
+from led_strip.color import RGBW
 
 from .pattern import Pattern, ColorPattern
+from .pattern_definitions import PatternDefinitionError, parse_pattern_definitions
 
 CommandHandler = Callable[[Any, List[Any]], Optional[Pattern]]
 """
@@ -26,11 +28,19 @@ class CommandResponse:
 
 
 class Command(ABC):
-    def __init__(self):
+    def __init__(self, segment: Optional[str] = None):
         self.id = uuid.uuid4()
+        self.segment = segment
+        """
+        Name of the segment the command applies to, None for the default one
+        """
 
     @abstractmethod
-    def handle(self, context: Any) -> Tuple[CommandResponse, Optional[Pattern]]:
+    def handle(self, context: Any) -> Tuple[Optional[CommandResponse], Optional[Pattern]]:
+        """
+        Returns the response and the pattern to switch to, if any. Commands that can only tell whether they worked
+        later return None instead of the response, and send it through context.respond once they know.
+        """
         pass
 
     def response(self, status: CommandResponse.Status, data: Any = None) -> CommandResponse:
@@ -44,18 +54,44 @@ class Command(ABC):
 
 
 class PatternCommand(Command):
-    def __init__(self, pattern: str):
-        super().__init__()
+    def __init__(self, pattern: str, segment: Optional[str] = None):
+        super().__init__(segment)
         self.pattern = pattern
 
+    def handle(self, context: Any) -> Tuple[Optional[CommandResponse], Optional[Pattern]]:
+        # Building the pattern can take a while, so that happens off the render loop, which answers once it's done
+        context.pattern_builder.build(context.segment(self.segment).name, context.pattern_constructors[self.pattern],
+                                      lambda error: context.respond(self.ok_response() if error is None else
+                                                                    self.response(CommandResponse.Status.FAILED,
+                                                                                  error)))
+        return None, None
+
+
+class LoadPatternsCommand(Command):
+    """
+    Replaces all pattern definitions with the ones in source (see pattern_definitions.py). The patterns that are
+    showing keep running. Publishes the new pattern names to the state snapshot and responds with them.
+    """
+
+    def __init__(self, source: str, file_format: str = 'json'):
+        super().__init__()
+        self.source = source
+        self.file_format = file_format
+
     def handle(self, context: Any) -> Tuple[CommandResponse, Optional[Pattern]]:
-        new_pattern = context.pattern_constructors[self.pattern]()
-        return self.ok_response(), new_pattern
+        constructors = parse_pattern_definitions(self.source, self.file_format)
+        if context.snapshot is not None:
+            try:
+                context.snapshot.publish_patterns(list(constructors))
+            except ValueError as e:
+                raise PatternDefinitionError('$', str(e))
+        context.pattern_constructors = constructors
+        return self.ok_response(list(constructors)), None
 
 
 class SetColorCommand(Command):
-    def __init__(self, color: RGBW):
-        super().__init__()
+    def __init__(self, color: RGBW, segment: Optional[str] = None):
+        super().__init__(segment)
         self.color = color
 
     def handle(self, context: Any) -> Tuple[CommandResponse, Optional[Pattern]]:
@@ -63,54 +99,192 @@ class SetColorCommand(Command):
 
 
 class SetBrightnessCommand(Command):
-    def __init__(self, value: int):
-        super().__init__()
+    def __init__(self, value: int, segment: Optional[str] = None):
+        super().__init__(segment)
 
         assert 0 <= value <= 255
         self.value = value
 
     def handle(self, context: Any) -> Tuple[CommandResponse, Optional[Pattern]]:
-        context.strip.setBrightness(self.value)
+        context.segment(self.segment).set_brightness(self.value)
         return self.empty_ok_response()
 
 
-class GetBrightnessCommand(Command):
-    def handle(self, context: Any) -> Tuple[CommandResponse, Optional[Pattern]]:
-        return self.ok_response(context.strip.getBrightness()), None
-
-
 class SetIncrementCommand(Command):
-    def __init__(self, value: float):
-        super().__init__()
+    def __init__(self, value: float, segment: Optional[str] = None):
+        super().__init__(segment)
         self.value = value
 
     def handle(self, context: Any) -> Tuple[CommandResponse, Optional[Pattern]]:
-        context.progress_increment = self.value
+        context.segment(self.segment).set_progress_increment(self.value)
         return self.empty_ok_response()
 
 
-class GetIncrementCommand(Command):
-    def handle(self, context: Any) -> Tuple[CommandResponse, Optional[Pattern]]:
-        return self.ok_response(context.progress_increment), None
-
+class BatchCommand(Command):
+    """
+    Runs several commands as one: either all of them take effect, in the same frame, or none of them do. Responds
+    with the list of their responses, and fails if any of them failed.
 
-def process_command(pipe: Pipe, context: Any) -> Optional[Pattern]:
-    command_from_pipe = receive_from_pipe(pipe, timeout=0)
-
-    if command_from_pipe is None:
-        return None
+    The commands run against a staged context, which records every change instead of making it. Patterns they
+    switch to are built together, and the recorded changes are applied in the frame the patterns are installed.
+    The batch answers only then, so a pattern failing to build fails the batch and nothing is applied. Commands
+    reading something see it as it was before the batch.
+    """
 
+    def __init__(self, commands: List[Command]):
+        super().__init__()
+        self.commands = commands
+
+    def handle(self, context: Any) -> Tuple[Optional[CommandResponse], Optional[Pattern]]:
+        staged = _StagedContext(context)
+        responses: List[Optional[CommandResponse]] = []
+        for command in self.commands:
+            try:
+                assert isinstance(command, Command)
+                segment = context.segment(command.segment).name
+                response, new_pattern = command.handle(staged)
+                if new_pattern is not None:
+                    staged.pattern_builder.build(segment, lambda built=new_pattern: built)
+            except Exception as e:
+                response = command.response(CommandResponse.Status.FAILED, e)
+            responses.append(response)
+
+        if any(response is not None and response.status != CommandResponse.Status.OK for response in responses):
+            return self.response(CommandResponse.Status.FAILED, _not_applied(self.commands, responses)), None
+
+        # Only answered once the patterns are built, building one of them can still fail
+        def done(error: Optional[Exception]):
+            staged.pattern_builder.finish(error)
+            answered = [response if response is not None else staged.responses.get(command.id)
+                        for command, response in zip(self.commands, responses)]
+            if error is None:
+                context.respond(self.ok_response(answered))
+            else:
+                context.respond(self.response(CommandResponse.Status.FAILED, _not_applied(self.commands, answered)))
+
+        context.pattern_builder.build_group(staged.pattern_builder.builds, staged.apply, done)
+        return None, None
+
+
+def _not_applied(commands: List[Command], responses: List[Optional[CommandResponse]]) -> List[CommandResponse]:
+    """
+    Responses of a batch that failed: the failed ones as they are, every other one failed for not being applied
+    """
+    return [response if response is not None and response.status != CommandResponse.Status.OK else
+            CommandResponse(command.id, CommandResponse.Status.FAILED,
+                            'Not applied, another command in the batch failed')
+            for command, response in zip(commands, responses)]
+
+
+class _StagedBuilder:
+    def __init__(self, changes: List[Callable[[], None]]):
+        self.builds: List[Tuple[str, Callable[[], Pattern]]] = []
+        self._changes = changes
+        self._done: List[Callable[[Optional[Exception]], None]] = []
+
+    def build(self, segment: str, constructor: Callable[[], Pattern], done: Callable = None):
+        self.build_group([(segment, constructor)], done=done)
+
+    def build_group(self, builds: List[Tuple[str, Callable[[], Pattern]]], apply: Callable[[], None] = None,
+                    done: Callable = None):
+        self.builds += builds
+        if apply is not None:
+            self._changes.append(apply)
+        if done is not None:
+            self._done.append(done)
+
+    def finish(self, error: Optional[Exception]):
+        """
+        Tells the commands waiting for their builds how the batch's builds went
+        """
+        for done in self._done:
+            done(error)
+
+
+class _StagedSegment:
+    """
+    Reads from the segment, but records calls to its set_ methods instead of making them
+    """
+
+    def __init__(self, segment: Any, changes: List[Callable[[], None]]):
+        self._segment = segment
+        self._changes = changes
+
+    def __getattr__(self, name: str) -> Any:
+        value = getattr(self._segment, name)
+        if name.startswith('set_') and callable(value):
+            return lambda *args, **kwargs: self._changes.append(lambda: value(*args, **kwargs))
+        return value
+
+
+class _StagedContext:
+    """
+    Stands in for the context while a batch runs: reads go to the context, changes to it or its segments are
+    recorded and made by apply
+    """
+
+    def __init__(self, context: Any):
+        changes: List[Callable[[], None]] = []
+        self.__dict__.update(_context=context, _assigned={}, _changes=changes,
+                             pattern_builder=_StagedBuilder(changes), responses={})
+
+    def __getattr__(self, name: str) -> Any:
+        if name in self._assigned:
+            return self._assigned[name]
+        return getattr(self._context, name)
+
+    def __setattr__(self, name: str, value: Any):
+        self._assigned[name] = value
+        self._changes.append(lambda: setattr(self._context, name, value))
+
+    def respond(self, response: CommandResponse):
+        self.responses[response.command_id] = response
+
+    def segment(self, name: Optional[str] = None) -> _StagedSegment:
+        return _StagedSegment(self._context.segment(name), self._changes)
+
+    def apply(self):
+        for change in self._changes:
+            change()
+
+
+def process_commands(pipe: Pipe, context: Any, max_commands: int):
+    """
+    Handles every command waiting in the pipe (up to max_commands). The patterns they switch to go through the
+    context's pattern builder, in order, together with the ones PatternCommand builds there.
+    """
+    for _ in range(max_commands):
+        command_from_pipe = receive_from_pipe(pipe, timeout=0)
+        if command_from_pipe is None:
+            break
+
+        result = process_command(pipe, command_from_pipe, context)
+        if result is not None:
+            segment, pattern = result
+            context.pattern_builder.build(segment, lambda built=pattern: built)
+
+
+def process_command(pipe: Pipe, command_from_pipe: Any, context: Any) -> Optional[Tuple[str, Pattern]]:
+    """
+    Handles a single command and returns the name of its segment together with the pattern it switched to, if any
+    """
+    start_time = time.perf_counter()
     try:
         assert isinstance(command_from_pipe, Command)
+        segment = context.segment(command_from_pipe.segment).name
         response, new_pattern = command_from_pipe.handle(context)
-        pipe.send(response)
-        return new_pattern
+        if response is not None:
+            pipe.send(response)
+        return (segment, new_pattern) if new_pattern is not None else None
 
     except Exception as e:
         print(repr(e))
         pipe.send(command_from_pipe.response(CommandResponse.Status.FAILED, e))
         return None
 
+    finally:
+        context.profiler.record('command', type(command_from_pipe).__name__, time.perf_counter() - start_time)
+
 
 def receive_from_pipe(pipe, timeout=-1) -> Optional[Command]:
     if timeout < 0 or pipe.poll(timeout):
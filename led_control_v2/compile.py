@@ -0,0 +1,207 @@
+from bisect import bisect_left
+from itertools import accumulate
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from led_strip.frame_buffer import FrameBuffer
+
+from .pattern import Frame, Pattern, ColorPattern, NothingPattern, Reversed, Stretch, SwitchingPattern, OnePxChase, \
+    ChasePattern, Timed, NTimes, Once, Twice, Cached, SpectrumBars, BeatPulse
+
+Kernel = Callable[[float, int], Optional[Frame]]
+"""
+Function that takes (progress: float, total_leds: int) and returns the frame, same as Pattern.render_frame
+"""
+
+
+class CompiledPattern(Pattern):
+    """
+    Pattern tree flattened into a single render function by compile_pattern. The original tree is kept as a
+    child, so its state still gets updated after every frame and calculate_pixel still works.
+    """
+
+    def __init__(self, tree: Pattern, kernel: Kernel, static: bool = False):
+        super().__init__([tree])
+        self.tree = tree
+        self._kernel = kernel
+        self._static = static
+
+    def calculate_pixel(self, progress: float, index: int, total_leds: int):
+        return self.tree.calculate_pixel(progress, index, total_leds)
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        return self._kernel(progress, total_leds)
+
+    def render_into(self, progress: float, total_leds: int, buffer: FrameBuffer):
+        # Trees that draw only what changed are already cheaper than any whole-frame kernel
+        if type(self.tree).render_into is not Pattern.render_into:
+            self.tree.render_into(progress, total_leds, buffer)
+        else:
+            super().render_into(progress, total_leds, buffer)
+
+    def is_static(self) -> bool:
+        return self._static or self.tree.is_static()
+
+    def is_deterministic(self) -> bool:
+        return self.tree.is_deterministic()
+
+
+class _Compiled:
+    def __init__(self, kernel: Kernel, constant: bool = False, color: Optional[int] = None):
+        self.kernel = kernel
+        self.constant = constant
+        self.color = color
+        """
+        Color of every pixel on every frame if constant is set, None meaning the pattern never draws anything
+        """
+
+
+def compile_pattern(pattern: Pattern) -> Pattern:
+    """
+    Turns a pattern tree into one render function where possible:
+
+    - ColorPatterns (and anything that only wraps them) become a constant frame that is only built once per size
+    - Reversed and Stretch become slices of their sub pattern's frame instead of separate nodes
+    - SwitchingPattern picks its sub pattern with one binary search per frame
+
+    Nodes it doesn't know how to flatten are rendered through their own render_frame. Returns the pattern itself
+    if nothing could be compiled.
+    """
+    compiled = _compile(pattern)
+    if compiled.kernel == pattern.render_frame:
+        return pattern
+    return CompiledPattern(pattern, compiled.kernel, compiled.constant)
+
+
+def _compile(pattern: Pattern) -> _Compiled:
+    compiler = _compilers.get(type(pattern))
+    if compiler is None:
+        return _Compiled(pattern.render_frame)
+    return compiler(pattern)
+
+
+def _constant(color: Optional[int]) -> _Compiled:
+    if color is None:
+        return _Compiled(lambda progress, total_leds: None, True, None)
+
+    frames: Dict[int, Frame] = {}
+
+    def kernel(progress: float, total_leds: int) -> Frame:
+        frame = frames.get(total_leds)
+        if frame is None:
+            frame = np.full(total_leds, color, dtype=np.uint32)
+            # Handed out every frame, so make sure nobody draws on it
+            frame.flags.writeable = False
+            frames[total_leds] = frame
+        return frame
+
+    return _Compiled(kernel, True, color)
+
+
+def _compile_color(pattern: ColorPattern) -> _Compiled:
+    return _constant(pattern.color)
+
+
+def _compile_nothing(pattern: NothingPattern) -> _Compiled:
+    return _constant(None)
+
+
+def _compile_reversed(pattern: Reversed) -> _Compiled:
+    sub = _compile(pattern._sub_pattern)
+    if sub.constant:
+        return sub
+
+    sub_kernel = sub.kernel
+
+    def kernel(progress: float, total_leds: int) -> Optional[Frame]:
+        frame = sub_kernel(progress, total_leds)
+        return None if frame is None else frame[::-1]
+
+    return _Compiled(kernel)
+
+
+def _compile_stretch(pattern: Stretch) -> _Compiled:
+    sub = _compile(pattern._sub_pattern)
+    if sub.constant:
+        return sub
+    if pattern._factor < 1:
+        return _Compiled(pattern.render_frame)
+
+    sub_kernel = sub.kernel
+    factor = pattern._factor
+
+    def kernel(progress: float, total_leds: int) -> Optional[Frame]:
+        frame = sub_kernel(progress, int(total_leds * factor))
+        return None if frame is None else frame[:total_leds]
+
+    return _Compiled(kernel)
+
+
+def _compile_switching(pattern: SwitchingPattern) -> _Compiled:
+    subs = [_compile(sub_pattern) for sub_pattern in pattern._sub_patterns]
+    if all(sub.constant for sub in subs) and len(set(sub.color for sub in subs)) == 1:
+        return subs[0]
+
+    # Same running sums as SwitchingPattern._current_pattern, so the same sub pattern is picked
+    thresholds = list(accumulate(pattern._weights))
+    kernels = [sub.kernel for sub in subs]
+    last = len(kernels) - 1
+
+    def kernel(progress: float, total_leds: int) -> Optional[Frame]:
+        return kernels[min(bisect_left(thresholds, progress), last)](progress, total_leds)
+
+    return _Compiled(kernel)
+
+
+def _compile_one_px_chase(pattern: OnePxChase) -> _Compiled:
+    sub = _compile(pattern._sub_pattern)
+    background = _compile(pattern._background)
+    sub_kernel = sub.kernel
+    background_kernel = background.kernel
+
+    def kernel(progress: float, total_leds: int) -> Frame:
+        frame = background_kernel(progress, total_leds)
+        frame = np.zeros(total_leds, dtype=np.uint32) if frame is None else frame.copy()
+        active_led = round(progress * total_leds)
+        if active_led < total_leds:
+            if sub.constant:
+                frame[active_led] = 0 if sub.color is None else sub.color
+            else:
+                sub_frame = sub_kernel(progress, total_leds)
+                frame[active_led] = 0 if sub_frame is None else sub_frame[active_led]
+        return frame
+
+    return _Compiled(kernel)
+
+
+def _compile_sub_patterns(pattern: Pattern, *attributes: str) -> _Compiled:
+    """
+    For stateful nodes that can't be flattened themselves: compiles the sub patterns they render from, and
+    leaves the node rendering through its own render_frame.
+    """
+    for attribute in attributes:
+        original = getattr(pattern, attribute)
+        compiled = compile_pattern(original)
+        setattr(pattern, attribute, compiled)
+        # Walking the tree through the children (find_patterns, FrameProfiler.instrument) has to reach it as well
+        pattern._children = [compiled if child is original else child for child in pattern._children]
+    return _Compiled(pattern.render_frame)
+
+
+_compilers: Dict[type, Callable[..., _Compiled]] = {
+    ColorPattern: _compile_color,
+    NothingPattern: _compile_nothing,
+    Reversed: _compile_reversed,
+    Stretch: _compile_stretch,
+    SwitchingPattern: _compile_switching,
+    OnePxChase: _compile_one_px_chase,
+    ChasePattern: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern'),
+    Timed: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern'),
+    NTimes: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern', '_after'),
+    Once: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern', '_after'),
+    Twice: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern', '_after'),
+    Cached: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern'),
+    SpectrumBars: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern'),
+    BeatPulse: lambda pattern: _compile_sub_patterns(pattern, '_sub_pattern'),
+}
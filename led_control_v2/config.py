@@ -1,40 +1,120 @@
+import os
+import tempfile
 from typing import Dict, Any, Optional, List
 
-from rpi_ws281x import Color
-
 from .command import CommandHandler
-from .pattern import ColorPattern, FullRandomPattern, Pattern, OnePxChase, Timed, Twice, NTimes, Reversed, ChasePattern, \
-    SwitchingPattern, Stretch
+from .pattern_definitions import load_pattern_file
+from .scheduler import CatchUp
 
 LED_COUNT = 300
 LED_PIN = 18
 LED_FREQ_HZ = 800000
 LED_DMA = 10
+# Initial brightness of every segment, applied in software by the post processors
 LED_BRIGHTNESS = 255
 LED_INVERT = False
 LED_CHANNEL = 0
 
+# Physical strips, laid out one after another in the frame buffer. Each needs its own PWM channel (pins 12/18 are
+# channel 0, 13/19 channel 1) and its own DMA channel.
+OUTPUTS = [
+    {'count': LED_COUNT, 'pin': LED_PIN, 'channel': LED_CHANNEL, 'dma': LED_DMA},
+    # {'count': 150, 'pin': 13, 'channel': 1, 'dma': 11},
+]
+TOTAL_LED_COUNT = sum(output['count'] for output in OUTPUTS)
+
+# Named, non overlapping (start, end) ranges of the frame buffer that each get their own pattern, brightness and
+# increment. They may span several outputs. Commands that don't name a segment go to DEFAULT_SEGMENT.
+SEGMENTS = {
+    'all': (0, TOTAL_LED_COUNT),
+}
+DEFAULT_SEGMENT = 'all'
+
+# 'ws281x' for real hardware, 'virtual' to run anywhere (see led_strip/strip.py)
+STRIP_BACKEND = os.environ.get('LED_STRIP_BACKEND', 'ws281x')
+VIRTUAL_STRIP_HISTORY = 600
+VIRTUAL_STRIP_SIMULATE_WIRE_TIME = True
+
 
 REFRESH_RATE_TARGET_HZ = 60
 INITIAL_PROGRESS = 0
 INITIAL_PROGRESS_INCREMENT = 1 / REFRESH_RATE_TARGET_HZ
-FADE_OUT_SPEED = 10
-
-
-patterns = ['halloween1', 'Random Chase', 'RGB Chase', 'Random Waves', 'Full Random (Debug)']
-pattern_constructors = {
-    'halloween1': lambda: OnePxChase(ColorPattern(Color(255, 127, 0))),
-    'Random Chase': lambda: Reversed(ChasePattern(FullRandomPattern())),
-    'RGB Chase': lambda: Stretch(4,
-                                 ChasePattern(
-                                     SwitchingPattern(
-                                         [
-                                             ColorPattern(Color(255, 0, 0)),
-                                             ColorPattern(Color(0, 255, 0)),
-                                             ColorPattern(Color(0, 0, 255))
-                                         ],
-                                         [1, 1, 1]),
-                                     blend=True)),
-    'Full Random (Debug)': lambda: FullRandomPattern(),
-    'Random Waves': lambda: ChasePattern(FullRandomPattern(), blend=True)
-}
+FRAME_CATCH_UP = CatchUp.SKIP
+MAX_COMMANDS_PER_FRAME = 64
+COMPILE_PATTERNS = True
+# Seconds to crossfade from the old pattern to the new one when switching, 0 to cut straight over
+TRANSITION_S = 1.0
+# Processes rendering the segments in parallel (see render_pool.py). 1 renders everything in the render loop itself.
+# Work is split by segment, a segment is never split between workers, so only installations with several segments
+# benefit. At most one worker per segment is started, and with a single segment everything is rendered in the render
+# loop, since one worker would only add the round trip to it.
+RENDER_WORKERS = int(os.environ.get('LED_RENDER_WORKERS', 1))
+# How often the render loop wakes up to check for UDP frames and preview readers while a static pattern is showing
+IDLE_POLL_INTERVAL_S = 0.25
+
+PREVIEW_SLOTS = 4
+PREVIEW_IDLE_TIMEOUT_S = 2
+# Every open /preview stream holds a web server thread, so streams end after PREVIEW_STREAM_MAX_S (browsers reconnect
+# on their own) and send a keepalive every PREVIEW_KEEPALIVE_S while the frame doesn't change, which is how a client
+# that went away is noticed.
+PREVIEW_STREAM_MAX_S = 300
+PREVIEW_KEEPALIVE_S = 5
+
+# Unix socket the render daemon listens on for web server workers when running under a production server (see
+# daemon.py and wsgi.py), and the key they need to connect with. Anyone who can connect can make the daemon run code,
+# and the daemon can make its clients run code, so the socket lives in a directory only its user can get into:
+# $XDG_RUNTIME_DIR/led-control, or led-control-<uid> in the temp directory, which is created with mode 0700. Without a
+# key the daemon generates one on every start and leaves it next to the socket for clients of the same user. Web
+# server workers running as another user need LED_DAEMON_ADDRESS in a directory they can reach and LED_DAEMON_AUTHKEY.
+RENDER_DAEMON_ADDRESS = os.environ.get('LED_DAEMON_ADDRESS') or os.path.join(
+    os.path.join(os.environ['XDG_RUNTIME_DIR'], 'led-control') if os.environ.get('XDG_RUNTIME_DIR') else
+    os.path.join(tempfile.gettempdir(), f'led-control-{os.getuid()}'), 'daemon.sock')
+RENDER_DAEMON_AUTHKEY = os.environ.get('LED_DAEMON_AUTHKEY', '').encode() or None
+
+# Timing histograms of every phase of a frame and of every command, served at /metrics (see profiling.py).
+# PROFILE_PATTERN_NODES also times every node of the pattern trees, which costs a few microseconds per node and frame.
+PROFILING = os.environ.get('LED_PROFILING', '') == '1'
+PROFILE_PATTERN_NODES = os.environ.get('LED_PROFILE_PATTERN_NODES', '') == '1'
+
+# Frames pushed over UDP take over from the current pattern until none arrive for INGEST_TIMEOUT_S (see ingest.py).
+# 'ddp', 'e131' or None to not listen at all. INGEST_PORT None means the protocol's usual port. There's no
+# authentication, anyone who can reach INGEST_HOST can take over the strips, so it's off unless asked for, and
+# INGEST_HOST should be the address of the interface the sender is on rather than all of them where possible.
+INGEST_PROTOCOL = os.environ.get('LED_INGEST_PROTOCOL') or None
+INGEST_HOST = os.environ.get('LED_INGEST_HOST', '0.0.0.0')
+INGEST_PORT = None
+INGEST_TIMEOUT_S = 2
+E131_START_UNIVERSE = 1
+
+# Applied to every frame on its way to the strips (see post_process.py). Gamma is one value or one each for
+# (r, g, b, w), 1 sends colors as rendered and around 2.2 to 2.8 makes brightness steps look even on most LEDs.
+# COLOR_TEMPERATURE_K shifts white towards the given temperature (6500 is neutral), None leaves colors alone.
+# TEMPORAL_DITHERING shows levels between the 256 a channel has by alternating frames, which smooths out low
+# brightness, but sends every frame to the strips even while the pattern is static.
+OUTPUT_GAMMA = 1.0
+COLOR_TEMPERATURE_K = None
+TEMPORAL_DITHERING = False
+# Audio input for music reactive patterns like SpectrumBars and BeatPulse (see audio.py): 'alsa', 'wav' (loops the
+# file), 'stdin' (raw 16 bit PCM) or None for none. AUDIO_INPUT is the ALSA device or the path of the WAV file.
+# Every AUDIO_BLOCK_SIZE samples the newest AUDIO_FFT_SIZE are analysed into AUDIO_BANDS bands.
+AUDIO_SOURCE = os.environ.get('LED_AUDIO_SOURCE') or None
+AUDIO_INPUT = os.environ.get('LED_AUDIO_INPUT', 'default')
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+AUDIO_BLOCK_SIZE = 512
+AUDIO_FFT_SIZE = 2048
+AUDIO_BANDS = 16
+AUDIO_MIN_HZ = 40
+AUDIO_MAX_HZ = 16000
+AUDIO_DYNAMIC_RANGE_DB = 40
+
+# Seconds to fade to black on shutdown
+FADE_OUT_S = 0.5
+
+
+# Pattern definitions (see pattern_definitions.py), can be replaced at runtime with PUT /patterns
+PATTERN_FILE = os.environ.get('LED_PATTERN_FILE', os.path.join(os.path.dirname(__file__), 'patterns.json'))
+pattern_constructors = load_pattern_file(PATTERN_FILE)
+patterns = list(pattern_constructors)
+# Room in the state snapshot for the pattern names, as JSON, so GET /patterns doesn't have to ask the render loop
+PATTERN_NAMES_BYTES = 64 * 1024
@@ -0,0 +1,200 @@
+import os
+import secrets
+import signal
+import socket
+import stat
+import threading
+import uuid
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from typing import Deque, Dict, Optional, Tuple
+
+from .channel import CommandChannel
+from .command import Command, CommandResponse
+from .config import RENDER_DAEMON_ADDRESS, RENDER_DAEMON_AUTHKEY, TOTAL_LED_COUNT, PREVIEW_SLOTS, \
+    PREVIEW_IDLE_TIMEOUT_S, PROFILING, PROFILE_PATTERN_NODES
+from .led_control import run_control_loop
+from .preview import SharedFrameBuffer
+from .profiling import FrameProfiler
+from .state import StateSnapshot
+
+SharedState = Tuple[StateSnapshot, SharedFrameBuffer, Optional[FrameProfiler]]
+
+
+class CommandBus:
+    """
+    Render loop side of the daemon's socket, in place of the command pipe. Any number of web server workers can be
+    connected: their commands come out of recv in the order they arrived, and send routes each response back to the
+    worker that sent the command.
+
+    Every worker gets the shared state first, so it reads settings, preview and metrics straight from shared memory
+    like a web server started with the render loop.
+    """
+
+    def __init__(self, listener: Listener, shared_state: SharedState):
+        self._listener = listener
+        self._shared_state = shared_state
+        self._closed = False
+        self._commands: Deque[Tuple[Connection, Command]] = deque()
+        self._arrived = threading.Condition()
+        self._senders: Dict[uuid.UUID, Connection] = {}
+        """
+        Connection of every command handed out by recv and not answered yet, only used by the render loop
+        """
+
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def poll(self, timeout: float = 0) -> bool:
+        with self._arrived:
+            return self._arrived.wait_for(lambda: len(self._commands) > 0, timeout)
+
+    def recv(self) -> Command:
+        with self._arrived:
+            self._arrived.wait_for(lambda: len(self._commands) > 0)
+            conn, command = self._commands.popleft()
+        self._senders[command.id] = conn
+        return command
+
+    def send(self, response: CommandResponse):
+        conn = self._senders.pop(response.command_id, None)
+        if conn is None:
+            return
+        try:
+            conn.send(response)
+        except OSError:
+            # The worker went away while its command was being handled
+            pass
+
+    def close(self):
+        self._closed = True
+        self._listener.close()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                conn = self._listener.accept()
+                conn.send(self._shared_state)
+            except (AuthenticationError, EOFError, OSError) as e:
+                if not self._closed:
+                    print(repr(e))
+                continue
+            threading.Thread(target=self._receive, args=(conn,), daemon=True).start()
+
+    def _receive(self, conn: Connection):
+        while True:
+            try:
+                command = conn.recv()
+            except (EOFError, OSError):
+                conn.close()
+                return
+            except Exception as e:
+                # Messages are framed, so one that doesn't unpickle doesn't affect the next
+                print(repr(e))
+                continue
+
+            if isinstance(command, Command):
+                with self._arrived:
+                    self._commands.append((conn, command))
+                    self._arrived.notify()
+
+
+def run_daemon(address: str = RENDER_DAEMON_ADDRESS, authkey: Optional[bytes] = RENDER_DAEMON_AUTHKEY):
+    """
+    Runs the render loop, taking commands from web server workers connecting to the Unix socket at address, until
+    interrupted with Ctrl+C or SIGTERM. Without an authkey it generates one for clients to read (see
+    connect_to_daemon).
+    """
+    _ensure_private_directory(os.path.dirname(address), create=True)
+    _remove_stale_socket(address)
+    if authkey is None:
+        authkey = _create_authkey(address)
+    # Created without permissions for anyone else, rather than restricted after it's already there
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(address, 'AF_UNIX', authkey=authkey)
+    finally:
+        os.umask(umask)
+
+    snapshot = StateSnapshot()
+    preview = SharedFrameBuffer(TOTAL_LED_COUNT, PREVIEW_SLOTS, PREVIEW_IDLE_TIMEOUT_S)
+    profiler = FrameProfiler(PROFILE_PATTERN_NODES) if PROFILING else None
+    bus = CommandBus(listener, (snapshot, preview, profiler))
+
+    # Service managers stop with SIGTERM, which should fade out like Ctrl+C does
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        run_control_loop(bus, snapshot, preview, profiler)
+    finally:
+        bus.close()
+        snapshot.close()
+        preview.close()
+        if profiler is not None:
+            profiler.close()
+
+
+def connect_to_daemon(address: str = RENDER_DAEMON_ADDRESS, authkey: Optional[bytes] = RENDER_DAEMON_AUTHKEY) \
+        -> Tuple[CommandChannel, StateSnapshot, SharedFrameBuffer, Optional[FrameProfiler]]:
+    """
+    Connects a web server worker to the render daemon, returns the channel to send commands through and the shared
+    state to read from. Without an authkey it uses the one the daemon generated, after checking nobody else could
+    have put it or the socket there.
+    """
+    if authkey is None:
+        _ensure_private_directory(os.path.dirname(address), create=False)
+        with open(_authkey_path(address), 'rb') as f:
+            authkey = f.read()
+    conn = Client(address, 'AF_UNIX', authkey=authkey)
+    snapshot, preview, profiler = conn.recv()
+    return CommandChannel(conn), snapshot, preview, profiler
+
+
+def _ensure_private_directory(path: str, create: bool):
+    """
+    Makes sure path is a directory of this user that nobody else can write to, so no one else can have put a socket
+    or key there. Creates it with mode 0700 if it doesn't exist and create is set.
+    """
+    if create:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise RuntimeError(f'{path} has to be a directory of this user that only it can write to')
+
+
+def _authkey_path(address: str) -> str:
+    return address + '.key'
+
+
+def _create_authkey(address: str) -> bytes:
+    """
+    Generates a key and writes it next to the socket, readable only by this user
+    """
+    authkey = secrets.token_bytes(32)
+    path = _authkey_path(address)
+    temporary = f'{path}.{os.getpid()}'
+    fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(authkey)
+    os.replace(temporary, path)
+    return authkey
+
+
+def _remove_stale_socket(address: str):
+    """
+    Removes the socket a daemon that didn't shut down cleanly left behind, but refuses to start next to a running one
+    """
+    if not os.path.exists(address):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(address)
+    except ConnectionRefusedError:
+        os.unlink(address)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f'A render daemon is already listening on {address}')
+
+
+if __name__ == '__main__':
+    run_daemon()
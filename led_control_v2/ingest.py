@@ -0,0 +1,214 @@
+import socket
+import struct
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Dict, Iterator, Optional, Type
+
+import numpy as np
+
+_MAX_PACKET_SIZE = 1500
+
+
+class IngestProtocol(ABC):
+    """
+    Parses packets of one protocol. parse() copies the pixel data straight from the packet into `rgb` (3 bytes per
+    LED) and returns True once a frame is complete.
+    """
+
+    default_port: int
+
+    @abstractmethod
+    def parse(self, packet: memoryview, rgb: memoryview) -> bool:
+        pass
+
+
+class DdpProtocol(IngestProtocol):
+    """
+    Distributed Display Protocol: a 10 byte header (14 with a timecode) with the byte offset and length of the data,
+    and a push flag on the last packet of a frame.
+    """
+
+    default_port = 4048
+
+    VERSION_1 = 0x40
+    FLAG_PUSH = 0x01
+    FLAG_TIMECODE = 0x10
+    HEADER = struct.Struct('>BBBBIH')
+    MAX_DATA_LENGTH = 1440
+
+    def parse(self, packet: memoryview, rgb: memoryview) -> bool:
+        if len(packet) < self.HEADER.size:
+            return False
+
+        flags, _, _, _, offset, length = self.HEADER.unpack_from(packet)
+        if flags & 0xc0 != self.VERSION_1:
+            return False
+
+        start = self.HEADER.size + (4 if flags & self.FLAG_TIMECODE else 0)
+        # A header with a timecode but no room for it leaves nothing to copy
+        length = max(0, min(length, len(packet) - start, len(rgb) - offset))
+        rgb[offset:offset + length] = packet[start:start + length]
+
+        return bool(flags & self.FLAG_PUSH)
+
+
+class E131Protocol(IngestProtocol):
+    """
+    E1.31 (sACN): one DMX universe of up to 170 RGB pixels per packet. Universes are laid out one after another
+    starting at start_universe, and a frame is complete when the universe holding the last LED arrives.
+    """
+
+    default_port = 5568
+
+    PACKET_IDENTIFIER = b'ASC-E1.17\x00\x00\x00'
+    VECTOR_DATA = 0x00000002
+    PIXELS_PER_UNIVERSE = 170
+    DATA_START = 126
+
+    def __init__(self, start_universe: int = 1):
+        self.start_universe = start_universe
+
+    def parse(self, packet: memoryview, rgb: memoryview) -> bool:
+        if len(packet) <= self.DATA_START or packet[4:16] != self.PACKET_IDENTIFIER:
+            return False
+
+        vector, = struct.unpack_from('>I', packet, 40)
+        universe, = struct.unpack_from('>H', packet, 113)
+        value_count, = struct.unpack_from('>H', packet, 123)
+        start_code = packet[125]
+        if vector != self.VECTOR_DATA or start_code != 0 or universe < self.start_universe:
+            return False
+
+        offset = (universe - self.start_universe) * self.PIXELS_PER_UNIVERSE * 3
+        if offset >= len(rgb):
+            return False
+
+        # The value count includes the start code, so 0 is malformed and 1 carries no pixels
+        length = max(0, min(value_count - 1, len(packet) - self.DATA_START, self.PIXELS_PER_UNIVERSE * 3,
+                            len(rgb) - offset))
+        rgb[offset:offset + length] = packet[self.DATA_START:self.DATA_START + length]
+
+        return offset + self.PIXELS_PER_UNIVERSE * 3 >= len(rgb)
+
+
+ingest_protocols: Dict[str, Type[IngestProtocol]] = {
+    'ddp': DdpProtocol,
+    'e131': E131Protocol
+}
+
+
+class UdpIngest:
+    """
+    Listens for frames rendered somewhere else. Packets are received into one preallocated buffer and their pixel
+    data copied directly into the back half of a double-buffered RGB frame, so there are no allocations per packet.
+    When a frame is complete the halves are swapped and the render loop picks it up.
+
+    While frames keep arriving (within timeout seconds of each other) the ingest takes over the strip, after that
+    the render loop goes back to its pattern.
+    """
+
+    def __init__(self, protocol: IngestProtocol, num_leds: int, port: int, timeout: float, host: str = '0.0.0.0'):
+        self.protocol = protocol
+        self.timeout = timeout
+        self.frames_received = 0
+
+        self._packet = bytearray(_MAX_PACKET_SIZE)
+        self._front = bytearray(num_leds * 3)
+        self._back = bytearray(num_leds * 3)
+        self._frame = np.zeros(num_leds, dtype=np.uint32)
+        self._swap_lock = threading.Lock()
+        self._new_frame = False
+        self._last_frame_time = -float('inf')
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self.port = self._socket.getsockname()[1]
+
+        self._thread = threading.Thread(target=self._receive, daemon=True)
+        self._thread.start()
+
+    def is_active(self) -> bool:
+        return time.monotonic() - self._last_frame_time < self.timeout
+
+    def frame(self) -> np.ndarray:
+        """
+        Returns the newest complete frame. Only converts from RGB bytes when a new frame has arrived.
+        """
+        with self._swap_lock:
+            if self._new_frame:
+                rgb = np.frombuffer(self._front, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+                self._frame[:] = (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+                self._new_frame = False
+        return self._frame
+
+    def close(self):
+        self._socket.close()
+
+    def _receive(self):
+        packet = memoryview(self._packet)
+        while True:
+            try:
+                size = self._socket.recv_into(packet)
+            except OSError:
+                return
+
+            try:
+                complete = self.protocol.parse(packet[:size], memoryview(self._back))
+            except Exception as e:
+                # Drop the packet, one bad sender shouldn't stop ingest
+                print(repr(e))
+                continue
+
+            if complete:
+                with self._swap_lock:
+                    self._front, self._back = self._back, self._front
+                    self._new_frame = True
+                    self._last_frame_time = time.monotonic()
+                self.frames_received += 1
+                # Keep pixels the next frame doesn't send
+                self._back[:] = self._front
+
+
+def create_ingest(protocol: str, num_leds: int, port: Optional[int], timeout: float, host: str = '0.0.0.0',
+                  **protocol_args) -> UdpIngest:
+    if protocol not in ingest_protocols:
+        raise ValueError(f'Unknown ingest protocol {protocol!r}, expected one of {list(ingest_protocols)}')
+    ingest_protocol = ingest_protocols[protocol](**protocol_args)
+    return UdpIngest(ingest_protocol, num_leds, port if port is not None else ingest_protocol.default_port, timeout,
+                     host)
+
+
+def ddp_packets(rgb: bytes, sequence: int = 0) -> Iterator[bytes]:
+    """
+    Splits one frame of RGB bytes into DDP packets, the last one with the push flag set
+    """
+    for offset in range(0, len(rgb), DdpProtocol.MAX_DATA_LENGTH):
+        data = rgb[offset:offset + DdpProtocol.MAX_DATA_LENGTH]
+        flags = DdpProtocol.VERSION_1
+        if offset + len(data) >= len(rgb):
+            flags |= DdpProtocol.FLAG_PUSH
+        yield DdpProtocol.HEADER.pack(flags, sequence & 0x0f, 0x0b, 1, offset, len(data)) + data
+
+
+def e131_packets(rgb: bytes, start_universe: int = 1, sequence: int = 0) -> Iterator[bytes]:
+    """
+    Splits one frame of RGB bytes into E1.31 data packets, one per universe
+    """
+    universe_size = E131Protocol.PIXELS_PER_UNIVERSE * 3
+    for i, offset in enumerate(range(0, len(rgb), universe_size)):
+        data = rgb[offset:offset + universe_size]
+        length = E131Protocol.DATA_START + len(data)
+
+        packet = bytearray(length)
+        struct.pack_into('>HH', packet, 0, 0x0010, 0x0000)
+        packet[4:16] = E131Protocol.PACKET_IDENTIFIER
+        struct.pack_into('>HI', packet, 16, 0x7000 | (length - 16), 0x00000004)
+        struct.pack_into('>HI', packet, 38, 0x7000 | (length - 38), E131Protocol.VECTOR_DATA)
+        packet[44:44 + 14] = b'pi-led-server\x00'
+        struct.pack_into('>BHBBH', packet, 108, 100, 0, sequence & 0xff, 0, start_universe + i)
+        struct.pack_into('>HBBHHH', packet, 115, 0x7000 | (length - 115), 0x02, 0xa1, 0, 1, len(data) + 1)
+        packet[125] = 0
+        packet[E131Protocol.DATA_START:] = data
+        yield bytes(packet)
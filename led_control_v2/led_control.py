@@ -1,84 +1,265 @@
-import math
 import time
 from multiprocessing import Pipe
+from typing import Callable, Optional, Dict, List
 
-from rpi_ws281x import PixelStrip
+from led_strip.frame_buffer import FrameBuffer
+from led_strip.strip import create_strip
 
-from .command import process_command
+from .audio import AudioAnalyzer, start_audio
+from .command import CommandResponse, process_commands
 from .config import *
-from .pattern import Pattern, NothingPattern
-
-
-class LedStrip(PixelStrip):
-    def __init__(self):
-        super().__init__(LED_COUNT, LED_PIN, LED_FREQ_HZ, LED_DMA, LED_INVERT, LED_BRIGHTNESS, LED_CHANNEL)
+from .ingest import UdpIngest, create_ingest
+from .pattern import Cached, find_patterns
+from .pattern_builder import PatternBuilder
+from .post_process import PostProcessor
+from .preview import SharedFrameBuffer
+from .profiling import FrameProfiler, NullProfiler
+from .scheduler import FrameScheduler
+from .render_pool import RenderPool
+from .segment import Segment, Output
+from .state import StateSnapshot
 
 
 class Context:
-    def __init__(self, strip: PixelStrip):
-        self.current_pattern = NothingPattern()
-        self.current_progress = INITIAL_PROGRESS
-        self.progress_increment = INITIAL_PROGRESS_INCREMENT
-        self.strip = strip
+    def __init__(self, outputs: List[Output], snapshot: StateSnapshot = None, preview: SharedFrameBuffer = None,
+                 pool: Optional[RenderPool] = None, profiler: FrameProfiler = None):
+        self.outputs = outputs
+        self.pool = pool
+        self.profiler = profiler if profiler is not None else NullProfiler()
+        # Render workers compile their patterns themselves, compiled or instrumented patterns can't be sent to them
+        self.pattern_builder = PatternBuilder(COMPILE_PATTERNS and pool is None,
+                                              self.profiler if pool is None else NullProfiler())
+        self.scheduler = FrameScheduler(REFRESH_RATE_TARGET_HZ, FRAME_CATCH_UP)
+        self.snapshot = snapshot
+        self.preview = preview
+        self.ingest: Optional[UdpIngest] = None
+        self.respond: Callable[[CommandResponse], None] = lambda response: None
+        """
+        Sends the response of a command that answers after it was handled (see Command.handle)
+        """
+        self.audio: Optional[AudioAnalyzer] = None
+        self.audio_latency = 0.0
+        """
+        Seconds from the newest sample the last audio reactive frame used being recorded to that frame being shown
+        """
+        self.frame_buffer = FrameBuffer(sum(output.end - output.start for output in outputs),
+                                        pool.pixels if pool is not None else None)
+        self.segments: Dict[str, Segment] = {
+            name: Segment(name, self.frame_buffer, start, end, INITIAL_PROGRESS, INITIAL_PROGRESS_INCREMENT,
+                          LED_BRIGHTNESS, pool)
+            for name, (start, end) in SEGMENTS.items()
+        }
         self.pattern_constructors = pattern_constructors
 
+    def segment(self, name: Optional[str] = None) -> Segment:
+        """
+        The segment called name, or the default one if name is None. Raises KeyError for unknown segments.
+        """
+        return self.segments[DEFAULT_SEGMENT if name is None else name]
+
 
-def run_control_loop(pipe):
-    context = _init_context()
+def run_control_loop(pipe, snapshot: StateSnapshot = None, preview: SharedFrameBuffer = None,
+                     profiler: FrameProfiler = None, stdin_fd: Optional[int] = None):
+    """
+    Runs the render loop until interrupted. stdin_fd is a copy of the parent's stdin for AUDIO_SOURCE 'stdin' when
+    running in a child process, whose own stdin multiprocessing replaces with /dev/null.
+    """
+    context = _init_context(snapshot, preview, profiler, stdin_fd)
+    context.respond = pipe.send
 
     try:
         _main_loop(pipe, context)
     except KeyboardInterrupt:
         pass
     finally:
-        _fade_out(context.strip)
+        context.pattern_builder.close()
+        if context.audio is not None:
+            context.audio.close()
+        if context.pool is not None:
+            context.pool.close()
+        if context.ingest is not None:
+            context.ingest.close()
+        _fade_out(context)
+
+
+def _init_context(snapshot: StateSnapshot = None, preview: SharedFrameBuffer = None,
+                  profiler: FrameProfiler = None, stdin_fd: Optional[int] = None) -> Context:
+    total = sum(output['count'] for output in OUTPUTS)
+    for name, (segment_start, segment_end) in SEGMENTS.items():
+        if not 0 <= segment_start < segment_end <= total:
+            raise ValueError(f"Segment {name} ({segment_start}, {segment_end}) doesn't fit the {total} LEDs")
+    by_start = sorted(SEGMENTS.items(), key=lambda item: item[1][0])
+    for (name, (_, end)), (next_name, (next_start, next_end)) in zip(by_start, by_start[1:]):
+        if next_start < end:
+            raise ValueError(f'Segment {next_name} ({next_start}, {next_end}) overlaps segment {name}')
+
+    # Started before the render workers, so their audio patterns can read the analysis as well
+    audio = start_audio(AUDIO_SOURCE, AUDIO_INPUT, AUDIO_SAMPLE_RATE, AUDIO_CHANNELS, AUDIO_BLOCK_SIZE, AUDIO_FFT_SIZE,
+                        AUDIO_BANDS, AUDIO_MIN_HZ, AUDIO_MAX_HZ, AUDIO_DYNAMIC_RANGE_DB, profiler, stdin_fd) \
+        if AUDIO_SOURCE is not None else None
 
+    # Work is split by segment, and a pool of one worker only adds the round trip to it
+    workers = min(RENDER_WORKERS, len(SEGMENTS))
+    if RENDER_WORKERS > workers:
+        print(f'RENDER_WORKERS is {RENDER_WORKERS}, but a segment is never split between workers and there are only '
+              f'{len(SEGMENTS)}: ' + (f'using {workers} workers' if workers > 1 else 'rendering in the render loop'))
+    # Started before any strip is opened, so the workers don't inherit the hardware
+    pool = RenderPool(total, SEGMENTS, workers, COMPILE_PATTERNS) if workers > 1 else None
 
-def _init_context() -> Context:
-    strip = LedStrip()
-    strip.begin()
-    strip.show()
-    return Context(strip)
+    backend_args = {'history': VIRTUAL_STRIP_HISTORY, 'simulate_wire_time': VIRTUAL_STRIP_SIMULATE_WIRE_TIME} \
+        if STRIP_BACKEND == 'virtual' else {}
+    outputs = []
+    start = 0
+    for output in OUTPUTS:
+        # Full brightness in hardware, the post processors apply each segment's brightness
+        strip = create_strip(STRIP_BACKEND, output['count'], output['pin'], LED_FREQ_HZ, output['dma'], LED_INVERT,
+                             255, output['channel'], **backend_args)
+        strip.begin()
+        strip.show()
+        post_processor = PostProcessor(output['count'], OUTPUT_GAMMA, COLOR_TEMPERATURE_K, TEMPORAL_DITHERING)
+        outputs.append(Output(strip, start, post_processor))
+        start += output['count']
+
+    context = Context(outputs, snapshot, preview, pool, profiler)
+    context.audio = audio
+
+    if INGEST_PROTOCOL is not None:
+        protocol_args = {'start_universe': E131_START_UNIVERSE} if INGEST_PROTOCOL == 'e131' else {}
+        context.ingest = create_ingest(INGEST_PROTOCOL, len(context.frame_buffer), INGEST_PORT, INGEST_TIMEOUT_S,
+                                       INGEST_HOST, **protocol_args)
+
+    return context
 
 
 def _main_loop(pipe: Pipe, context: Context):
     while True:
-        start_time = time.time()
+        process_commands(pipe, context, MAX_COMMANDS_PER_FRAME)
+        for name, new_pattern in context.pattern_builder.take_finished():
+            context.segments[name].set_pattern(new_pattern, INITIAL_PROGRESS, TRANSITION_S)
+        context.profiler.lap('commands')
 
-        new_pattern = process_command(pipe, context)
-        if new_pattern is not None:
-            context.current_pattern = new_pattern
-            context.current_progress = INITIAL_PROGRESS
+        # The patterns are paused while something else is sending frames, and pick up where they were afterwards
+        ingesting = context.ingest is not None and context.ingest.is_active()
+        if ingesting:
+            context.frame_buffer.update(context.ingest.frame())
+            context.profiler.lap('ingest')
+            for segment in context.segments.values():
+                segment.buffer.last_writer = context.ingest
+            if context.pool is not None:
+                context.pool.invalidate()
+            changed = _show_frame_buffer(context)
+        else:
+            changed = _run_patterns(context)
 
-        _run_pattern(context, context.current_pattern, context.current_progress)
-        context.current_progress = _update_progress(context.current_progress, context.progress_increment)
+        _publish_state(context)
+        context.profiler.lap('publish')
 
-        duration = time.time() - start_time
-        target_duration = 1 / REFRESH_RATE_TARGET_HZ
-        sleep_time = target_duration - duration
+        if not changed and not ingesting and not context.pattern_builder.is_busy() and _patterns_static(context):
+            _wait_while_idle(pipe, context)
+            context.profiler.lap('idle')
+            continue
 
-        if sleep_time > 0:
-            time.sleep(sleep_time)
+        steps = context.scheduler.wait_for_next_frame()
+        context.profiler.lap('wait')
+        if not ingesting:
+            for segment in context.segments.values():
+                segment.advance(steps)
 
 
-def _run_pattern(context: Context, pattern: Pattern, progress: float):
-    strip = context.strip
-    for i in range(strip.numPixels()):
-        color = pattern.calculate_pixel(progress, i, strip.numPixels())
-        if color is not None:
-            strip.setPixelColor(i, color)
-    pattern.after_update()
-    strip.show()
+def _run_patterns(context: Context) -> bool:
+    if context.pool is not None:
+        # The workers update their patterns right after rendering, so that's part of this as well
+        context.pool.render({name: segment.progress for name, segment in context.segments.items()},
+                            context.frame_buffer)
+        context.profiler.lap('render')
+        return _show_frame_buffer(context)
 
+    for segment in context.segments.values():
+        segment.render()
+    context.profiler.lap('render')
+    changed = _show_frame_buffer(context)
+    for segment in context.segments.values():
+        segment.after_update()
+    context.profiler.lap('after_update')
+    return changed
 
-def _update_progress(progress: float, progress_increment: float) -> float:
-    progress += progress_increment
-    return progress - math.trunc(progress)
 
+def _patterns_static(context: Context) -> bool:
+    if context.pool is not None:
+        return context.pool.static
+    return all(segment.pattern.is_static() for segment in context.segments.values())
 
-def _fade_out(strip: PixelStrip):
-    for i in range(strip.getBrightness(), -1, -FADE_OUT_SPEED):
-        strip.setBrightness(i)
-        strip.show()
-    strip.setBrightness(0)
-    strip.show()
+
+def _show_frame_buffer(context: Context) -> bool:
+    """
+    Uploads the parts of the frame buffer that changed and shows the strips they're on. Returns False if nothing
+    changed, in which case nothing gets sent to any strip. Strips that dither get every frame.
+    """
+    buffer = context.frame_buffer
+    if context.preview is not None:
+        context.preview.publish(buffer.pixels)
+
+    if not buffer.is_dirty() and not any(output.post_processor.needs_refresh() for output in context.outputs):
+        context.profiler.lap('upload')
+        return False
+
+    dirty = buffer.take_dirty()
+    uploaded = [output for output in context.outputs
+                if output.upload(buffer.pixels, dirty, context.segments.values())]
+    context.profiler.lap('upload')
+    for output in uploaded:
+        output.show()
+    context.profiler.lap('show')
+
+    if context.audio is not None and uploaded:
+        sample_time = context.audio.analysis.take_consumed()
+        if sample_time is not None:
+            context.audio_latency = time.monotonic() - sample_time
+            context.profiler.record('audio', 'sample_to_frame', context.audio_latency)
+    return len(uploaded) > 0
+
+
+def _wait_while_idle(pipe: Pipe, context: Context):
+    """
+    Sleeps until a command comes in or UDP frames start arriving, without rendering anything
+    """
+    while not pipe.poll(IDLE_POLL_INTERVAL_S):
+        if context.ingest is not None and context.ingest.is_active():
+            break
+        if context.preview is not None:
+            context.preview.publish(context.frame_buffer.pixels)
+    context.scheduler.resync()
+
+
+def _publish_state(context: Context):
+    if context.snapshot is None:
+        return
+
+    state = context.scheduler.stats.to_dict()
+    for segment in context.segments.values():
+        state[StateSnapshot.segment_field('brightness', segment.name)] = segment.brightness
+        state[StateSnapshot.segment_field('progress_increment', segment.name)] = segment.progress_increment
+
+    if context.pool is not None:
+        cache_stats = context.pool.cache_stats
+    else:
+        caches = [cache for segment in context.segments.values() for cache in find_patterns(segment.pattern, Cached)]
+        cache_stats = (sum(cache.bytes_used for cache in caches), sum(cache.hits for cache in caches),
+                       sum(cache.misses for cache in caches))
+    state['frame_cache_bytes'], state['frame_cache_hits'], state['frame_cache_misses'] = cache_stats
+    state['audio_latency_ms'] = context.audio_latency * 1000
+    context.snapshot.publish(state)
+
+
+def _fade_out(context: Context):
+    """
+    Fades the last frame to black through the post processors, in steps of one frame
+    """
+    frames = max(1, round(FADE_OUT_S * REFRESH_RATE_TARGET_HZ))
+    everything = [(0, len(context.frame_buffer))]
+    context.scheduler.resync()
+    for i in range(frames - 1, -1, -1):
+        for output in context.outputs:
+            output.upload(context.frame_buffer.pixels, everything, context.segments.values(), i / frames)
+            output.show()
+        context.scheduler.wait_for_next_frame()
@@ -1,10 +1,23 @@
-import colorsys
 import time
 from abc import ABC, abstractmethod
-from random import randint
-from typing import Dict, Any, List
+from collections import OrderedDict
+from typing import List, Optional, TypeVar
 
-from rpi_ws281x import RGBW, Color
+import numpy as np
+
+from led_strip.color import RGBW, Color
+from led_strip.frame_buffer import FrameBuffer
+
+from . import audio
+from .blend import BlendMode, BlendCache, blend_colors, mix_frames
+from .buffered import Buffered, BufferedRing, BufferedValue
+
+Frame = np.ndarray
+"""
+uint32 array with one packed color (same layout as Color) per LED
+"""
+
+B = TypeVar('B', bound=Buffered)
 
 
 class Pattern(ABC):
@@ -13,29 +26,85 @@ class Pattern(ABC):
         if children is None:
             children = []
 
-        self._later_updates: Dict[str, Any] = {}
+        self._buffers: List[Buffered] = []
         self._children = children
 
     @abstractmethod
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
         pass
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        """
+        Calculates every pixel of the strip at once. Returns None if the pattern doesn't want to change anything.
+
+        The default implementation falls back to calling calculate_pixel for every LED, so patterns that only
+        implement calculate_pixel keep working. Pixels it returns None for come out black.
+
+        The returned frame may share memory with the pattern's own state, so copy it before modifying it.
+        """
+        colors = [self.calculate_pixel(progress, i, total_leds) for i in range(total_leds)]
+        if all(color is None for color in colors):
+            return None
+        return np.array([0 if color is None else color for color in colors], dtype=np.uint32)
+
+    def render_into(self, progress: float, total_leds: int, buffer: FrameBuffer):
+        """
+        Draws the frame into buffer. By default that renders a whole frame and lets the buffer work out which pixels
+        changed. Patterns that know exactly which pixels they change can override this to only touch those.
+        """
+        frame = self.render_frame(progress, total_leds)
+        if frame is not None:
+            buffer.update(frame)
+        buffer.last_writer = self
+
+    def is_static(self) -> bool:
+        """
+        Whether render_frame returns the same thing on every frame. The render loop stops rendering static patterns
+        once they're on the strip and waits for the next command instead.
+        """
+        return False
+
+    def is_deterministic(self) -> bool:
+        """
+        Whether render_frame only depends on its arguments, so frames can be rendered once and replayed (see Cached)
+        """
+        return False
+
+    def set_progress_increment(self, progress_increment: float):
+        """
+        Called by the render loop when a pattern is installed and whenever the increment changes
+        """
+        for child in self._children:
+            child.set_progress_increment(progress_increment)
+
     def after_update(self):
-        for key in self._later_updates:
-            exec(f'{key} = self._later_updates[key]')
-        self._later_updates.clear()
+        for buffer in self._buffers:
+            buffer.swap()
 
         for child in self._children:
             child.after_update()
 
-    def _update_later(self, key: str, value: Any):
-        self._later_updates[key] = value
+    def _buffered(self, buffer: B) -> B:
+        """
+        Registers state that should only change once the current frame is done. See Buffered.
+        """
+        self._buffers.append(buffer)
+        return buffer
 
 
 class NothingPattern(Pattern):
     def calculate_pixel(self, progress: float, index: int, total_leds: int):
         return None
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        return None
+
+    def is_static(self) -> bool:
+        return True
+
+    def is_deterministic(self) -> bool:
+        return True
+
 
 class ColorPattern(Pattern):
     def __init__(self, color: RGBW):
@@ -45,11 +114,43 @@ class ColorPattern(Pattern):
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
         return self.color
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        return np.full(total_leds, self.color, dtype=np.uint32)
+
+    def is_static(self) -> bool:
+        return True
+
+    def is_deterministic(self) -> bool:
+        return True
+
 
 class FullRandomPattern(Pattern):
+    """
+    A random color for every pixel, new every frame. The colors of a frame are drawn in one go, the first time the
+    frame asks for one, so both ways of rendering give the same colors. The same seed gives the same frames.
+    """
+
+    def __init__(self, seed: Optional[int] = None):
+        super().__init__()
+        self.seed = seed
+        self._generator = np.random.default_rng(seed)
+        self._colors: Optional[Frame] = None
+
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
-        def randi(): return randint(0, 255)
-        return Color(randi(), randi(), randi())
+        return RGBW(int(self._frame_colors(total_leds)[index]))
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        return self._frame_colors(total_leds)[:total_leds]
+
+    def after_update(self):
+        super().after_update()
+        self._colors = None
+
+    def _frame_colors(self, total_leds: int) -> Frame:
+        if self._colors is None or len(self._colors) < total_leds:
+            # Every 24 bit value is equally likely, so this is the same as picking r, g and b separately
+            self._colors = self._generator.integers(0, 1 << 24, total_leds, dtype=np.uint32)
+        return self._colors
 
 
 class Timed(Pattern):
@@ -60,8 +161,13 @@ class Timed(Pattern):
         self._sub_pattern = sub_pattern
 
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
-        progress = ((time.time() - self._start_time) % self._duration) / self._duration
-        return self._sub_pattern.calculate_pixel(progress, index, total_leds)
+        return self._sub_pattern.calculate_pixel(self._timed_progress(), index, total_leds)
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        return self._sub_pattern.render_frame(self._timed_progress(), total_leds)
+
+    def _timed_progress(self) -> float:
+        return ((time.time() - self._start_time) % self._duration) / self._duration
 
 
 class NTimes(Pattern):
@@ -91,6 +197,17 @@ class NTimes(Pattern):
     def _do_after(self, progress: float, index: int, total_leds: int):
         return self._after.calculate_pixel(progress, index, total_leds)
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        if self._count > 0:
+            if self._prev_progress > progress:
+                self._count -= 1
+            self._prev_progress = progress
+
+        if self._count > 0:
+            return self._sub_pattern.render_frame(progress, total_leds)
+        else:
+            return self._after.render_frame(progress, total_leds)
+
 
 class Once(NTimes):
     def __init__(self, sub_pattern: Pattern):
@@ -111,6 +228,7 @@ class OnePxChase(Pattern):
 
         self._sub_pattern = sub_pattern
         self._background = background
+        self._drawn_led = None
 
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
         active_led = round(progress * total_leds)
@@ -119,6 +237,33 @@ class OnePxChase(Pattern):
         else:
             return self._background.calculate_pixel(progress, index, total_leds)
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        frame = _frame_or_black(self._background, progress, total_leds).copy()
+        active_led = round(progress * total_leds)
+        if active_led < total_leds:
+            frame[active_led] = _frame_or_black(self._sub_pattern, progress, total_leds)[active_led]
+        return frame
+
+    def render_into(self, progress: float, total_leds: int, buffer: FrameBuffer):
+        active_led = round(progress * total_leds)
+
+        sparse = self._background.is_static() and self._sub_pattern.is_static()
+        if not sparse or buffer.last_writer is not self or len(buffer) != total_leds:
+            super().render_into(progress, total_leds, buffer)
+        else:
+            # Everything but the pixel drawn last frame and the new one is already right
+            if self._drawn_led is not None and self._drawn_led < total_leds:
+                buffer.set(self._drawn_led, _color_or_black(
+                    self._background.calculate_pixel(progress, self._drawn_led, total_leds)))
+            if active_led < total_leds:
+                buffer.set(active_led, _color_or_black(
+                    self._sub_pattern.calculate_pixel(progress, active_led, total_leds)))
+
+        self._drawn_led = active_led
+
+    def is_deterministic(self) -> bool:
+        return self._sub_pattern.is_deterministic() and self._background.is_deterministic()
+
 
 class Reversed(Pattern):
     def __init__(self, sub_pattern: Pattern):
@@ -128,67 +273,78 @@ class Reversed(Pattern):
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
         return self._sub_pattern.calculate_pixel(progress, total_leds - 1 - index, total_leds)
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        frame = self._sub_pattern.render_frame(progress, total_leds)
+        if frame is None:
+            return None
+        return frame[::-1]
 
-# Will write docs later, but the idea of having multiple layers is that depending
-# on the direction you want to update in, the pixel you're reading might have already
-# been updated, so you go back one layer to get the real previous value
-#
-# It's dirty and I don't like it but a better solution will take a while and I'd rather do that later if this doesn't work
+    def is_static(self) -> bool:
+        return self._sub_pattern.is_static()
+
+    def is_deterministic(self) -> bool:
+        return self._sub_pattern.is_deterministic()
+
+
+# Pattern that can look at what it drew on the previous frame. Colors calculated during a frame only
+# show up in color_at once the frame is done, so the order pixels are calculated in doesn't matter.
+# The memory is a ring buffer, so patterns that move what they drew along can do that without copying it.
 class MemoryPattern(Pattern, ABC):
-    _LAYERS = 2
 
     def __init__(self, children: List[Pattern] = None):
         super().__init__(children)
-        self._memory = []
+        self._memory = self._buffered(BufferedRing())
 
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
-        self._update_memory_size(total_leds)
+        self._memory.resize(total_leds)
         color = self._calculate_pixel_with_memory(progress, index, total_leds)
-        self._update_later(f'self._memory[{index}]', color)
+        self._memory.set(index, color)
         return color
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        self._memory.resize(total_leds)
+        frame = self._render_frame_with_memory(progress, total_leds)
+        self._memory.set_frame(frame)
+        return frame
+
     def color_at(self, index: int) -> RGBW:
         assert index >= 0
         if index >= len(self._memory):
             return Color(0, 0, 0)
-        return self._memory[index]
+        return RGBW(self._memory.at(index))
 
     @abstractmethod
     def _calculate_pixel_with_memory(self, progress: float, index: int, total_leds: int) -> RGBW:
         pass
 
-    def _update_memory_size(self, total_leds):
-        if len(self._memory) < total_leds:
-            self._memory.extend([Color(0, 0, 0)] * (total_leds - len(self._memory)))
-
-
-def _color_blend(color1: RGBW, color2: RGBW) -> RGBW:
-    color1_hsv = colorsys.rgb_to_hsv(color1.r / 255, color1.g / 255, color1.b / 255)
-    color2_hsv = colorsys.rgb_to_hsv(color2.r / 255, color2.g / 255, color2.b / 255)
+    def _render_frame_with_memory(self, progress: float, total_leds: int) -> Frame:
+        colors = [self._calculate_pixel_with_memory(progress, i, total_leds) for i in range(total_leds)]
+        return np.array(colors, dtype=np.uint32)
 
-    midpoint = (_avg(color1_hsv[0], color2_hsv[0]),
-                _avg(color1_hsv[1], color2_hsv[1]),
-                _avg(color1_hsv[2], color2_hsv[2]))
 
-    midpoint_rgb = colorsys.hsv_to_rgb(*midpoint)
+def _color_or_black(color: Optional[RGBW]) -> int:
+    return 0 if color is None else color
 
-    return Color(int(midpoint_rgb[0] * 255), int(midpoint_rgb[1] * 255), int(midpoint_rgb[2] * 255))
 
-
-def _avg(a: float, b: float) -> float:
-    return (a + b) / 2
+def _frame_or_black(pattern: Pattern, progress: float, total_leds: int) -> Frame:
+    frame = pattern.render_frame(progress, total_leds)
+    if frame is None:
+        return np.zeros(total_leds, dtype=np.uint32)
+    return frame
 
 
 class ChasePattern(MemoryPattern):
 
-    def __init__(self, sub_pattern: Pattern, blend=False):
+    def __init__(self, sub_pattern: Pattern, blend=False, blend_mode: BlendMode = BlendMode.HSV_MIDPOINT):
         super().__init__([sub_pattern])
         self._sub_pattern = sub_pattern
-        self._prev_progress = 0
+        self._prev_progress = self._buffered(BufferedValue(0))
         self._blend = blend
+        self._blend_mode = blend_mode
+        self._blend_cache = BlendCache(blend_mode)
 
     def _calculate_pixel_with_memory(self, progress: float, index: int, total_leds: int) -> RGBW:
-        progress_amount = progress - self._prev_progress
+        progress_amount = progress - self._prev_progress.value
         if progress_amount < 0:
             progress_amount += 1
 
@@ -196,17 +352,45 @@ class ChasePattern(MemoryPattern):
         if leds_to_update < 1:
             if index == 0 or not self._blend:
                 return self.color_at(index)
-            return _color_blend(self.color_at(index), self.color_at(index - 1))
+            return blend_colors(self.color_at(index), self.color_at(index - 1), self._blend_mode)
         leds_to_update = int(leds_to_update)
 
         if index == 0:
-            self._update_later('self._prev_progress', progress)
+            self._prev_progress.set(progress)
 
         if index < leds_to_update:
             return self._sub_pattern.calculate_pixel(progress, index, total_leds)
         else:
             return self.color_at(index - leds_to_update)
 
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        # Stages the memory itself: moving the chase along only moves the ring's offset
+        self._memory.resize(total_leds)
+        progress_amount = progress - self._prev_progress.value
+        if progress_amount < 0:
+            progress_amount += 1
+
+        leds_to_update = progress_amount * total_leds
+        if leds_to_update < 1:
+            memory = self._memory.frame(total_leds)
+            if not self._blend or total_leds == 0:
+                return memory
+            frame = np.empty(total_leds, dtype=np.uint32)
+            frame[0] = memory[0]
+            frame[1:] = self._blend_cache.blend(memory[1:], memory[:-1])
+            self._memory.set_frame(frame)
+            return frame
+        leds_to_update = min(int(leds_to_update), total_leds)
+
+        self._prev_progress.set(progress)
+
+        new_colors = _frame_or_black(self._sub_pattern, progress, total_leds)[:leds_to_update].copy()
+        self._memory.shift(new_colors)
+        frame = np.empty(total_leds, dtype=np.uint32)
+        frame[:leds_to_update] = new_colors
+        self._memory.copy_to(frame[leds_to_update:])
+        return frame
+
 
 class SwitchingPattern(Pattern):
 
@@ -223,6 +407,18 @@ class SwitchingPattern(Pattern):
         self._weights = [weight / weight_sum for weight in self._weights]
 
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
+        return self._current_pattern(progress).calculate_pixel(progress, index, total_leds)
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        return self._current_pattern(progress).render_frame(progress, total_leds)
+
+    def is_static(self) -> bool:
+        return len(self._sub_patterns) == 1 and self._sub_patterns[0].is_static()
+
+    def is_deterministic(self) -> bool:
+        return all(sub_pattern.is_deterministic() for sub_pattern in self._sub_patterns)
+
+    def _current_pattern(self, progress: float) -> Pattern:
         weight_sum = 0
         i = 0
 
@@ -234,7 +430,7 @@ class SwitchingPattern(Pattern):
             else:
                 break
 
-        return self._sub_patterns[i].calculate_pixel(progress, index, total_leds)
+        return self._sub_patterns[i]
 
 
 class Stretch(Pattern):
@@ -244,4 +440,241 @@ class Stretch(Pattern):
         self._factor = factor
 
     def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
-        return self._sub_pattern.calculate_pixel(progress, index, int(total_leds * self._factor))
\ No newline at end of file
+        return self._sub_pattern.calculate_pixel(progress, index, int(total_leds * self._factor))
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        stretched_leds = int(total_leds * self._factor)
+        if stretched_leds < total_leds:
+            # The sub pattern would be asked for pixels past its end, which only the per-pixel path can do
+            return super().render_frame(progress, total_leds)
+
+        frame = self._sub_pattern.render_frame(progress, stretched_leds)
+        if frame is None:
+            return None
+        return frame[:total_leds]
+
+    def is_static(self) -> bool:
+        return self._sub_pattern.is_static()
+
+    def is_deterministic(self) -> bool:
+        return self._sub_pattern.is_deterministic()
+
+
+def find_patterns(pattern: Pattern, pattern_class: type) -> List[Pattern]:
+    """
+    Returns every pattern of the given class in the tree under (and including) pattern
+    """
+    found = [pattern] if isinstance(pattern, pattern_class) else []
+    for child in pattern._children:
+        found.extend(find_patterns(child, pattern_class))
+    return found
+
+
+class SpectrumBars(Pattern):
+    """
+    One bar per audio band (see audio.py), side by side along the strip, lowest frequencies first. Each is lit in the
+    colors of sub_pattern from its start as far as its band's energy. Dark without audio input.
+    """
+
+    def __init__(self, sub_pattern: Pattern):
+        super().__init__([sub_pattern])
+        self._sub_pattern = sub_pattern
+        self._lit: Optional[np.ndarray] = None
+
+    def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
+        if not self._lit_pixels(total_leds)[index]:
+            return Color(0, 0, 0)
+        return self._sub_pattern.calculate_pixel(progress, index, total_leds)
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        frame = _frame_or_black(self._sub_pattern, progress, total_leds)
+        return np.where(self._lit_pixels(total_leds), frame, 0).astype(np.uint32)
+
+    def after_update(self):
+        super().after_update()
+        self._lit = None
+
+    def _lit_pixels(self, total_leds: int) -> np.ndarray:
+        # The analysis is read once per frame, so every pixel sees the same one
+        if self._lit is None or len(self._lit) != total_leds:
+            analysis = audio.latest()
+            bands = analysis.bands if analysis is not None else np.zeros(1)
+            positions = np.arange(total_leds) * len(bands) / max(total_leds, 1)
+            band = positions.astype(int)
+            self._lit = positions - band < bands[band]
+        return self._lit
+
+
+class BeatPulse(Pattern):
+    """
+    sub_pattern flashing at full brightness on every beat (see audio.py) and fading out over decay seconds
+    """
+
+    def __init__(self, sub_pattern: Pattern, decay: float = 0.25):
+        super().__init__([sub_pattern])
+        self._sub_pattern = sub_pattern
+        self._decay = decay
+        self._brightness: Optional[float] = None
+
+    def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
+        color = self._sub_pattern.calculate_pixel(progress, index, total_leds)
+        if color is None:
+            return None
+        brightness = self._current_brightness()
+        dimmed = mix_frames(np.zeros(1, dtype=np.uint32), np.array([color], dtype=np.uint32), brightness)
+        return RGBW(int(dimmed[0]))
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        frame = self._sub_pattern.render_frame(progress, total_leds)
+        if frame is None:
+            return None
+        return mix_frames(np.zeros(total_leds, dtype=np.uint32), frame, self._current_brightness())
+
+    def after_update(self):
+        super().after_update()
+        self._brightness = None
+
+    def _current_brightness(self) -> float:
+        if self._brightness is None:
+            analysis = audio.latest()
+            since_beat = time.monotonic() - analysis.beat_time if analysis is not None else float('inf')
+            self._brightness = float(np.exp(-since_beat / self._decay))
+        return self._brightness
+
+
+class Cached(Pattern):
+    """
+    Renders each frame of a deterministic sub pattern once and replays it from then on. Progress is rounded to the
+    nearest multiple of the progress increment, so a pattern at 60 steps per cycle has at most 60 distinct frames.
+    The least recently used frames are dropped once they take up more than max_bytes.
+
+    The cache is cleared when the increment or the LED count changes. Sub patterns that aren't deterministic are
+    rendered normally.
+    """
+
+    def __init__(self, sub_pattern: Pattern, max_bytes: int = 16 * 1024 * 1024):
+        super().__init__([sub_pattern])
+        self._sub_pattern = sub_pattern
+        self._max_bytes = max_bytes
+        self._frames: 'OrderedDict[int, Optional[Frame]]' = OrderedDict()
+        self._progress_increment: Optional[float] = None
+        self._total_leds: Optional[int] = None
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+
+    def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
+        return self._sub_pattern.calculate_pixel(progress, index, total_leds)
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        if not self._progress_increment or not self._sub_pattern.is_deterministic():
+            return self._sub_pattern.render_frame(progress, total_leds)
+
+        if total_leds != self._total_leds:
+            self._clear()
+            self._total_leds = total_leds
+
+        step = round(progress / self._progress_increment)
+        if step * self._progress_increment >= 1:
+            step = 0
+
+        if step in self._frames:
+            self.hits += 1
+            self._frames.move_to_end(step)
+            return self._frames[step]
+
+        self.misses += 1
+        frame = self._sub_pattern.render_frame(step * self._progress_increment, total_leds)
+        if frame is not None:
+            frame = np.array(frame, dtype=np.uint32)
+            frame.flags.writeable = False
+            self.bytes_used += frame.nbytes
+        self._frames[step] = frame
+
+        while self.bytes_used > self._max_bytes and self._frames:
+            _, evicted = self._frames.popitem(last=False)
+            if evicted is not None:
+                self.bytes_used -= evicted.nbytes
+
+        return frame
+
+    def set_progress_increment(self, progress_increment: float):
+        if progress_increment != self._progress_increment:
+            self._clear()
+            self._progress_increment = progress_increment
+        super().set_progress_increment(progress_increment)
+
+    def is_static(self) -> bool:
+        return self._sub_pattern.is_static()
+
+    def is_deterministic(self) -> bool:
+        return self._sub_pattern.is_deterministic()
+
+    def _clear(self):
+        self._frames.clear()
+        self.bytes_used = 0
+
+
+class Crossfade(Pattern):
+    """
+    Fades from one pattern to another over duration seconds, rendering both in the meantime. The outgoing pattern
+    carries on from outgoing_progress while the incoming one starts from whatever progress it's given.
+    """
+
+    def __init__(self, outgoing: Pattern, incoming: Pattern, duration: float, outgoing_progress: float = 0):
+        super().__init__([outgoing, incoming])
+        self.outgoing = outgoing
+        self.incoming = incoming
+        self._duration = duration
+        self._outgoing_progress = outgoing_progress
+        self._start_time = time.monotonic()
+
+    def calculate_pixel(self, progress: float, index: int, total_leds: int) -> RGBW:
+        weight = self._weight()
+        if weight >= 1:
+            return self.incoming.calculate_pixel(progress, index, total_leds)
+        outgoing = _color_or_black(self.outgoing.calculate_pixel(self._carried_on(progress), index, total_leds))
+        incoming = _color_or_black(self.incoming.calculate_pixel(progress, index, total_leds))
+        mixed = mix_frames(np.array([outgoing], dtype=np.uint32), np.array([incoming], dtype=np.uint32), weight)
+        return RGBW(int(mixed[0]))
+
+    def render_frame(self, progress: float, total_leds: int) -> Optional[Frame]:
+        weight = self._weight()
+        if weight >= 1:
+            return self.incoming.render_frame(progress, total_leds)
+        outgoing = _frame_or_black(self.outgoing, self._carried_on(progress), total_leds)
+        incoming = _frame_or_black(self.incoming, progress, total_leds)
+        return mix_frames(outgoing, incoming, weight)
+
+    def is_finished(self) -> bool:
+        """
+        Whether only the incoming pattern is showing, so it can replace the crossfade
+        """
+        return self._weight() >= 1
+
+    def _weight(self) -> float:
+        if self._duration <= 0:
+            return 1
+        return (time.monotonic() - self._start_time) / self._duration
+
+    def _carried_on(self, progress: float) -> float:
+        progress += self._outgoing_progress
+        return progress - int(progress)
+
+
+def crossfade(current: Pattern, current_progress: float, new: Pattern, duration: float) -> Pattern:
+    """
+    What to render instead of current once new is installed: a Crossfade to new, or new itself if duration is 0
+    """
+    if duration <= 0:
+        return new
+    return Crossfade(current, new, duration, current_progress)
+
+
+def settle(pattern: Pattern) -> Pattern:
+    """
+    Replaces a finished Crossfade with the pattern it faded to
+    """
+    while isinstance(pattern, Crossfade) and pattern.is_finished():
+        pattern = pattern.incoming
+    return pattern
@@ -0,0 +1,85 @@
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Deque, List, Optional, Tuple
+
+from .compile import compile_pattern
+from .pattern import Pattern
+
+Done = Optional[Callable[[Optional[Exception]], None]]
+"""
+Called with None once a build is handed to the render loop, or with the exception it failed with
+"""
+
+
+class PatternBuilder:
+    """
+    Constructs (and compiles) new patterns on a background thread, so building a big pattern tree never holds up
+    a frame. The render loop picks up finished patterns at the start of each frame, in the order they were
+    requested, so a quick command can't overtake a slow one for the same segment.
+    """
+
+    def __init__(self, compile_patterns: bool, profiler):
+        self._compile_patterns = compile_patterns
+        self._profiler = profiler
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='pattern-builder')
+        self._pending: Deque[Tuple[Future, Optional[Callable[[], None]], Optional[Done]]] = deque()
+
+    def build(self, segment: str, constructor: Callable[[], Pattern], done: Done = None):
+        self.build_group([(segment, constructor)], done=done)
+
+    def build_group(self, builds: List[Tuple[str, Callable[[], Pattern]]], apply: Callable[[], None] = None,
+                    done: Done = None):
+        """
+        Builds the patterns for (segment, constructor) in order. Once all of them are built, apply is called on the
+        render loop right before they're handed to it. If any of them fails, none of them are, and apply isn't called.
+        Without anything to build or wait for, apply is called right away.
+
+        done is called on the render loop with None once the patterns are handed over, or with the exception if
+        building them or apply failed. Failures without done are only printed.
+        """
+        if not builds and not self._pending:
+            if apply is not None:
+                apply()
+            if done is not None:
+                done(None)
+            return
+        self._pending.append((self._executor.submit(self._build_group, builds), apply, done))
+
+    def take_finished(self) -> List[Tuple[str, Pattern]]:
+        """
+        Returns (segment, pattern) for the builds that are done, stopping at the first one that isn't
+        """
+        finished = []
+        while self._pending and self._pending[0][0].done():
+            future, apply, done = self._pending.popleft()
+            try:
+                built = future.result()
+                if apply is not None:
+                    apply()
+            except Exception as e:
+                if done is not None:
+                    done(e)
+                else:
+                    print(repr(e))
+                continue
+            if done is not None:
+                done(None)
+            finished += built
+        return finished
+
+    def is_busy(self) -> bool:
+        return len(self._pending) > 0
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def _build_group(self, builds: List[Tuple[str, Callable[[], Pattern]]]) -> List[Tuple[str, Pattern]]:
+        return [(segment, self._build(constructor)) for segment, constructor in builds]
+
+    def _build(self, constructor: Callable[[], Pattern]) -> Pattern:
+        pattern = constructor()
+        if self._compile_patterns:
+            self._profiler.instrument(pattern)
+            pattern = compile_pattern(pattern)
+        self._profiler.instrument(pattern)
+        return pattern
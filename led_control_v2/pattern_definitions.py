@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Dict
+
+from led_strip.color import Color
+
+from .blend import BlendMode
+from .pattern import Pattern, NothingPattern, ColorPattern, FullRandomPattern, Timed, NTimes, Once, Twice, \
+    OnePxChase, Reversed, ChasePattern, SwitchingPattern, Stretch, Cached, SpectrumBars, BeatPulse
+
+PatternConstructor = Callable[[], Pattern]
+"""
+Builds a new instance of a pattern, patterns have state so every switch to one needs its own
+"""
+
+Maker = Callable[[], Any]
+"""
+Produces the value of one constructor argument, a new sub pattern for pattern arguments
+"""
+
+_MAX_CACHED_DEFINITIONS = 256
+
+# Upper bounds for arguments that size what gets allocated or how long something runs, so a definition can't make
+# the render loop ask for more memory than there is
+_MAX_STRETCH_FACTOR = 100
+_MAX_CACHE_BYTES = 256 * 1024 * 1024
+_MAX_DURATION_S = 24 * 60 * 60
+_MAX_COUNT = 1_000_000
+_MAX_WEIGHT = 1_000_000
+
+
+class PatternDefinitionError(ValueError):
+    def __init__(self, path: str, message: str):
+        super().__init__(path, message)
+        self.path = path
+        self.message = message
+
+    def __str__(self):
+        return f'{self.path}: {self.message}'
+
+
+class _Param:
+    def __init__(self, parse: Callable[[Any, str], Maker], required: bool = True):
+        self.parse = parse
+        self.required = required
+
+
+def parse_pattern_definitions(text: str, file_format: str = 'json') -> Dict[str, PatternConstructor]:
+    """
+    Parses a JSON or YAML document of pattern definitions, see compile_definitions. Raises PatternDefinitionError
+    if it isn't valid.
+    """
+    if file_format == 'json':
+        try:
+            definitions = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise PatternDefinitionError('$', f'invalid JSON: {e}')
+    elif file_format == 'yaml':
+        # Only needed for YAML, so not in requirements.txt
+        import yaml
+        try:
+            definitions = yaml.safe_load(text)
+        except yaml.YAMLError as e:
+            raise PatternDefinitionError('$', f'invalid YAML: {e}')
+    else:
+        raise PatternDefinitionError('$', f'unknown format {file_format}, expected json or yaml')
+
+    return compile_definitions(definitions)
+
+
+def load_pattern_file(path: str) -> Dict[str, PatternConstructor]:
+    """
+    Loads pattern definitions from a .json, .yaml or .yml file
+    """
+    extension = os.path.splitext(path)[1].lower()
+    with open(path) as f:
+        return parse_pattern_definitions(f.read(), 'yaml' if extension in ('.yaml', '.yml') else 'json')
+
+
+def compile_definitions(definitions: Any) -> Dict[str, PatternConstructor]:
+    """
+    Turns {name: definition} into {name: constructor}. A definition mirrors the pattern classes and their
+    constructor arguments:
+
+        {"type": "Stretch", "factor": 4, "sub_pattern": {"type": "ColorPattern", "color": [255, 127, 0]}}
+
+    Colors are [r, g, b], [r, g, b, w] or "#rrggbb". Everything is validated up front, so the constructors only
+    instantiate classes. Definitions are cached by content, so loading a document again (or another one sharing
+    definitions with it) reuses the constructors it got before.
+    """
+    if not isinstance(definitions, dict):
+        raise PatternDefinitionError('$', 'expected an object of pattern name to definition')
+
+    constructors = {}
+    for name, definition in definitions.items():
+        try:
+            key = hashlib.sha256(json.dumps(definition, sort_keys=True).encode()).hexdigest()
+        except (TypeError, ValueError) as e:
+            # YAML has types JSON doesn't, like dates and sets, none of which any pattern takes
+            raise PatternDefinitionError(f'$.{name}', f'unsupported value: {e}')
+        constructor = _definition_cache.get(key)
+        if constructor is None:
+            constructor = _compile_node(definition, f'$.{name}')
+            _definition_cache[key] = constructor
+            if len(_definition_cache) > _MAX_CACHED_DEFINITIONS:
+                _definition_cache.popitem(last=False)
+        else:
+            _definition_cache.move_to_end(key)
+        constructors[str(name)] = constructor
+    return constructors
+
+
+def _compile_node(node: Any, path: str) -> PatternConstructor:
+    if not isinstance(node, dict) or 'type' not in node:
+        raise PatternDefinitionError(path, 'expected an object with a "type"')
+    pattern_type = node['type']
+    if not isinstance(pattern_type, str) or pattern_type not in pattern_types:
+        raise PatternDefinitionError(path, f'unknown type {pattern_type}, expected one of {", ".join(pattern_types)}')
+
+    pattern_class, params = pattern_types[pattern_type]
+    unknown = [key for key in node if key != 'type' and key not in params]
+    if unknown:
+        raise PatternDefinitionError(path, f'unknown arguments {", ".join(unknown)} for {pattern_type}')
+
+    makers: Dict[str, Maker] = {}
+    for name, param in params.items():
+        if name in node:
+            makers[name] = param.parse(node[name], f'{path}.{name}')
+        elif param.required:
+            raise PatternDefinitionError(path, f'{pattern_type} needs {name}')
+
+    if pattern_class is SwitchingPattern and len(node['sub_patterns']) != len(node['weights']):
+        raise PatternDefinitionError(path, 'needs as many weights as sub_patterns')
+
+    def construct() -> Pattern:
+        return pattern_class(**{name: make() for name, make in makers.items()})
+    return construct
+
+
+def _pattern(value: Any, path: str) -> Maker:
+    return _compile_node(value, path)
+
+
+def _patterns(value: Any, path: str) -> Maker:
+    if not isinstance(value, list) or not value:
+        raise PatternDefinitionError(path, 'expected a non-empty list of patterns')
+    constructors = [_compile_node(node, f'{path}[{i}]') for i, node in enumerate(value)]
+    return lambda: [constructor() for constructor in constructors]
+
+
+def _color(value: Any, path: str) -> Maker:
+    if isinstance(value, str) and len(value) == 7 and value.startswith('#'):
+        try:
+            color = Color(int(value[1:3], 16), int(value[3:5], 16), int(value[5:7], 16))
+        except ValueError:
+            raise PatternDefinitionError(path, f'invalid color {value}')
+    elif isinstance(value, list) and len(value) in (3, 4) and all(_is_channel(channel) for channel in value):
+        color = Color(*value)
+    else:
+        raise PatternDefinitionError(path, 'expected [r, g, b], [r, g, b, w] or "#rrggbb" with values 0-255')
+    return lambda: color
+
+
+def _is_channel(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value <= 255
+
+
+def _positive_number(maximum: float) -> Callable[[Any, str], Maker]:
+    def parse(value: Any, path: str) -> Maker:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or not 0 < value <= maximum:
+            raise PatternDefinitionError(path, f'expected a positive number up to {maximum:g}')
+        return lambda: value
+    return parse
+
+
+def _positive_int(maximum: int) -> Callable[[Any, str], Maker]:
+    def parse(value: Any, path: str) -> Maker:
+        if isinstance(value, bool) or not isinstance(value, int) or not 0 < value <= maximum:
+            raise PatternDefinitionError(path, f'expected a positive integer up to {maximum}')
+        return lambda: value
+    return parse
+
+
+def _seed(value: Any, path: str) -> Maker:
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        raise PatternDefinitionError(path, 'expected a non-negative integer')
+    return lambda: value
+
+
+def _positive_numbers(value: Any, path: str) -> Maker:
+    if not isinstance(value, list) or not value:
+        raise PatternDefinitionError(path, 'expected a non-empty list of numbers')
+    for i, number in enumerate(value):
+        _positive_number(_MAX_WEIGHT)(number, f'{path}[{i}]')
+    numbers = list(value)
+    return lambda: list(numbers)
+
+
+def _bool(value: Any, path: str) -> Maker:
+    if not isinstance(value, bool):
+        raise PatternDefinitionError(path, 'expected true or false')
+    return lambda: value
+
+
+def _blend_mode(value: Any, path: str) -> Maker:
+    if not isinstance(value, str) or value not in BlendMode.__members__:
+        raise PatternDefinitionError(path, f'unknown blend mode {value}, expected one of '
+                                           f'{", ".join(BlendMode.__members__)}')
+    mode = BlendMode[value]
+    return lambda: mode
+
+
+pattern_types = {
+    'NothingPattern': (NothingPattern, {}),
+    'ColorPattern': (ColorPattern, {'color': _Param(_color)}),
+    'FullRandomPattern': (FullRandomPattern, {'seed': _Param(_seed, required=False)}),
+    'Timed': (Timed, {'duration': _Param(_positive_number(_MAX_DURATION_S)), 'sub_pattern': _Param(_pattern)}),
+    'NTimes': (NTimes, {'count': _Param(_positive_int(_MAX_COUNT)), 'sub_pattern': _Param(_pattern),
+                        'after': _Param(_pattern, required=False)}),
+    'Once': (Once, {'sub_pattern': _Param(_pattern)}),
+    'Twice': (Twice, {'sub_pattern': _Param(_pattern)}),
+    'OnePxChase': (OnePxChase, {'sub_pattern': _Param(_pattern), 'background': _Param(_pattern, required=False)}),
+    'Reversed': (Reversed, {'sub_pattern': _Param(_pattern)}),
+    'ChasePattern': (ChasePattern, {'sub_pattern': _Param(_pattern), 'blend': _Param(_bool, required=False),
+                                    'blend_mode': _Param(_blend_mode, required=False)}),
+    'SwitchingPattern': (SwitchingPattern, {'sub_patterns': _Param(_patterns), 'weights': _Param(_positive_numbers)}),
+    'Stretch': (Stretch, {'factor': _Param(_positive_number(_MAX_STRETCH_FACTOR)), 'sub_pattern': _Param(_pattern)}),
+    'Cached': (Cached, {'sub_pattern': _Param(_pattern),
+                        'max_bytes': _Param(_positive_int(_MAX_CACHE_BYTES), required=False)}),
+    'SpectrumBars': (SpectrumBars, {'sub_pattern': _Param(_pattern)}),
+    'BeatPulse': (BeatPulse, {'sub_pattern': _Param(_pattern),
+                              'decay': _Param(_positive_number(_MAX_DURATION_S), required=False)}),
+}
+
+_definition_cache: 'OrderedDict[str, PatternConstructor]' = OrderedDict()
@@ -0,0 +1,125 @@
+import math
+from collections import OrderedDict
+from typing import Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+_FRACTION_BITS = 8
+"""
+Tables hold 8.8 fixed point values: the upper byte is what gets sent, the lower one what 8 bits can't show
+"""
+
+_MAX_CACHED_TABLES = 64
+
+_CHANNEL_ORDER = (2, 1, 0, 3)
+"""
+Index into (r, g, b, w) for every byte of a 0xWWRRGGBB pixel, in memory order
+"""
+
+_CHANNELS = np.arange(4)
+
+Gamma = Union[float, Sequence[float]]
+
+
+class PostProcessor:
+    """
+    Turns rendered frames into what gets sent to a strip: brightness, gamma and color temperature correction.
+
+    All three are folded into one precomputed table per channel, so a frame is a single lookup of every byte. The
+    tables keep 8 fractional bits. Without dithering they are rounded to the nearest level. With dithering the
+    fraction is carried over to the next frame per pixel and channel, so a level between two the strip can show
+    is shown by alternating between them, instead of steps at low brightness. That only works if every frame is
+    sent, see needs_refresh.
+    """
+
+    def __init__(self, num_leds: int, gamma: Gamma = 1.0, color_temperature: Optional[float] = None,
+                 dithering: bool = False):
+        self.gamma = tuple(gamma) if isinstance(gamma, Sequence) else (gamma,) * 4
+        if len(self.gamma) != 4 or any(value <= 0 for value in self.gamma):
+            raise ValueError(f'Expected a positive gamma or one for each of r, g, b and w, got {gamma}')
+        self.white_point = white_point(color_temperature) if color_temperature is not None else (1.0, 1.0, 1.0, 1.0)
+        self.dithering = dithering
+        self._error = np.zeros((num_leds, 4), dtype=np.uint16) if dithering else None
+        self._tables: 'OrderedDict[int, np.ndarray]' = OrderedDict()
+
+    def is_identity(self, brightness: float) -> bool:
+        """
+        Whether frames at this brightness would come out unchanged, in which case process isn't needed
+        """
+        return brightness >= 1 and not self.dithering and self.gamma == (1.0,) * 4 and \
+            self.white_point == (1.0, 1.0, 1.0, 1.0)
+
+    def needs_refresh(self) -> bool:
+        """
+        Whether the output changes every frame even if the frame buffer doesn't
+        """
+        return self.dithering
+
+    def process(self, frame: np.ndarray, start: int, brightness: float, out: np.ndarray):
+        """
+        Writes the corrected frame to out. start is the index of the first pixel of frame on the strip, for the
+        dithering error, and brightness is linear light from 0 to 1.
+        """
+        values = self._table(brightness)[_CHANNELS, frame.view(np.uint8).reshape(-1, 4)]
+        channels = out.view(np.uint8).reshape(-1, 4)
+        if self._error is None:
+            np.right_shift(values + (1 << (_FRACTION_BITS - 1)), _FRACTION_BITS, out=channels, casting='unsafe')
+            return
+
+        error = self._error[start:start + len(frame)]
+        values += error
+        np.right_shift(values, _FRACTION_BITS, out=channels, casting='unsafe')
+        np.bitwise_and(values, (1 << _FRACTION_BITS) - 1, out=error)
+
+    def _table(self, brightness: float) -> np.ndarray:
+        """
+        (4, 256) uint16 table per byte of a pixel, for brightness quantised to 1/4096
+        """
+        key = max(0, min(4096, round(brightness * 4096)))
+        table = self._tables.get(key)
+        if table is not None:
+            self._tables.move_to_end(key)
+            return table
+
+        levels = np.arange(256) / 255
+        scale = key / 4096 * (255 << _FRACTION_BITS)
+        table = np.empty((4, 256), dtype=np.uint16)
+        for byte, channel in enumerate(_CHANNEL_ORDER):
+            linear = levels ** self.gamma[channel] * self.white_point[channel]
+            table[byte] = np.round(linear * scale)
+        self._tables[key] = table
+        if len(self._tables) > _MAX_CACHED_TABLES:
+            self._tables.popitem(last=False)
+        return table
+
+
+def white_point(kelvin: float) -> Tuple[float, float, float, float]:
+    """
+    (r, g, b, w) factors that shift white from 6500K (how colors are rendered) to the given color temperature,
+    scaled so the strongest channel stays at 1. The white channel is left alone, its color is fixed by the LED.
+    """
+    r, g, b = _blackbody(kelvin)
+    r0, g0, b0 = _blackbody(6500)
+    factors = (r / r0, g / g0, b / b0)
+    strongest = max(factors)
+    return factors[0] / strongest, factors[1] / strongest, factors[2] / strongest, 1.0
+
+
+def _blackbody(kelvin: float) -> Tuple[float, float, float]:
+    """
+    Approximate sRGB color of a black body, fit by Tanner Helland, good from 1000K to 40000K
+    """
+    t = max(1000.0, min(40000.0, kelvin)) / 100
+    if t <= 66:
+        r = 255.0
+        g = 99.4708025861 * math.log(t) - 161.1195681661
+    else:
+        r = 329.698727446 * (t - 60) ** -0.1332047592
+        g = 288.1221695283 * (t - 60) ** -0.0755148492
+    if t >= 66:
+        b = 255.0
+    elif t <= 19:
+        b = 0.0
+    else:
+        b = 138.5177312231 * math.log(t - 10) - 305.0447927307
+    return tuple(max(1.0, min(255.0, value)) / 255 for value in (r, g, b))
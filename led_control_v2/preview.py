@@ -0,0 +1,79 @@
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .shm import open_shared_memory
+
+_HEADER_FIELDS = 2
+_SEQUENCE = 0
+_LAST_READ_NS = 1
+
+
+class SharedFrameBuffer:
+    """
+    Ring of the last few frames the render loop showed, in shared memory so the web server can read them without
+    anything going through the command pipe.
+
+    The header holds how many frames have been published and when a reader last looked. The render loop skips
+    publishing entirely when nobody has read in idle_timeout seconds, so an unwatched preview costs nothing.
+    """
+
+    def __init__(self, num_leds: int, slots: int, idle_timeout: float, name: str = None):
+        self.num_leds = num_leds
+        self.slots = slots
+        self.idle_timeout = idle_timeout
+
+        size = (_HEADER_FIELDS + slots * num_leds) * 8
+        self._owner = name is None
+        self._shm = open_shared_memory(name, size)
+
+        self._header = np.ndarray(_HEADER_FIELDS, dtype=np.int64, buffer=self._shm.buf)
+        self._frames = np.ndarray((slots, num_leds), dtype=np.uint32, buffer=self._shm.buf,
+                                  offset=_HEADER_FIELDS * 8)
+        if self._owner:
+            self._header[:] = 0
+
+    def __reduce__(self):
+        # Other processes attach to the same memory instead of getting a copy
+        return SharedFrameBuffer, (self.num_leds, self.slots, self.idle_timeout, self._shm.name)
+
+    def publish(self, frame: np.ndarray):
+        if time.monotonic_ns() - self._header[_LAST_READ_NS] > self.idle_timeout * 1e9:
+            return
+
+        sequence = int(self._header[_SEQUENCE])
+        frame = frame[:self.num_leds]
+        self._frames[sequence % self.slots, :len(frame)] = frame
+        self._header[_SEQUENCE] = sequence + 1
+
+    def read_latest(self) -> Tuple[int, Optional[np.ndarray]]:
+        """
+        Returns (sequence number, copy of the newest frame), or (0, None) if nothing has been published yet.
+        """
+        self._header[_LAST_READ_NS] = time.monotonic_ns()
+
+        while True:
+            sequence = int(self._header[_SEQUENCE])
+            if sequence == 0:
+                return 0, None
+            frame = self._frames[(sequence - 1) % self.slots].copy()
+            # Only torn if the render loop lapped the whole ring while we were copying
+            if self._header[_SEQUENCE] - sequence < self.slots - 1:
+                return sequence, frame
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def frame_to_rgb_bytes(frame: np.ndarray) -> bytes:
+    """
+    Packs a frame as 3 bytes (r, g, b) per LED
+    """
+    rgb = np.empty((len(frame), 3), dtype=np.uint8)
+    rgb[:, 0] = (frame >> 16) & 0xff
+    rgb[:, 1] = (frame >> 8) & 0xff
+    rgb[:, 2] = frame & 0xff
+    return rgb.tobytes()
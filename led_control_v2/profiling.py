@@ -0,0 +1,165 @@
+import time
+from bisect import bisect_left
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from .command import Command
+from .pattern import Pattern, find_patterns
+from .shm import open_shared_memory
+
+BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+"""
+Upper bounds of the histogram buckets in seconds, anything slower goes into the +Inf bucket
+"""
+
+PHASES = ('commands', 'ingest', 'render', 'upload', 'show', 'after_update', 'publish', 'wait', 'idle')
+
+AUDIO_STAGES = ('analysis', 'sample_to_frame')
+"""
+How long analysing a block of samples takes, and how long it takes from a sample being recorded to the frame
+showing it
+"""
+
+Series = Tuple[str, str]
+"""
+(metric, label value), e.g. ('phase', 'render') or ('command', 'SetColorCommand')
+"""
+
+
+class FrameProfiler:
+    """
+    Histograms of how long each phase of a frame takes, how long each type of command takes to handle, and
+    optionally how long each kind of pattern node takes to render (inclusive of its children).
+
+    The render loop records, the web server reads: all histograms live in one fixed-size array in shared memory.
+    Recording never blocks; a reader might see a frame's count without its sum, which doesn't matter for metrics.
+    Pickling it attaches the other side to the same memory, like StateSnapshot.
+
+    Phases are timed with lap: each call records the time since the previous one under the given phase, so the loop
+    only needs one call at the end of each phase.
+    """
+
+    def __init__(self, pattern_nodes: bool = False, name: str = None):
+        self.pattern_nodes = pattern_nodes
+        series: List[Series] = [('phase', phase) for phase in PHASES]
+        series += [('command', name) for name in sorted(_subclass_names(Command))]
+        series += [('audio', stage) for stage in AUDIO_STAGES]
+        if pattern_nodes:
+            series += [('pattern', name) for name in sorted(_subclass_names(Pattern))]
+
+        self._width = len(BUCKETS) + 3
+        """
+        Per series: a count for each bucket and +Inf, then the sum and the total count
+        """
+        self._offsets: Dict[Series, int] = {key: i * self._width for i, key in enumerate(series)}
+        self._owner = name is None
+        self._shm = open_shared_memory(name, len(series) * self._width * 8)
+        self._values = np.ndarray(len(series) * self._width, dtype=np.float64, buffer=self._shm.buf)
+        if self._owner:
+            self._values[:] = 0
+        self._last_lap = time.perf_counter()
+
+    def __reduce__(self):
+        return FrameProfiler, (self.pattern_nodes, self._shm.name)
+
+    def lap(self, phase: str):
+        now = time.perf_counter()
+        self.record('phase', phase, now - self._last_lap)
+        self._last_lap = now
+
+    def record(self, metric: str, label: str, seconds: float):
+        offset = self._offsets.get((metric, label))
+        if offset is None:
+            return
+        values = self._values
+        values[offset + bisect_left(BUCKETS, seconds)] += 1
+        values[offset + self._width - 2] += seconds
+        values[offset + self._width - 1] += 1
+
+    def instrument(self, pattern: Pattern):
+        """
+        Times render_frame of every node in the pattern tree that isn't timed yet, if pattern node timings are
+        enabled. Compiled kernels call the render_frame their nodes had when they were compiled, so this should be
+        called before compiling (to time the nodes the kernel falls back to) and on the result (to time the kernel).
+        """
+        if not self.pattern_nodes:
+            return
+        for node in find_patterns(pattern, Pattern):
+            if 'render_frame' in vars(node):
+                continue
+            node.render_frame = self._timed_render_frame(type(node).__name__, node.render_frame)
+
+    def _timed_render_frame(self, name: str, render_frame):
+        def timed_render_frame(progress: float, total_leds: int):
+            start = time.perf_counter()
+            try:
+                return render_frame(progress, total_leds)
+            finally:
+                self.record('pattern', name, time.perf_counter() - start)
+        return timed_render_frame
+
+    def to_prometheus(self) -> str:
+        """
+        All histograms in the Prometheus text format, as led_frame_phase_seconds, led_command_seconds,
+        led_audio_seconds and led_pattern_render_seconds
+        """
+        values = self._values.tolist()
+        lines = []
+        for metric, name, label, help_text in _METRICS:
+            keys = [key for key in self._offsets if key[0] == metric]
+            if not keys:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} histogram')
+            for key in keys:
+                offset = self._offsets[key]
+                labels = f'{label}="{key[1]}"'
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ('+Inf',), values[offset:offset + len(BUCKETS) + 1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {int(cumulative)}')
+                lines.append(f'{name}_sum{{{labels}}} {values[offset + self._width - 2]}')
+                lines.append(f'{name}_count{{{labels}}} {int(values[offset + self._width - 1])}')
+        return '\n'.join(lines) + '\n'
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+class NullProfiler:
+    """
+    Stands in for FrameProfiler when profiling is off, so the render loop doesn't need to check
+    """
+
+    pattern_nodes = False
+
+    def lap(self, phase: str):
+        pass
+
+    def record(self, metric: str, label: str, seconds: float):
+        pass
+
+    def instrument(self, pattern: Pattern):
+        pass
+
+
+_METRICS = (
+    ('phase', 'led_frame_phase_seconds', 'phase', 'Time spent in each phase of the render loop'),
+    ('command', 'led_command_seconds', 'command', 'Time spent handling each type of command'),
+    ('audio', 'led_audio_seconds', 'stage', 'Time to analyse a block of audio, and from the newest sample of an '
+                                            'analysis to the frame using it being shown'),
+    ('pattern', 'led_pattern_render_seconds', 'pattern', 'Time spent in render_frame of each type of pattern node, '
+                                                         'including its sub patterns'),
+)
+
+
+def _subclass_names(cls: type) -> List[str]:
+    names = []
+    for subclass in cls.__subclasses__():
+        names.append(subclass.__name__)
+        names += _subclass_names(subclass)
+    return list(dict.fromkeys(names))
+
@@ -0,0 +1,167 @@
+import ctypes
+import signal
+from multiprocessing import Process, Pipe, RawArray
+from multiprocessing.connection import Connection
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from led_strip.frame_buffer import FrameBuffer, Range
+
+from .compile import compile_pattern
+from .pattern import Pattern, NothingPattern, Cached, find_patterns, crossfade, settle
+from .segment import after_update_or_blank, render_or_blank
+
+
+class RenderPool:
+    """
+    Worker processes that render the segments in parallel, straight into a frame buffer in shared memory.
+
+    Work is split by segment: every segment (and its whole pattern tree) lives in exactly one worker, so patterns
+    with state, or whose pixels depend on their neighbours like ChasePattern, behave exactly as they would in the
+    render loop. The flip side is that one segment is never split between workers: a single large segment doesn't
+    get any faster, so large installations should be split into at least as many segments as there are workers.
+    Segments are handed out longest first to the least loaded worker, and at most one worker per segment is started.
+
+    The render loop keeps progress, increment and brightness of every segment, and only sends the patterns and the
+    progress to render at. Workers only touch the shared pixels while a render call is waiting for them.
+    """
+
+    def __init__(self, num_leds: int, segments: Dict[str, Range], workers: int, compile_patterns: bool = True):
+        self._shared = RawArray(ctypes.c_uint32, num_leds)
+        self.pixels = np.frombuffer(self._shared, dtype=np.uint32)
+        self._invalidate = False
+        self.static = False
+        self.cache_stats = (0, 0, 0)
+        """
+        (bytes, hits, misses) of all Cached patterns in the workers, as of the last render
+        """
+
+        assignments: List[Dict[str, Range]] = [{} for _ in range(min(workers, len(segments)))]
+        longest_first = sorted(segments.items(), key=lambda item: item[1][1] - item[1][0], reverse=True)
+        for name, segment_range in longest_first:
+            least_loaded = min(assignments, key=lambda assigned: sum(end - start for start, end in assigned.values()))
+            least_loaded[name] = segment_range
+
+        self._connections: List[Connection] = []
+        self._worker_of: Dict[str, Connection] = {}
+        self._processes: List[Process] = []
+        for assigned in assignments:
+            conn, worker_conn = Pipe()
+            self._connections.append(conn)
+            process = Process(target=_worker_main, daemon=True,
+                              args=(worker_conn, list(self._connections), self._shared, assigned, compile_patterns))
+            process.start()
+            worker_conn.close()
+            self._processes.append(process)
+            for name in assigned:
+                self._worker_of[name] = conn
+
+    def set_pattern(self, segment: str, pattern: Pattern, progress_increment: float, outgoing_progress: float,
+                    transition: float):
+        """
+        Sends the pattern to the worker rendering the segment, which compiles it there if enabled and fades to it
+        like Segment.set_pattern
+        """
+        self._worker_of[segment].send(('set_pattern', segment, pattern, progress_increment, outgoing_progress,
+                                       transition))
+
+    def set_progress_increment(self, segment: str, progress_increment: float):
+        self._worker_of[segment].send(('set_progress_increment', segment, progress_increment))
+
+    def invalidate(self):
+        """
+        Tells the workers that something else drew into the buffer, so sparse patterns redraw everything
+        """
+        self._invalidate = True
+
+    def render(self, progress: Dict[str, float], buffer: FrameBuffer):
+        """
+        Renders every segment at its progress and waits for all of them. The pixels they changed are marked
+        dirty in buffer, which has to be drawing into self.pixels.
+        """
+        for conn in self._connections:
+            conn.send(('render', progress, self._invalidate))
+        self._invalidate = False
+
+        static = True
+        cache_stats = (0, 0, 0)
+        for conn in self._connections:
+            result = conn.recv()
+            if isinstance(result, Exception):
+                # Patterns failing are handled in the worker, this is anything else going wrong there. Its segments
+                # keep what they showed last, rather than the render loop going down.
+                print(repr(result))
+                static = False
+                continue
+            dirty, worker_static, worker_cache_stats = result
+            buffer.mark_dirty(dirty)
+            static &= worker_static
+            cache_stats = tuple(a + b for a, b in zip(cache_stats, worker_cache_stats))
+
+        self.static = static
+        self.cache_stats = cache_stats
+
+    def close(self):
+        for conn in self._connections:
+            conn.send(('close',))
+        for process in self._processes:
+            process.join(1)
+
+
+def _worker_main(conn: Connection, pool_connections: List[Connection], shared: ctypes.Array,
+                 segments: Dict[str, Range], compile_patterns: bool):
+    # Ctrl+C reaches the whole process group, but shutting down is up to the render loop (see close). The daemon
+    # turns SIGTERM into Ctrl+C for itself, which workers shouldn't inherit either.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    # Only the render loop may hold the other ends, otherwise recv never notices when it's gone
+    for pool_connection in pool_connections:
+        pool_connection.close()
+
+    buffer = FrameBuffer(len(shared), np.frombuffer(shared, dtype=np.uint32))
+    views = {name: buffer.view(start, end) for name, (start, end) in segments.items()}
+    patterns: Dict[str, Pattern] = {name: NothingPattern() for name in segments}
+
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, ConnectionError):
+            return
+        kind = message[0]
+
+        if kind == 'set_pattern':
+            _, segment, pattern, progress_increment, outgoing_progress, transition = message
+            pattern = compile_pattern(pattern) if compile_patterns else pattern
+            pattern.set_progress_increment(progress_increment)
+            patterns[segment] = crossfade(patterns[segment], outgoing_progress, pattern, transition)
+        elif kind == 'set_progress_increment':
+            _, segment, progress_increment = message
+            patterns[segment].set_progress_increment(progress_increment)
+        elif kind == 'render':
+            _, progress, invalidate = message
+            try:
+                conn.send(_render(buffer, views, patterns, progress, invalidate))
+            except Exception as e:
+                conn.send(e)
+        elif kind == 'close':
+            return
+
+
+def _render(buffer: FrameBuffer, views: Dict[str, FrameBuffer], patterns: Dict[str, Pattern],
+            progress: Dict[str, float], invalidate: bool) -> Tuple[List[Range], bool, Tuple[int, int, int]]:
+    for name, view in views.items():
+        if invalidate:
+            view.last_writer = None
+        patterns[name] = render_or_blank(name, settle(patterns[name]), progress[name], view)
+    dirty = buffer.take_dirty()
+
+    for name, view in views.items():
+        patterns[name] = after_update_or_blank(name, patterns[name], view)
+    # Patterns that failed in after_update blanked their segment after the dirty ranges were taken
+    dirty += buffer.take_dirty()
+
+    caches = [cache for pattern in patterns.values() for cache in find_patterns(pattern, Cached)]
+    cache_stats = (sum(cache.bytes_used for cache in caches), sum(cache.hits for cache in caches),
+                   sum(cache.misses for cache in caches))
+    return dirty, all(pattern.is_static() for pattern in patterns.values()), cache_stats
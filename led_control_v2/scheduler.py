@@ -0,0 +1,88 @@
+import time
+from enum import Enum
+from typing import Dict, Any
+
+
+class CatchUp(Enum):
+    NONE = 1
+    """
+    Every frame advances the animation by one step, so falling behind slows the animation down.
+    """
+    SKIP = 2
+    """
+    Frames whose deadline has already passed are skipped, the next one advances by every step that was missed.
+    """
+    INTERPOLATE = 3
+    """
+    Each frame advances the animation by exactly how much time passed since the previous one.
+    """
+
+
+class FrameStats:
+    def __init__(self):
+        self.frames_rendered = 0
+        self.deadlines_missed = 0
+        self.frames_skipped = 0
+        self.worst_lateness = 0.0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'frames_rendered': self.frames_rendered,
+            'deadlines_missed': self.deadlines_missed,
+            'frames_skipped': self.frames_skipped,
+            'worst_lateness_ms': self.worst_lateness * 1000
+        }
+
+
+class FrameScheduler:
+    """
+    Paces the render loop against absolute deadlines on the monotonic clock, so that time spent rendering
+    doesn't add up as drift and wall clock changes don't affect it.
+    """
+
+    def __init__(self, target_hz: float, catch_up: CatchUp = CatchUp.SKIP):
+        self.period = 1 / target_hz
+        self.catch_up = catch_up
+        self.stats = FrameStats()
+        self._deadline = time.monotonic()
+        self._last_frame_start = self._deadline
+
+    def resync(self):
+        """
+        Call after the render loop deliberately stopped for a while, so the pause isn't counted as missed frames.
+        """
+        self._deadline = time.monotonic()
+        self._last_frame_start = self._deadline
+
+    def wait_for_next_frame(self) -> float:
+        """
+        Call once a frame has been shown. Sleeps until the next frame is due and returns how many animation steps
+        the next frame should advance by.
+        """
+        self.stats.frames_rendered += 1
+        self._deadline += self.period
+
+        now = time.monotonic()
+        lateness = now - self._deadline
+        steps = 1
+
+        if lateness <= 0:
+            time.sleep(-lateness)
+        else:
+            self.stats.deadlines_missed += 1
+            self.stats.worst_lateness = max(self.stats.worst_lateness, lateness)
+
+            # Don't try to squeeze in frames that are already over, start again from the next deadline
+            skipped = int(lateness // self.period)
+            if skipped > 0:
+                self.stats.frames_skipped += skipped
+                self._deadline += skipped * self.period
+                if self.catch_up == CatchUp.SKIP:
+                    steps += skipped
+
+        frame_start = time.monotonic()
+        if self.catch_up == CatchUp.INTERPOLATE:
+            steps = (frame_start - self._last_frame_start) / self.period
+        self._last_frame_start = frame_start
+
+        return steps
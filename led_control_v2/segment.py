@@ -0,0 +1,166 @@
+import math
+from typing import Iterable, List, Optional, Tuple, TYPE_CHECKING
+
+import numpy as np
+
+from led_strip.frame_buffer import FrameBuffer, Range
+from led_strip.frame_sink import FrameSink
+from led_strip.strip import Strip
+
+from .pattern import Pattern, NothingPattern, crossfade, settle
+from .post_process import PostProcessor
+
+if TYPE_CHECKING:
+    from .render_pool import RenderPool
+
+
+class Segment:
+    """
+    Named part of the frame buffer with its own pattern, progress, increment and brightness. The brightness is
+    applied when the segment gets uploaded, so patterns always draw full brightness colors into the buffer.
+
+    With a render pool the pattern lives in the worker rendering the segment, and pattern changes are forwarded
+    there.
+    """
+
+    def __init__(self, name: str, frame_buffer: FrameBuffer, start: int, end: int, progress: float,
+                 progress_increment: float, brightness: int, pool: Optional['RenderPool'] = None):
+        self.name = name
+        self.start = start
+        self.end = end
+        self.buffer = frame_buffer.view(start, end)
+        self.pattern: Pattern = NothingPattern()
+        self.progress = progress
+        self.progress_increment = progress_increment
+        self.brightness = brightness
+        self.pool = pool
+
+    def __len__(self):
+        return self.end - self.start
+
+    def set_pattern(self, pattern: Pattern, progress: float, transition: float = 0):
+        """
+        Switches to pattern, starting at progress. With a transition (in seconds) the current pattern keeps running
+        and fades out meanwhile.
+        """
+        if self.pool is not None:
+            self.pool.set_pattern(self.name, pattern, self.progress_increment, self.progress, transition)
+        else:
+            pattern.set_progress_increment(self.progress_increment)
+            self.pattern = crossfade(self.pattern, self.progress, pattern, transition)
+        self.progress = progress
+
+    def set_progress_increment(self, progress_increment: float):
+        self.progress_increment = progress_increment
+        if self.pool is not None:
+            self.pool.set_progress_increment(self.name, progress_increment)
+        else:
+            self.pattern.set_progress_increment(progress_increment)
+
+    def set_brightness(self, brightness: int):
+        if brightness != self.brightness:
+            self.brightness = brightness
+            self.buffer.mark_all_dirty()
+
+    def render(self):
+        self.pattern = render_or_blank(self.name, settle(self.pattern), self.progress, self.buffer)
+
+    def after_update(self):
+        self.pattern = after_update_or_blank(self.name, self.pattern, self.buffer)
+
+    def advance(self, steps: int):
+        progress = self.progress + self.progress_increment * steps
+        self.progress = progress - math.trunc(progress)
+
+
+def render_or_blank(name: str, pattern: Pattern, progress: float, buffer: FrameBuffer) -> Pattern:
+    """
+    Renders pattern into the buffer of segment name and returns the pattern to render from then on. That's
+    NothingPattern if rendering failed, e.g. a definition asking for more memory than there is, in which case the
+    segment goes dark instead of the error taking down the render loop and every other segment with it.
+    """
+    try:
+        pattern.render_into(progress, len(buffer), buffer)
+        return pattern
+    except Exception as e:
+        return _blank(name, buffer, e)
+
+
+def after_update_or_blank(name: str, pattern: Pattern, buffer: FrameBuffer) -> Pattern:
+    """
+    Like render_or_blank, for Pattern.after_update
+    """
+    try:
+        pattern.after_update()
+        return pattern
+    except Exception as e:
+        return _blank(name, buffer, e)
+
+
+def _blank(name: str, buffer: FrameBuffer, error: Exception) -> Pattern:
+    print(f'Pattern of segment {name} failed, switching it off: {error!r}')
+    buffer.update(np.zeros(len(buffer), dtype=np.uint32))
+    buffer.last_writer = None
+    return NothingPattern()
+
+
+class Output:
+    """
+    A physical strip showing [start, end) of the frame buffer, through its post processor
+    """
+
+    def __init__(self, strip: Strip, start: int, post_processor: Optional[PostProcessor] = None):
+        self.strip = strip
+        self.sink: FrameSink = strip.frame_sink()
+        self.start = start
+        self.end = start + strip.numPixels()
+        self.post_processor = post_processor if post_processor is not None else PostProcessor(self.end - start)
+        self._processed = np.zeros(self.end - start, dtype=np.uint32)
+
+    def upload(self, pixels: np.ndarray, dirty: List[Range], segments: Iterable[Segment],
+               master_brightness: float = 1) -> bool:
+        """
+        Uploads the dirty ranges (in frame buffer indices) that fall on this strip, with the segments' brightness
+        scaled by master_brightness applied. Returns False if none of them did, in which case the strip doesn't need
+        to be shown. If the post processor needs every frame, the whole strip is uploaded regardless of dirty.
+        """
+        if self.post_processor.needs_refresh():
+            dirty = [(self.start, self.end)]
+        ranges = [(max(start, self.start) - self.start, min(end, self.end) - self.start)
+                  for start, end in dirty if start < self.end and end > self.start]
+        if not ranges:
+            return False
+
+        frame = pixels[self.start:self.end]
+        spans = self._brightness_spans(segments, master_brightness)
+        if not all(self.post_processor.is_identity(brightness) for _, _, brightness in spans):
+            for range_start, range_end in ranges:
+                for span_start, span_end, brightness in spans:
+                    start, end = max(range_start, span_start), min(range_end, span_end)
+                    if start < end:
+                        self.post_processor.process(frame[start:end], start, brightness, self._processed[start:end])
+            frame = self._processed
+
+        self.sink.write_ranges(frame, ranges)
+        return True
+
+    def show(self):
+        self.sink.show()
+
+    def _brightness_spans(self, segments: Iterable[Segment], master_brightness: float) -> List[Tuple[int, int, float]]:
+        """
+        (start, end, brightness) covering the whole strip in strip indices, brightness from 0 to 1
+        """
+        spans = []
+        position = 0
+        on_strip = sorted((segment for segment in segments if segment.start < self.end and segment.end > self.start),
+                          key=lambda segment: segment.start)
+        for segment in on_strip:
+            start, end = max(segment.start, self.start) - self.start, min(segment.end, self.end) - self.start
+            if position < start:
+                spans.append((position, start, master_brightness))
+            spans.append((start, end, master_brightness * segment.brightness / 255))
+            position = end
+        if position < self.end - self.start:
+            spans.append((position, self.end - self.start, master_brightness))
+        return spans
@@ -0,0 +1,15 @@
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+
+def open_shared_memory(name: Optional[str], size: int) -> shared_memory.SharedMemory:
+    """
+    Creates shared memory of size bytes if name is None, otherwise attaches to the existing memory called name.
+
+    Only the creator should unlink it, but Python tracks attached memory like created memory and removes it when
+    the process that attached exits, e.g. a web server worker being recycled. So attached memory isn't tracked.
+    """
+    shm = shared_memory.SharedMemory(name=name, create=name is None, size=size)
+    if name is not None:
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
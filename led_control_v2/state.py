@@ -0,0 +1,98 @@
+import json
+from typing import Dict, Any, Iterable, List
+
+import numpy as np
+
+from .config import LED_BRIGHTNESS, INITIAL_PROGRESS_INCREMENT, SEGMENTS, PATTERN_NAMES_BYTES, pattern_constructors
+from .shm import open_shared_memory
+
+
+class StateSnapshot:
+    """
+    Copy of the render loop's current settings in shared memory, so the web server can answer reads without
+    waiting for the render loop. The render loop publishes a new snapshot every frame.
+
+    Uses a sequence counter instead of a lock so neither side ever blocks: it's odd while a publish is in progress,
+    and readers retry if it changed while they were reading.
+
+    Segment settings are published once per segment, under segment_field(field, segment). The names of the pattern
+    definitions are published separately, whenever they change (see publish_patterns).
+
+    Pickling it (e.g. to send it to a web server worker, see daemon.py) attaches the other side to the same memory.
+    """
+
+    FIELDS = ('frames_rendered', 'deadlines_missed', 'frames_skipped', 'worst_lateness_ms', 'frame_cache_bytes',
+              'frame_cache_hits', 'frame_cache_misses', 'audio_latency_ms')
+    SEGMENT_FIELDS = ('brightness', 'progress_increment')
+
+    def __init__(self, segments: Iterable[str] = tuple(SEGMENTS), name: str = None):
+        self.segments = list(segments)
+        self.fields = self.FIELDS + tuple(self.segment_field(field, segment)
+                                          for segment in self.segments for field in self.SEGMENT_FIELDS)
+        self._owner = name is None
+        names_offset = (2 + len(self.fields)) * 8
+        self._shm = open_shared_memory(name, names_offset + PATTERN_NAMES_BYTES)
+        self._sequence = np.ndarray(1, dtype=np.uint64, buffer=self._shm.buf)
+        self._values = np.ndarray(len(self.fields), dtype=np.float64, buffer=self._shm.buf, offset=8)
+        self._names_length = np.ndarray(1, dtype=np.uint64, buffer=self._shm.buf, offset=names_offset - 8)
+        self._names = np.ndarray(PATTERN_NAMES_BYTES, dtype=np.uint8, buffer=self._shm.buf, offset=names_offset)
+        if not self._owner:
+            return
+
+        self._sequence[0] = 0
+        initial = {}
+        for segment in self.segments:
+            initial[self.segment_field('brightness', segment)] = LED_BRIGHTNESS
+            initial[self.segment_field('progress_increment', segment)] = INITIAL_PROGRESS_INCREMENT
+        self.publish(initial)
+        self.publish_patterns(list(pattern_constructors))
+
+    def __reduce__(self):
+        return StateSnapshot, (self.segments, self._shm.name)
+
+    @staticmethod
+    def segment_field(field: str, segment: str) -> str:
+        return f'{segment}.{field}'
+
+    def publish(self, values: Dict[str, Any]):
+        self._sequence[0] += 1
+        for i, field in enumerate(self.fields):
+            if field in values:
+                self._values[i] = values[field]
+        self._sequence[0] += 1
+
+    def publish_patterns(self, names: List[str]):
+        """
+        Raises ValueError if the names take more than PATTERN_NAMES_BYTES, leaving the old ones
+        """
+        encoded = np.frombuffer(json.dumps(names).encode(), dtype=np.uint8)
+        if len(encoded) > len(self._names):
+            raise ValueError(f'The pattern names take {len(encoded)} bytes, more than the {len(self._names)} shared')
+
+        self._sequence[0] += 1
+        self._names[:len(encoded)] = encoded
+        self._names_length[0] = len(encoded)
+        self._sequence[0] += 1
+
+    def read(self) -> Dict[str, float]:
+        while True:
+            sequence = int(self._sequence[0])
+            if sequence % 2 == 1:
+                continue
+            values = self._values.tolist()
+            if int(self._sequence[0]) == sequence:
+                return dict(zip(self.fields, values))
+
+    def read_patterns(self) -> List[str]:
+        while True:
+            sequence = int(self._sequence[0])
+            if sequence % 2 == 1:
+                continue
+            encoded = self._names[:min(int(self._names_length[0]), len(self._names))].tobytes()
+            if int(self._sequence[0]) == sequence:
+                return json.loads(encoded)
+
+    def close(self):
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
@@ -0,0 +1,32 @@
+class RGBW(int):
+    """
+    Color packed into an int the same way rpi_ws281x does it (0xWWRRGGBB), so it can be handed to any strip backend.
+    Kept here so patterns don't need rpi_ws281x installed.
+    """
+
+    def __new__(cls, r, g=None, b=None, w=None):
+        if (g, b, w) == (None, None, None):
+            return int.__new__(cls, r)
+        if w is None:
+            w = 0
+        return int.__new__(cls, (w << 24) | (r << 16) | (g << 8) | b)
+
+    @property
+    def r(self):
+        return (self >> 16) & 0xff
+
+    @property
+    def g(self):
+        return (self >> 8) & 0xff
+
+    @property
+    def b(self):
+        return self & 0xff
+
+    @property
+    def w(self):
+        return (self >> 24) & 0xff
+
+
+def Color(red: int, green: int, blue: int, white: int = 0) -> RGBW:
+    return RGBW(red, green, blue, white)
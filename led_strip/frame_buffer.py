@@ -0,0 +1,98 @@
+from typing import Any, List, Tuple, Optional
+
+import numpy as np
+
+Range = Tuple[int, int]
+"""
+Half-open range of LED indices, (start, end)
+"""
+
+
+class FrameBuffer:
+    """
+    What the strip should be showing, plus which index ranges changed since the last time they were taken.
+    Writers either set individual pixels (and know what they changed) or hand over a whole frame, in which case
+    the changed ranges are found by comparing it with what's already there.
+    """
+
+    def __init__(self, num_leds: int, pixels: Optional[np.ndarray] = None):
+        """
+        pixels is an existing uint32 array of num_leds to draw into (e.g. in shared memory), a new one if None
+        """
+        self.pixels = np.zeros(num_leds, dtype=np.uint32) if pixels is None else pixels
+        self.last_writer: Any = None
+        """
+        Whatever last wrote to the buffer, so sparse writers can tell whether the buffer still holds their output
+        """
+        self._dirty: List[Range] = []
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def set(self, index: int, color: int):
+        if self.pixels.item(index) != color:
+            self.pixels[index] = color
+            self.mark_dirty([(index, index + 1)])
+
+    def update(self, frame: np.ndarray):
+        frame = frame[:len(self.pixels)]
+        changed = np.flatnonzero(self.pixels[:len(frame)] != frame)
+        if len(changed) == 0:
+            return
+        self.pixels[changed] = frame[changed]
+        self.mark_dirty(_ranges_from_indices(changed))
+
+    def mark_dirty(self, ranges: List[Range]):
+        self._dirty.extend(ranges)
+
+    def mark_all_dirty(self):
+        self.mark_dirty([(0, len(self.pixels))])
+
+    def view(self, start: int, end: int) -> 'FrameBuffer':
+        """
+        FrameBuffer over [start, end) of this one, e.g. for a segment of the strip. It writes straight into this
+        buffer's pixels and dirty ranges, but has its own last_writer.
+        """
+        return _FrameBufferView(self, start, end)
+
+    def is_dirty(self) -> bool:
+        return len(self._dirty) > 0
+
+    def take_dirty(self) -> List[Range]:
+        """
+        Returns the changed ranges, sorted and merged, and forgets them
+        """
+        dirty = sorted(self._dirty)
+        self._dirty = []
+
+        merged: List[Range] = []
+        for start, end in dirty:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+            else:
+                merged.append((start, end))
+        return merged
+
+
+class _FrameBufferView(FrameBuffer):
+    def __init__(self, parent: FrameBuffer, start: int, end: int):
+        self.pixels = parent.pixels[start:end]
+        self.last_writer: Any = None
+        self._parent = parent
+        self._start = start
+
+    def is_dirty(self) -> bool:
+        raise NotImplementedError('Dirty ranges are tracked by the buffer the view was taken from')
+
+    def take_dirty(self) -> List[Range]:
+        raise NotImplementedError('Dirty ranges are tracked by the buffer the view was taken from')
+
+    def mark_dirty(self, ranges: List[Range]):
+        self._parent.mark_dirty([(start + self._start, end + self._start) for start, end in ranges])
+
+
+def _ranges_from_indices(indices: np.ndarray) -> List[Range]:
+    breaks = np.flatnonzero(np.diff(indices) > 1)
+    starts = indices[np.concatenate(([0], breaks + 1))]
+    ends = indices[np.concatenate((breaks, [len(indices) - 1]))] + 1
+    return list(zip(starts.tolist(), ends.tolist()))
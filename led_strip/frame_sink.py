@@ -0,0 +1,102 @@
+import ctypes
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING, List
+
+import numpy as np
+
+from .frame_buffer import Range
+
+if TYPE_CHECKING:
+    from rpi_ws281x import PixelStrip
+
+
+class FrameSink(ABC):
+    """
+    Takes whole frames (anything that exposes a buffer of uint32 colors, e.g. a NumPy array, an array('I') or a
+    memoryview) and gets them onto the LEDs.
+    """
+
+    @abstractmethod
+    def write(self, frame):
+        pass
+
+    def write_ranges(self, frame, ranges: List[Range]):
+        """
+        Only writes the given index ranges of frame, the rest of the strip is assumed to already be right.
+        Sinks that can't do better than that write the whole frame.
+        """
+        self.write(frame)
+
+    @abstractmethod
+    def show(self):
+        pass
+
+
+class PixelStripSink(FrameSink):
+    """
+    Copies frames straight into the ws2811 channel's LED array with a single memmove instead of calling
+    setPixelColor for every LED. The strip has to have been begun, since that's when the array gets allocated.
+    """
+
+    def __init__(self, strip: 'PixelStrip'):
+        import _rpi_ws281x as ws
+
+        self._strip = strip
+        self._num_pixels = strip.numPixels()
+        self._leds_address = int(ws.ws2811_channel_t_leds_get(strip._channel))
+
+    def write(self, frame):
+        frame = _as_frame(frame)[:self._num_pixels]
+        ctypes.memmove(self._leds_address, frame.ctypes.data, frame.nbytes)
+
+    def write_ranges(self, frame, ranges: List[Range]):
+        frame = _as_frame(frame)[:self._num_pixels]
+        for start, end in _limit_spans(ranges):
+            ctypes.memmove(self._leds_address + start * 4, frame.ctypes.data + start * 4, (end - start) * 4)
+
+    def show(self):
+        self._strip.show()
+
+
+class MemorySink(FrameSink):
+    """
+    Keeps the last written and last shown frame in memory. Used for testing and benchmarking without hardware.
+    """
+
+    def __init__(self, num_pixels: int):
+        self.pixels = np.zeros(num_pixels, dtype=np.uint32)
+        self.shown_pixels = np.zeros(num_pixels, dtype=np.uint32)
+        self.writes = 0
+        self.shows = 0
+
+    def write(self, frame):
+        frame = _as_frame(frame)[:len(self.pixels)]
+        self.pixels[:len(frame)] = frame
+        self.writes += 1
+
+    def write_ranges(self, frame, ranges: List[Range]):
+        frame = _as_frame(frame)
+        for start, end in _limit_spans(ranges):
+            self.pixels[start:end] = frame[start:end]
+        self.writes += 1
+
+    def show(self):
+        np.copyto(self.shown_pixels, self.pixels)
+        self.shows += 1
+
+
+_MAX_SPANS = 16
+
+
+def _limit_spans(ranges: List[Range]) -> List[Range]:
+    # Past a point, one copy over everything is cheaper than lots of small ones
+    if len(ranges) > _MAX_SPANS:
+        return [(ranges[0][0], ranges[-1][1])]
+    return ranges
+
+
+def _as_frame(frame) -> np.ndarray:
+    if not isinstance(frame, np.ndarray):
+        frame = np.frombuffer(frame, dtype=np.uint32)
+    # Only copies if the frame isn't already a contiguous uint32 array
+    return np.ascontiguousarray(frame, dtype=np.uint32)
@@ -0,0 +1,171 @@
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, List, Tuple
+
+import numpy as np
+
+from .frame_buffer import Range
+from .frame_sink import FrameSink, _as_frame, _limit_spans
+
+
+class Strip(ABC):
+    """
+    The parts of rpi_ws281x.PixelStrip's interface that the control loops use, so that they can run against
+    something other than real hardware.
+    """
+
+    @abstractmethod
+    def begin(self):
+        pass
+
+    @abstractmethod
+    def show(self):
+        pass
+
+    @abstractmethod
+    def numPixels(self) -> int:
+        pass
+
+    @abstractmethod
+    def setPixelColor(self, n: int, color: int):
+        pass
+
+    @abstractmethod
+    def getPixelColor(self, n: int) -> int:
+        pass
+
+    @abstractmethod
+    def setBrightness(self, brightness: int):
+        pass
+
+    @abstractmethod
+    def getBrightness(self) -> int:
+        pass
+
+    @abstractmethod
+    def frame_sink(self) -> FrameSink:
+        """
+        Returns the fastest way to get whole frames onto this strip. Only valid after begin().
+        """
+        pass
+
+
+class VirtualStrip(Strip):
+    """
+    Strip that only exists in memory. Every show() records the frame, when it happened and how long show() took
+    into a ring buffer of the last `history` frames, so frame times can be measured without hardware.
+
+    With simulate_wire_time, show() blocks like the real driver does: it waits for the previous frame to finish
+    going down the wire (24 bits per LED at freq_hz plus the reset time) before starting the next one.
+    """
+
+    _RESET_TIME_S = 50e-6
+
+    def __init__(self, num: int, history: int, brightness: int = 255, freq_hz: int = 800000,
+                 simulate_wire_time: bool = False):
+        self.pixels = np.zeros(num, dtype=np.uint32)
+        self.frames = np.zeros((history, num), dtype=np.uint32)
+        self.brightnesses = np.zeros(history, dtype=np.uint8)
+        self.timestamps = np.zeros(history)
+        self.show_latencies = np.zeros(history)
+        self.frame_count = 0
+
+        self._brightness = brightness
+        self._wire_time = num * 24 / freq_hz + self._RESET_TIME_S if simulate_wire_time else 0
+        self._busy_until = 0
+
+    def begin(self):
+        pass
+
+    def show(self):
+        start_time = time.monotonic()
+
+        if self._wire_time > 0:
+            if self._busy_until > start_time:
+                time.sleep(self._busy_until - start_time)
+            self._busy_until = time.monotonic() + self._wire_time
+
+        slot = self.frame_count % len(self.frames)
+        self.frames[slot] = self.pixels
+        self.brightnesses[slot] = self._brightness
+        self.timestamps[slot] = start_time
+        self.show_latencies[slot] = time.monotonic() - start_time
+        self.frame_count += 1
+
+    def numPixels(self) -> int:
+        return len(self.pixels)
+
+    def setPixelColor(self, n: int, color: int):
+        self.pixels[n] = color
+
+    def getPixelColor(self, n: int) -> int:
+        return int(self.pixels[n])
+
+    def setBrightness(self, brightness: int):
+        self._brightness = brightness
+
+    def getBrightness(self) -> int:
+        return self._brightness
+
+    def frame_sink(self) -> FrameSink:
+        return VirtualStripSink(self)
+
+    def recorded_frames(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (frames, timestamps, show latencies) for the frames still in the ring buffer, oldest first.
+        """
+        recorded = min(self.frame_count, len(self.frames))
+        order = (np.arange(recorded) + self.frame_count - recorded) % len(self.frames)
+        return self.frames[order], self.timestamps[order], self.show_latencies[order]
+
+    def frame_intervals(self) -> np.ndarray:
+        _, timestamps, _ = self.recorded_frames()
+        return np.diff(timestamps)
+
+    def dropped_frames(self, target_hz: float) -> int:
+        """
+        Number of frames that should have been shown between the recorded ones but weren't.
+        """
+        missed = np.round(self.frame_intervals() * target_hz) - 1
+        return int(missed[missed > 0].sum())
+
+
+class VirtualStripSink(FrameSink):
+    def __init__(self, strip: VirtualStrip):
+        self._strip = strip
+
+    def write(self, frame):
+        frame = _as_frame(frame)[:len(self._strip.pixels)]
+        self._strip.pixels[:len(frame)] = frame
+
+    def write_ranges(self, frame, ranges: List[Range]):
+        frame = _as_frame(frame)
+        for start, end in _limit_spans(ranges):
+            self._strip.pixels[start:end] = frame[start:end]
+
+    def show(self):
+        self._strip.show()
+
+
+def _ws281x_strip(num: int, pin: int, freq_hz: int, dma: int, invert: bool, brightness: int, channel: int) -> Strip:
+    # Imported here so that rpi_ws281x is only needed when driving real hardware
+    from .ws281x_strip import Ws281xStrip
+    return Ws281xStrip(num, pin, freq_hz, dma, invert, brightness, channel)
+
+
+def _virtual_strip(num: int, pin: int, freq_hz: int, dma: int, invert: bool, brightness: int, channel: int,
+                   history: int = 600, simulate_wire_time: bool = True) -> Strip:
+    return VirtualStrip(num, history, brightness, freq_hz, simulate_wire_time)
+
+
+strip_backends: Dict[str, Callable[..., Strip]] = {
+    'ws281x': _ws281x_strip,
+    'virtual': _virtual_strip
+}
+
+
+def create_strip(backend: str, num: int, pin: int, freq_hz: int, dma: int, invert: bool, brightness: int,
+                 channel: int, **backend_args) -> Strip:
+    if backend not in strip_backends:
+        raise ValueError(f'Unknown strip backend {backend!r}, expected one of {list(strip_backends)}')
+    return strip_backends[backend](num, pin, freq_hz, dma, invert, brightness, channel, **backend_args)
@@ -0,0 +1,12 @@
+from rpi_ws281x import PixelStrip
+
+from .frame_sink import FrameSink, PixelStripSink
+from .strip import Strip
+
+
+class Ws281xStrip(PixelStrip, Strip):
+    def __init__(self, num: int, pin: int, freq_hz: int, dma: int, invert: bool, brightness: int, channel: int):
+        super().__init__(num, pin, freq_hz, dma, invert, brightness, channel)
+
+    def frame_sink(self) -> FrameSink:
+        return PixelStripSink(self)
@@ -1,16 +1,23 @@
-from multiprocessing import Process, Pipe, Lock
-from typing import Any, List, Iterable
-
-from flask import Flask, request
+import base64
+import os
+import sys
+import time
+from multiprocessing import Process, Pipe
+from typing import Any, List, Iterable, Optional
+
+from flask import Flask, Response, request
 from flask_api import status
-from rpi_ws281x import Color
 from werkzeug.datastructures import MultiDict
 
 import led_control_v2 as led_control
+from led_control_v2 import config
+from led_strip.color import Color
 
 app = Flask(__name__)
-pipe = None
-pipe_mutex = Lock()
+channel: led_control.CommandChannel = None
+snapshot: led_control.StateSnapshot = None
+preview: led_control.SharedFrameBuffer = None
+profiler: Optional[led_control.FrameProfiler] = None
 
 
 class MissingValuesException(Exception):
@@ -18,11 +25,13 @@ class MissingValuesException(Exception):
         self.missing_args = missing_args
 
 
+class UnknownSegmentException(Exception):
+    def __init__(self, segment: str):
+        self.segment = segment
+
+
 def pipe_send(data: Any) -> Any:
-    with pipe_mutex:
-        pipe.send(data)
-        resp = pipe.recv()
-    return resp
+    return channel.send(data)
 
 
 def require_args(required_args: Iterable[str], args: MultiDict) -> List[str]:
@@ -42,6 +51,20 @@ def require_args(required_args: Iterable[str], args: MultiDict) -> List[str]:
     return values
 
 
+def segment_arg(args: MultiDict) -> Optional[str]:
+    """
+    The optional `segment` arg every route takes. None means the default segment.
+    """
+    segment = args.get('segment')
+    if segment is not None and (not isinstance(segment, str) or segment not in config.SEGMENTS):
+        raise UnknownSegmentException(segment)
+    return segment
+
+
+def read_segment_value(field: str, segment: Optional[str]) -> float:
+    return snapshot.read()[led_control.StateSnapshot.segment_field(field, segment or config.DEFAULT_SEGMENT)]
+
+
 def get_return_for_response(response: led_control.CommandResponse):
     data = response.data
     if data is None:
@@ -63,46 +86,127 @@ def set_color():
     green = int(green)
     blue = int(blue)
 
-    resp = pipe_send(led_control.SetColorCommand(Color(red, green, blue)))
+    resp = pipe_send(led_control.SetColorCommand(Color(red, green, blue), segment_arg(request.args)))
     return get_return_for_response(resp)
 
 
 @app.route('/set_value/brightness', methods=['PUT'])
 def set_brightness():
     value, = require_args(('value',), request.args)
-    command = led_control.SetBrightnessCommand(int(value))
+    command = led_control.SetBrightnessCommand(int(value), segment_arg(request.args))
     resp = pipe_send(command)
     return get_return_for_response(resp)
 
 
 @app.route('/get_value/brightness', methods=['GET'])
 def get_brightness():
-    command = led_control.GetBrightnessCommand()
-    resp = pipe_send(command)
-    return get_return_for_response(resp)
+    return str(int(read_segment_value('brightness', segment_arg(request.args)))), status.HTTP_200_OK
 
 
 @app.route('/set_value/increment', methods=['PUT'])
 def set_increment():
     value, = require_args(('value',), request.args)
-    command = led_control.SetIncrementCommand(float(value))
+    command = led_control.SetIncrementCommand(float(value), segment_arg(request.args))
     resp = pipe_send(command)
     return get_return_for_response(resp)
 
 
 @app.route('/get_value/increment', methods=['GET'])
 def get_increment():
-    command = led_control.GetIncrementCommand()
-    resp = pipe_send(command)
-    return get_return_for_response(resp)
+    return str(read_segment_value('progress_increment', segment_arg(request.args))), status.HTTP_200_OK
+
+
+@app.route('/stats/frames', methods=['GET'])
+def get_frame_stats():
+    state = snapshot.read()
+    return {
+        'frames_rendered': int(state['frames_rendered']),
+        'deadlines_missed': int(state['deadlines_missed']),
+        'frames_skipped': int(state['frames_skipped']),
+        'worst_lateness_ms': state['worst_lateness_ms']
+    }, status.HTTP_200_OK
+
+
+@app.route('/stats/frame_cache', methods=['GET'])
+def get_frame_cache_stats():
+    state = snapshot.read()
+    return {
+        'bytes': int(state['frame_cache_bytes']),
+        'hits': int(state['frame_cache_hits']),
+        'misses': int(state['frame_cache_misses'])
+    }, status.HTTP_200_OK
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Frame stats in the Prometheus text format, plus the timing histograms if profiling is enabled
+    """
+    state = snapshot.read()
+    lines = []
+    for name, field, metric_type, help_text in (
+            ('led_frames_rendered_total', 'frames_rendered', 'counter', 'Frames rendered'),
+            ('led_deadlines_missed_total', 'deadlines_missed', 'counter', 'Frames that started late'),
+            ('led_frames_skipped_total', 'frames_skipped', 'counter', 'Frames skipped to catch up'),
+            ('led_worst_lateness_seconds', 'worst_lateness_ms', 'gauge', 'Latest a frame has started'),
+            ('led_frame_cache_bytes', 'frame_cache_bytes', 'gauge', 'Memory used by frame caches'),
+            ('led_audio_latency_seconds', 'audio_latency_ms', 'gauge',
+             'From the newest audio sample to the last frame using it being shown')):
+        value = state[field] / 1000 if field.endswith('_ms') else state[field]
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} {metric_type}', f'{name} {value}']
+
+    text = '\n'.join(lines) + '\n'
+    if profiler is not None:
+        text += profiler.to_prometheus()
+    return Response(text, mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/preview', methods=['GET'])
+def stream_preview():
+    """
+    Server-sent events with the current frame as base64 encoded r, g, b bytes per LED, at most `fps` times a second.
+    Only the LEDs of `segment` if it's given.
+
+    Each stream holds a web server thread while it's open. It ends after PREVIEW_STREAM_MAX_S, telling the browser to
+    reconnect a second later, and stops as soon as writing to a client that went away fails.
+    """
+    try:
+        fps = min(float(request.args.get('fps', 10)), config.REFRESH_RATE_TARGET_HZ)
+    except ValueError:
+        return "fps must be a number", status.HTTP_400_BAD_REQUEST
+    if not fps > 0:
+        return "fps must be positive", status.HTTP_400_BAD_REQUEST
+    segment = segment_arg(request.args)
+    start, end = config.SEGMENTS[segment] if segment is not None else (0, config.TOTAL_LED_COUNT)
+
+    def frames():
+        yield 'retry: 1000\n\n'
+        last_sequence = None
+        last_sent = time.monotonic()
+        end_time = last_sent + config.PREVIEW_STREAM_MAX_S
+        while time.monotonic() < end_time:
+            sequence, frame = preview.read_latest()
+            if frame is not None and sequence != last_sequence:
+                last_sequence = sequence
+                last_sent = time.monotonic()
+                data = base64.b64encode(led_control.frame_to_rgb_bytes(frame[start:end])).decode()
+                yield f'data: {data}\n\n'
+            elif time.monotonic() - last_sent >= config.PREVIEW_KEEPALIVE_S:
+                last_sent = time.monotonic()
+                yield ': keepalive\n\n'
+            time.sleep(1 / fps)
+
+    return Response(frames(), mimetype='text/event-stream')
 
 
 @app.route('/pattern/<path:pattern>', methods=['PUT'])
 def pattern_input(pattern: str):
-    if pattern not in led_control.patterns:
+    if pattern not in snapshot.read_patterns():
+        return "Unknown pattern", status.HTTP_404_NOT_FOUND
+    resp = pipe_send(led_control.PatternCommand(pattern, segment_arg(request.args)))
+    # The patterns can still be replaced before the render loop gets to the command
+    if resp.status == led_control.CommandResponse.Status.FAILED and isinstance(resp.data, KeyError):
         return "Unknown pattern", status.HTTP_404_NOT_FOUND
-
-    resp = pipe_send(led_control.PatternCommand(pattern))
     return get_return_for_response(resp)
 
 
@@ -113,7 +217,99 @@ def root():
 
 @app.route('/patterns', methods=['GET'])
 def patterns():
-    return led_control.patterns, status.HTTP_200_OK
+    return snapshot.read_patterns(), status.HTTP_200_OK
+
+
+@app.route('/patterns', methods=['PUT'])
+def load_patterns():
+    """
+    Replaces all pattern definitions with the uploaded JSON or YAML document (see pattern_definitions.py). The
+    format comes from `format` or the content type, JSON if neither says.
+    """
+    file_format = request.args.get('format')
+    if file_format is None:
+        file_format = 'yaml' if 'yaml' in (request.content_type or '') else 'json'
+
+    resp = pipe_send(led_control.LoadPatternsCommand(request.get_data(as_text=True), file_format))
+    if resp.status == led_control.CommandResponse.Status.OK:
+        return resp.data, status.HTTP_200_OK
+    if isinstance(resp.data, led_control.PatternDefinitionError):
+        return str(resp.data), status.HTTP_400_BAD_REQUEST
+    return get_return_for_response(resp)
+
+
+def batch_pattern(args: dict, segment: Optional[str]) -> led_control.PatternCommand:
+    name, = require_args(('name',), args)
+    if not isinstance(name, str):
+        raise TypeError('name has to be a string')
+    return led_control.PatternCommand(name, segment)
+
+
+def batch_color(args: dict, segment: Optional[str]) -> led_control.SetColorCommand:
+    red, green, blue = require_args(('r', 'g', 'b'), args)
+    return led_control.SetColorCommand(Color(int(red), int(green), int(blue)), segment)
+
+
+def batch_brightness(args: dict, segment: Optional[str]) -> led_control.SetBrightnessCommand:
+    value, = require_args(('value',), args)
+    return led_control.SetBrightnessCommand(int(value), segment)
+
+
+def batch_increment(args: dict, segment: Optional[str]) -> led_control.SetIncrementCommand:
+    value, = require_args(('value',), args)
+    return led_control.SetIncrementCommand(float(value), segment)
+
+
+batch_commands = {
+    'pattern': batch_pattern,
+    'color': batch_color,
+    'brightness': batch_brightness,
+    'increment': batch_increment,
+}
+
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """
+    Runs a JSON list of commands in one go, all in the same frame or none of them if one fails, e.g.
+
+        [{"command": "pattern", "name": "RGB Chase"}, {"command": "brightness", "value": 64, "segment": "all"}]
+
+    Each takes the args of the matching single command route. Responds with a status and data for every command.
+    """
+    items = request.get_json(force=True, silent=True)
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        return "Expected a list of commands", status.HTTP_400_BAD_REQUEST
+
+    commands = []
+    for item in items:
+        if not isinstance(item.get('command'), str) or item['command'] not in batch_commands:
+            return f"Unknown command: {item.get('command')}, expected one of {', '.join(batch_commands)}", \
+                status.HTTP_400_BAD_REQUEST
+        try:
+            commands.append(batch_commands[item['command']](item, segment_arg(item)))
+        except (ValueError, TypeError, AssertionError):
+            return f"Invalid args for {item['command']}", status.HTTP_400_BAD_REQUEST
+
+    resp = pipe_send(led_control.BatchCommand(commands))
+    if not isinstance(resp.data, list):
+        return get_return_for_response(resp)
+
+    results = [{'status': response.status.name, 'data': None if response.data is None else str(response.data)}
+               for response in resp.data]
+    if resp.status == led_control.CommandResponse.Status.OK:
+        return results, status.HTTP_200_OK
+    return results, status.HTTP_500_INTERNAL_SERVER_ERROR
+
+
+@app.route('/segments', methods=['GET'])
+def segments():
+    return {name: {'start': start, 'end': end} for name, (start, end) in config.SEGMENTS.items()}, status.HTTP_200_OK
+
+
+@app.errorhandler(UnknownSegmentException)
+def handle_unknown_segment(e: UnknownSegmentException):
+    return f"Unknown segment: {e.segment}", status.HTTP_404_NOT_FOUND
 
 
 @app.errorhandler(MissingValuesException)
@@ -135,9 +331,15 @@ def add_header(r):
 
 if __name__ == '__main__':
     parent_conn, child_conn = Pipe()
-    p = Process(target=led_control.run_control_loop, args=(child_conn,))
-
-    pipe = parent_conn
+    snapshot = led_control.StateSnapshot()
+    preview = led_control.SharedFrameBuffer(config.TOTAL_LED_COUNT, config.PREVIEW_SLOTS, config.PREVIEW_IDLE_TIMEOUT_S)
+    if config.PROFILING:
+        profiler = led_control.FrameProfiler(config.PROFILE_PATTERN_NODES)
+    # The render loop's process gets /dev/null as stdin, so audio from stdin reaches it through a copy
+    stdin_fd = os.dup(sys.stdin.fileno()) if config.AUDIO_SOURCE == 'stdin' else None
+    p = Process(target=led_control.run_control_loop, args=(child_conn, snapshot, preview, profiler, stdin_fd))
+
+    channel = led_control.CommandChannel(parent_conn)
 
     p.start()
     app.run(host="0.0.0.0")
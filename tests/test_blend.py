@@ -0,0 +1,62 @@
+import colorsys
+
+import numpy as np
+import pytest
+
+from led_control_v2.blend import BlendCache, BlendMode, blend_colors, blend_frames
+from led_strip.color import RGBW
+
+
+def _colorsys_midpoint(color1: int, color2: int) -> int:
+    """
+    Blending as it was before the blend module, straight through colorsys
+    """
+    rgb1, rgb2 = RGBW(color1), RGBW(color2)
+    hsv1 = colorsys.rgb_to_hsv(rgb1.r / 255, rgb1.g / 255, rgb1.b / 255)
+    hsv2 = colorsys.rgb_to_hsv(rgb2.r / 255, rgb2.g / 255, rgb2.b / 255)
+    r, g, b = colorsys.hsv_to_rgb(*((a + b) / 2 for a, b in zip(hsv1, hsv2)))
+    return (int(r * 255) << 16) | (int(g * 255) << 8) | int(b * 255)
+
+
+def _color_pairs(count: int):
+    rng = np.random.default_rng(0)
+    frame1 = rng.integers(0, 1 << 32, count, dtype=np.uint32)
+    frame2 = rng.integers(0, 1 << 32, count, dtype=np.uint32)
+    # Grays, black and white have no hue, and equal channels take other branches of rgb_to_hsv
+    levels = np.array([0, 1, 127, 128, 254, 255], dtype=np.uint32)
+    grays = (levels << 16) | (levels << 8) | levels
+    edge_cases = np.array([0xff0000, 0x00ff00, 0x0000ff, 0xffff00, 0x00ffff, 0xff00ff, 0xff0001, 0x01ff00],
+                          dtype=np.uint32)
+    special = np.concatenate((grays, edge_cases))
+    pairs1, pairs2 = np.meshgrid(special, special)
+    return np.concatenate((frame1, pairs1.ravel())), np.concatenate((frame2, pairs2.ravel()))
+
+
+def test_hsv_midpoint_frames_match_colorsys():
+    frame1, frame2 = _color_pairs(5000)
+    expected = np.array([_colorsys_midpoint(int(a), int(b)) for a, b in zip(frame1, frame2)], dtype=np.uint32)
+    np.testing.assert_array_equal(blend_frames(frame1, frame2, BlendMode.HSV_MIDPOINT), expected)
+
+
+def test_hsv_midpoint_colors_match_colorsys():
+    frame1, frame2 = _color_pairs(500)
+    for a, b in zip(frame1, frame2):
+        assert int(blend_colors(RGBW(int(a)), RGBW(int(b)))) == _colorsys_midpoint(int(a), int(b))
+
+
+@pytest.mark.parametrize('mode', list(BlendMode))
+def test_frames_match_colors(mode: BlendMode):
+    frame1, frame2 = _color_pairs(500)
+    expected = np.array([int(blend_colors(RGBW(int(a)), RGBW(int(b)), mode)) for a, b in zip(frame1, frame2)],
+                        dtype=np.uint32)
+    np.testing.assert_array_equal(blend_frames(frame1, frame2, mode), expected)
+
+
+@pytest.mark.parametrize('mode', list(BlendMode))
+def test_cache_matches_uncached(mode: BlendMode):
+    rng = np.random.default_rng(1)
+    palette = rng.integers(0, 1 << 24, 20, dtype=np.uint32)
+    cache = BlendCache(mode, max_pairs=64)
+    for _ in range(10):
+        frame1, frame2 = rng.choice(palette, 300), rng.choice(palette, 300)
+        np.testing.assert_array_equal(cache.blend(frame1, frame2), blend_frames(frame1, frame2, mode))
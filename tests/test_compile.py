@@ -0,0 +1,34 @@
+import numpy as np
+
+from led_control_v2.compile import CompiledPattern, compile_pattern
+from led_control_v2.pattern import ChasePattern, FullRandomPattern, NTimes, Reversed, find_patterns
+from led_control_v2.profiling import FrameProfiler
+
+
+def _tree():
+    return ChasePattern(NTimes(2, Reversed(FullRandomPattern(1)), Reversed(FullRandomPattern(2))))
+
+
+def test_nested_compiled_patterns_are_children():
+    compiled = compile_pattern(_tree())
+    nested = find_patterns(compiled, CompiledPattern)
+    # Chases and NTimes render through their own render_frame, the Reversed under NTimes are compiled
+    assert len(nested) == 2
+    # The trees they were compiled from are still under them, not beside them
+    assert len(find_patterns(compiled, Reversed)) == 2
+    assert len(find_patterns(compiled, FullRandomPattern)) == 2
+
+    profiler = FrameProfiler(pattern_nodes=True)
+    profiler.instrument(compiled)
+    assert all('render_frame' in vars(node) for node in nested)
+    profiler.close()
+
+
+def test_compiling_keeps_the_frames():
+    expected, compiled = _tree(), compile_pattern(_tree())
+    progress = 0.0
+    for _ in range(50):
+        np.testing.assert_array_equal(compiled.render_frame(progress, 60), expected.render_frame(progress, 60))
+        compiled.after_update()
+        expected.after_update()
+        progress = (progress + 0.07) % 1
@@ -0,0 +1,157 @@
+import socket
+import struct
+import time
+
+import numpy as np
+import pytest
+
+from led_control_v2.ingest import (DdpProtocol, E131Protocol, UdpIngest, create_ingest, ddp_packets, e131_packets,
+                                   ingest_protocols)
+
+
+def _rgb(leds: int) -> bytes:
+    return np.random.default_rng(0).integers(0, 256, leds * 3, dtype=np.uint8).tobytes()
+
+
+def _parse_all(protocol, packets, leds: int):
+    rgb = bytearray(leds * 3)
+    completed = [protocol.parse(memoryview(packet), memoryview(rgb)) for packet in packets]
+    return bytes(rgb), completed
+
+
+def test_ddp_round_trip():
+    frame = _rgb(1000)
+    rgb, completed = _parse_all(DdpProtocol(), ddp_packets(frame), 1000)
+    assert rgb == frame
+    # 3000 bytes in 1440 byte packets, only the last one pushes
+    assert completed == [False, False, True]
+
+
+def test_ddp_header_from_the_spec():
+    rgb = bytearray(12)
+    # Version 1 with push, sequence 3, RGB 8 bit, display id 1, offset 3, 6 bytes
+    packet = bytes([0x41, 0x03, 0x0b, 0x01, 0, 0, 0, 3, 0, 6]) + bytes(range(1, 7))
+    assert DdpProtocol().parse(memoryview(packet), memoryview(rgb))
+    assert bytes(rgb) == bytes([0, 0, 0, 1, 2, 3, 4, 5, 6, 0, 0, 0])
+
+    # The timecode flag adds 4 bytes before the data, without push the frame isn't complete
+    packet = bytes([0x50, 0, 0x0b, 0x01, 0, 0, 0, 0, 0, 3]) + b'\xff' * 4 + bytes([7, 8, 9])
+    assert not DdpProtocol().parse(memoryview(packet), memoryview(rgb))
+    assert bytes(rgb[:3]) == bytes([7, 8, 9])
+
+
+def test_ddp_rejects_and_clips():
+    rgb = bytearray(6)
+    assert not DdpProtocol().parse(memoryview(b'\x41\x00\x0b'), memoryview(rgb))
+    # Version 2 isn't understood
+    packet = bytes([0x81, 0, 0x0b, 0x01, 0, 0, 0, 0, 0, 3]) + b'\x01\x02\x03'
+    assert not DdpProtocol().parse(memoryview(packet), memoryview(rgb))
+    assert bytes(rgb) == bytes(6)
+
+    # Data past the end of the strip and lengths past the end of the packet are cut off
+    packet = bytes([0x41, 0, 0x0b, 0x01, 0, 0, 0, 3, 0, 200]) + bytes(range(1, 10))
+    assert DdpProtocol().parse(memoryview(packet), memoryview(rgb))
+    assert bytes(rgb) == bytes([0, 0, 0, 1, 2, 3])
+
+
+def test_e131_round_trip():
+    frame = _rgb(400)
+    rgb, completed = _parse_all(E131Protocol(start_universe=5), e131_packets(frame, start_universe=5), 400)
+    assert rgb == frame
+    # 170 pixels per universe, the frame is complete with the universe holding the last LED
+    assert completed == [False, False, True]
+
+
+def test_e131_ignores_other_packets():
+    frame = _rgb(170)
+    packet = bytearray(next(e131_packets(frame, start_universe=1)))
+    protocol = E131Protocol(start_universe=2)
+    rgb = bytearray(170 * 3)
+    # Universe below the first one
+    assert not protocol.parse(memoryview(bytes(packet)), memoryview(rgb))
+
+    protocol = E131Protocol(start_universe=1)
+    for offset, value in ((125, 0xdd), (4, ord('X')), (43, 0x01)):
+        # Start code other than DMX, wrong packet identifier, vector other than data
+        broken = bytearray(packet)
+        broken[offset] = value
+        assert not protocol.parse(memoryview(bytes(broken)), memoryview(rgb))
+    assert bytes(rgb) == bytes(170 * 3)
+
+    # Universe field at byte 113
+    struct.pack_into('>H', packet, 113, 1)
+    assert protocol.parse(memoryview(bytes(packet)), memoryview(rgb))
+    assert bytes(rgb) == frame
+
+
+def _send_and_wait(ingest: UdpIngest, packets, frames: int):
+    sender = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        for packet in packets:
+            sender.sendto(packet, ('127.0.0.1', ingest.port))
+        deadline = time.monotonic() + 2
+        while ingest.frames_received < frames and time.monotonic() < deadline:
+            time.sleep(0.01)
+    finally:
+        sender.close()
+
+
+def _packed(frame: bytes) -> np.ndarray:
+    rgb = np.frombuffer(frame, dtype=np.uint8).reshape(-1, 3).astype(np.uint32)
+    return (rgb[:, 0] << 16) | (rgb[:, 1] << 8) | rgb[:, 2]
+
+
+def test_udp_ingest_delivers_frames():
+    leds = 600
+    frame = _rgb(leds)
+    ingest = create_ingest('ddp', leds, 0, timeout=1, host='127.0.0.1')
+    try:
+        _send_and_wait(ingest, ddp_packets(frame), 1)
+        assert ingest.is_active()
+        np.testing.assert_array_equal(ingest.frame(), _packed(frame))
+    finally:
+        ingest.close()
+
+
+# A timecode flag on a packet too short to hold the timecode, and an E1.31 value count of 0 without a start code
+_DDP_SHORT_TIMECODE = bytes([0x51, 0, 0x0b, 0x01, 0, 0, 0, 0, 0, 3, 0xff, 0xff])
+_E131_NO_VALUES = bytearray(next(e131_packets(bytes(30))))
+struct.pack_into('>H', _E131_NO_VALUES, 123, 0)
+
+
+@pytest.mark.parametrize('protocol, bad_packet, packets', [
+    ('ddp', _DDP_SHORT_TIMECODE, ddp_packets),
+    ('e131', bytes(_E131_NO_VALUES), e131_packets),
+], ids=['ddp', 'e131'])
+def test_malformed_packets_are_dropped(protocol, bad_packet, packets):
+    leds = 10
+    rgb = bytearray(leds * 3)
+    ingest_protocols[protocol]().parse(memoryview(bad_packet), memoryview(rgb))
+    assert bytes(rgb) == bytes(leds * 3)
+
+    frame = _rgb(leds)
+    ingest = create_ingest(protocol, leds, 0, timeout=1, host='127.0.0.1')
+    try:
+        # The bad packet may complete an empty frame of its own
+        _send_and_wait(ingest, [bad_packet, *packets(frame)], 2)
+        np.testing.assert_array_equal(ingest.frame(), _packed(frame))
+    finally:
+        ingest.close()
+
+
+class _FailingProtocol(DdpProtocol):
+    def parse(self, packet: memoryview, rgb: memoryview) -> bool:
+        if packet[0] == 0:
+            raise ValueError('bad packet')
+        return super().parse(packet, rgb)
+
+
+def test_ingest_survives_parse_errors():
+    leds = 10
+    frame = _rgb(leds)
+    ingest = UdpIngest(_FailingProtocol(), leds, 0, timeout=1, host='127.0.0.1')
+    try:
+        _send_and_wait(ingest, [bytes(12), *ddp_packets(frame)], 1)
+        np.testing.assert_array_equal(ingest.frame(), _packed(frame))
+    finally:
+        ingest.close()
@@ -0,0 +1,22 @@
+import numpy as np
+
+from led_control_v2 import led_control
+
+
+def test_brightness_is_only_applied_once(monkeypatch):
+    monkeypatch.setattr(led_control, 'STRIP_BACKEND', 'virtual')
+    monkeypatch.setattr(led_control, 'LED_BRIGHTNESS', 64)
+    context = led_control._init_context()
+    output = context.outputs[0]
+    assert output.strip.getBrightness() == 255
+    assert {segment.brightness for segment in context.segments.values()} == {64}
+
+    pixels = np.full(len(context.frame_buffer), 0xffffff, dtype=np.uint32)
+    output.upload(pixels, [(0, len(pixels))], context.segments.values())
+    output.show()
+    shown = output.strip.getPixelColor(0)
+    # Gamma corrected, so only check that 64 was applied and nothing on top of it
+    assert 0 < shown & 0xff < 255
+    expected = np.zeros(1, dtype=np.uint32)
+    output.post_processor.process(pixels[:1], 0, 64 / 255, expected)
+    assert shown == expected[0]
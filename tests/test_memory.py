@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+from led_control_v2.blend import BlendMode, blend_colors
+from led_control_v2.buffered import BufferedRing
+from led_control_v2.pattern import ChasePattern, Pattern
+
+
+class _IndexPattern(Pattern):
+    """
+    A different color for every pixel and progress, without randomness
+    """
+
+    def calculate_pixel(self, progress: float, index: int, total_leds: int) -> int:
+        return (index * 2654435761 + int(progress * 100000) * 40503) & 0xffffff
+
+
+class _ListChase:
+    """
+    ChasePattern as it was before the ring buffer: the last frame kept in a list, every pixel worked out on its own
+    """
+
+    def __init__(self, sub_pattern: Pattern, blend: bool):
+        self._sub_pattern = sub_pattern
+        self._blend = blend
+        self._memory = []
+        self._prev_progress = 0
+
+    def render_frame(self, progress: float, total_leds: int) -> np.ndarray:
+        next_progress = self._prev_progress
+        frame = []
+        for index in range(total_leds):
+            progress_amount = progress - self._prev_progress
+            if progress_amount < 0:
+                progress_amount += 1
+            leds_to_update = progress_amount * total_leds
+            if leds_to_update < 1:
+                if index == 0 or not self._blend:
+                    frame.append(self._color_at(index))
+                else:
+                    frame.append(blend_colors(self._color_at(index), self._color_at(index - 1),
+                                              BlendMode.HSV_MIDPOINT))
+                continue
+            leds_to_update = int(leds_to_update)
+            next_progress = progress
+            if index < leds_to_update:
+                frame.append(self._sub_pattern.calculate_pixel(progress, index, total_leds))
+            else:
+                frame.append(self._color_at(index - leds_to_update))
+        self._memory = frame
+        self._prev_progress = next_progress
+        return np.array(frame, dtype=np.uint32)
+
+    def _color_at(self, index: int) -> int:
+        return self._memory[index] if index < len(self._memory) else 0
+
+
+def _progress_steps(total_leds: int):
+    """
+    Steps of less than a pixel, a few pixels, more than the strip and across the wrap from 1 back to 0
+    """
+    rng = np.random.default_rng(0)
+    progress = 0.0
+    for step in rng.choice([0.3, 1, 2.5, 7, total_leds * 1.5], 200) / total_leds:
+        progress = (progress + step) % 1
+        yield progress
+
+
+@pytest.mark.parametrize('blend', [False, True])
+def test_chase_matches_list_version(blend):
+    total_leds = 50
+    chase = ChasePattern(_IndexPattern(), blend=blend)
+    reference = _ListChase(_IndexPattern(), blend)
+    for progress in _progress_steps(total_leds):
+        np.testing.assert_array_equal(chase.render_frame(progress, total_leds),
+                                      reference.render_frame(progress, total_leds))
+        chase.after_update()
+
+
+@pytest.mark.parametrize('blend', [False, True])
+def test_chase_pixels_match_frames(blend):
+    total_leds = 50
+    by_frame = ChasePattern(_IndexPattern(), blend=blend)
+    by_pixel = ChasePattern(_IndexPattern(), blend=blend)
+    for progress in _progress_steps(total_leds):
+        pixels = [by_pixel.calculate_pixel(progress, i, total_leds) for i in range(total_leds)]
+        np.testing.assert_array_equal(by_frame.render_frame(progress, total_leds),
+                                      np.array(pixels, dtype=np.uint32))
+        by_frame.after_update()
+        by_pixel.after_update()
+
+
+def test_buffered_ring_matches_list():
+    rng = np.random.default_rng(0)
+    ring = BufferedRing()
+    expected = []
+    for _ in range(500):
+        # Like a frame: grow the ring first, then stage changes, then swap
+        size = int(rng.integers(0, len(expected) + 4))
+        ring.resize(size)
+        expected += [0] * max(0, size - len(expected))
+        staged = list(expected)
+        for operation in rng.integers(0, 3, rng.integers(0, 4)):
+            if operation == 0:
+                colors = rng.integers(0, 1 << 24, rng.integers(0, len(expected) + 5), dtype=np.uint32)
+                ring.shift(colors)
+                staged = (list(colors) + expected)[:len(expected)]
+            elif operation == 1 and expected:
+                index, color = int(rng.integers(0, len(expected))), int(rng.integers(0, 1 << 24))
+                ring.set(index, color)
+                staged[index] = color
+            elif operation == 2:
+                frame = rng.integers(0, 1 << 24, rng.integers(0, len(expected) + 1), dtype=np.uint32)
+                ring.set_frame(frame)
+                staged[:len(frame)] = list(frame)
+
+            # Staged changes stay invisible until the swap
+            assert ring.frame().tolist() == expected
+
+        ring.swap()
+        expected = staged
+        assert ring.frame().tolist() == expected
+        assert [ring.at(i) for i in range(len(expected))] == expected
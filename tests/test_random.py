@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from led_control_v2.compile import compile_pattern
+from led_control_v2.pattern import FullRandomPattern
+from led_control_v2.pattern_definitions import PatternDefinitionError, compile_definitions
+
+TOTAL_LEDS = 100
+DEFINITIONS = {
+    'random': {'type': 'FullRandomPattern', 'seed': 5},
+    'chase': {'type': 'ChasePattern', 'blend': True, 'sub_pattern': {'type': 'FullRandomPattern', 'seed': 3}},
+}
+
+
+def _frames(pattern, by_pixel=False, count=30):
+    frames = []
+    progress = 0.0
+    for _ in range(count):
+        if by_pixel:
+            frame = np.array([pattern.calculate_pixel(progress, i, TOTAL_LEDS) for i in range(TOTAL_LEDS)],
+                             dtype=np.uint32)
+        else:
+            frame = pattern.render_frame(progress, TOTAL_LEDS).copy()
+        frames.append(frame)
+        pattern.after_update()
+        progress = (progress + 0.03) % 1
+    return frames
+
+
+def _assert_same_frames(frames1, frames2):
+    assert len(frames1) == len(frames2)
+    for frame1, frame2 in zip(frames1, frames2):
+        np.testing.assert_array_equal(frame1, frame2)
+
+
+def test_same_seed_same_frames():
+    frames = _frames(FullRandomPattern(7))
+    _assert_same_frames(_frames(FullRandomPattern(7)), frames)
+    # A new frame every frame, and a different seed gives different ones
+    assert len({frame.tobytes() for frame in frames}) == len(frames)
+    assert not np.array_equal(_frames(FullRandomPattern(8))[0], frames[0])
+    assert all(frame.max() <= 0xffffff for frame in frames)
+
+
+@pytest.mark.parametrize('name', sorted(DEFINITIONS))
+def test_seeded_definitions_render_the_same_every_way(name):
+    constructors = compile_definitions(DEFINITIONS)
+    frames = _frames(constructors[name]())
+    _assert_same_frames(_frames(constructors[name]()), frames)
+    _assert_same_frames(_frames(constructors[name](), by_pixel=True), frames)
+    _assert_same_frames(_frames(compile_pattern(constructors[name]())), frames)
+
+
+@pytest.mark.parametrize('seed', [-1, 1.5, True, '1'])
+def test_bad_seed(seed):
+    with pytest.raises(PatternDefinitionError):
+        compile_definitions({'random': {'type': 'FullRandomPattern', 'seed': seed}})
@@ -0,0 +1,41 @@
+import pytest
+
+from led_control_v2.command import CommandResponse, LoadPatternsCommand
+from led_control_v2.config import PATTERN_NAMES_BYTES, pattern_constructors
+from led_control_v2.pattern_definitions import PatternDefinitionError
+from led_control_v2.state import StateSnapshot
+
+
+class _Context:
+    def __init__(self, snapshot: StateSnapshot):
+        self.snapshot = snapshot
+        self.pattern_constructors = pattern_constructors
+
+
+@pytest.fixture
+def snapshot():
+    snapshot = StateSnapshot()
+    yield snapshot
+    snapshot.close()
+
+
+def test_pattern_names_start_with_the_pattern_file(snapshot):
+    assert snapshot.read_patterns() == list(pattern_constructors)
+
+
+def test_loading_patterns_publishes_their_names(snapshot):
+    context = _Context(snapshot)
+    response, _ = LoadPatternsCommand('{"Red": {"type": "ColorPattern", "color": "#ff0000"}, "Black": '
+                                      '{"type": "NothingPattern"}}').handle(context)
+    assert response.status == CommandResponse.Status.OK
+    assert snapshot.read_patterns() == ['Red', 'Black']
+    assert list(context.pattern_constructors) == ['Red', 'Black']
+
+
+def test_names_that_dont_fit_keep_the_old_ones(snapshot):
+    context = _Context(snapshot)
+    name = 'x' * PATTERN_NAMES_BYTES
+    with pytest.raises(PatternDefinitionError):
+        LoadPatternsCommand(f'{{"{name}": {{"type": "NothingPattern"}}}}').handle(context)
+    assert snapshot.read_patterns() == list(pattern_constructors)
+    assert context.pattern_constructors is pattern_constructors
@@ -0,0 +1,41 @@
+"""
+Production entry point. The strips belong to a single render daemon, and any number of web server workers and
+threads talk to it over a Unix socket (see led_control_v2/daemon.py). Start the daemon, then the server:
+
+    python -m led_control_v2.daemon
+    gunicorn --workers 4 --threads 8 --bind 0.0.0.0:5000 wsgi:app
+
+or with an ASGI server, which runs the app in its thread pool:
+
+    uvicorn --interface wsgi --workers 4 --host 0.0.0.0 --port 5000 wsgi:app
+
+Every worker connects on its first request, and again after the daemon restarted. Every open page streams the
+preview, which holds one of the threads for as long as it's open (see stream_preview in main.py), so allow for
+more threads than pages expected to be open at once. `python main.py` still runs the
+development server with the render loop in a child process.
+"""
+import threading
+from multiprocessing import AuthenticationError
+
+from flask_api import status
+
+import main
+from led_control_v2 import config
+from led_control_v2.daemon import connect_to_daemon
+
+app = main.app
+_connect_lock = threading.Lock()
+
+
+@app.before_request
+def ensure_connected():
+    with _connect_lock:
+        if main.channel is not None and not main.channel.closed:
+            return None
+        # AuthenticationError if the daemon restarted with a new key between reading it and connecting
+        try:
+            main.channel, main.snapshot, main.preview, main.profiler = connect_to_daemon(
+                config.RENDER_DAEMON_ADDRESS, config.RENDER_DAEMON_AUTHKEY)
+        except (FileNotFoundError, ConnectionRefusedError, AuthenticationError):
+            return "Render daemon isn't running", status.HTTP_503_SERVICE_UNAVAILABLE
+    return None